@@ -0,0 +1,214 @@
+"""
+End-to-end benchmarks for get_company_network(), run against chpy.mock
+rather than the real API, so they cost no quota and give the same network
+every time.
+
+    python benchmarks/crawl_benchmark.py
+    python benchmarks/crawl_benchmark.py --depths 1 2 3 --modes sync threads async \
+        --companies 1000 --people 1500 --latency 0.02
+
+A mock server is started in its own process, and each (mode, depth) is run in
+a fresh Python process too, so that CPU time and peak memory are chpy's
+alone and one run can't warm up another. For each run it reports:
+
+    - wall: seconds from start to finish.
+    - calls/node: API calls made per node in the final graph.
+    - CPU time per phase:
+        calls   making API calls and decoding the responses (sync and
+                threads only; async interleaves this with the crawl)
+        crawl   the crawl's own bookkeeping
+        dedupe  fuzzy name matching (fuzz_dict)
+        build   the rest of build_network: dataframes, graph
+        write   writing the outputs
+    - peak RSS: the process's peak resident memory, in MB.
+
+Add --json FILE to save the results, e.g. to compare before and after a
+change.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PHASES = ["calls", "crawl", "dedupe", "build", "write"]
+
+
+def start_server(args):
+    """ Starts chpy.mock in a subprocess. Returns (process, url). """
+    command = [sys.executable, "-m", "chpy.mock",
+               "--companies", str(args.companies),
+               "--people", str(args.people),
+               "--fan-out", str(args.fan_out),
+               "--seed", str(args.seed),
+               "--latency", str(args.latency),
+               "--error-rate", str(args.error_rate),
+               "--limit", "100000000",
+               "--window", "60"]
+    process = subprocess.Popen(command, stdout = subprocess.PIPE, text = True,
+                               cwd = os.path.dirname(HERE))
+    url = process.stdout.readline().strip()
+    return process, url
+
+
+def mock_get(url, path):
+    with urllib.request.urlopen(url + path) as response:
+        return json.loads(response.read())
+
+
+def timed(function, phase, cpu):
+    """ Wraps function so that the CPU time spent in it adds to cpu[phase]. """
+    def wrapper(*args, **kwargs):
+        start = time.process_time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            cpu[phase] += time.process_time() - start
+    return wrapper
+
+
+def run_one(url, depth, mode, workers):
+    """ One crawl, in this process. Returns its results as a dict. """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    import warnings
+    warnings.filterwarnings("ignore")
+
+    import chpy.search as search
+    import chpy.build as build
+    from chpy.transport import Transport, set_transport
+    from chpy.ratelimit import RateLimiter
+
+    search.base_url = url
+    set_transport(Transport(pool_size = max(10, workers),
+                            limiter = RateLimiter(limit = 100000000, window = 60,
+                                                  burst = 100000000)))
+    mock_get(url, "/_mock/reset")
+    root = mock_get(url, "/_mock/stats")['root']
+
+    cpu = dict.fromkeys(PHASES, 0.0)
+    build.fuzz_dict = timed(build.fuzz_dict, "dedupe", cpu)
+    build.write_outputs = timed(build.write_outputs, "write", cpu)
+
+    wall = time.perf_counter()
+    start = time.process_time()
+    crawl = build.start_crawl(root, "benchmark", depth, checkpoint = True)
+    if mode == "async":
+        from chpy.aio import AsyncTransport
+
+        async def go():
+            async with AsyncTransport(concurrency = workers) as transport:
+                return await build.adrive_crawl(crawl, transport)
+        sink = asyncio.run(go())
+    elif mode == "threads":
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            sink = build.drive_crawl(crawl, timed(build.thread_calls(pool), "calls", cpu))
+    else:
+        sink = build.drive_crawl(crawl, timed(build.run_calls, "calls", cpu))
+    sink.close()
+    cpu["crawl"] = time.process_time() - start - cpu["calls"]
+
+    start = time.process_time()
+    G, df, ct = build.build_network(sink, "{}_{}".format(root, depth))
+    cpu["build"] = time.process_time() - start - cpu["dedupe"] - cpu["write"]
+    wall = time.perf_counter() - wall
+
+    calls = mock_get(url, "/_mock/stats")['total']
+    peak = None
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return {"mode" : mode,
+            "depth" : depth,
+            "wall" : wall,
+            "calls" : calls,
+            "nodes" : len(G),
+            "edges" : G.number_of_edges(),
+            "calls_per_node" : calls / max(len(G), 1),
+            "cpu" : cpu,
+            "peak_rss_mb" : peak}
+
+
+def run_child(url, depth, mode, workers):
+    """ Runs one crawl in a fresh process, in a scratch directory. """
+    with tempfile.TemporaryDirectory() as scratch:
+        command = [sys.executable, os.path.abspath(__file__), "--child",
+                   "--url", url, "--depths", str(depth), "--modes", mode,
+                   "--workers", str(workers)]
+        out = subprocess.run(command, cwd = scratch, stdout = subprocess.PIPE,
+                             stderr = subprocess.DEVNULL, text = True, check = True)
+    # The result is the last line, whatever else ends up on stdout.
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def report(results):
+    header = ("mode", "depth", "nodes", "calls", "calls/node", "wall s") + \
+             tuple("{} s".format(p) for p in PHASES) + ("peak MB",)
+    rows = []
+    for r in results:
+        rows.append((r['mode'], r['depth'], r['nodes'], r['calls'],
+                     "{:.2f}".format(r['calls_per_node']), "{:.2f}".format(r['wall']))
+                    + tuple("{:.2f}".format(r['cpu'][p]) for p in PHASES)
+                    + ("-" if r['peak_rss_mb'] is None else "{:.0f}".format(r['peak_rss_mb']),))
+    widths = [max(len(str(row[i])) for row in rows + [header]) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(str(v).rjust(w) for v, w in zip(row, widths)))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--depths", type = int, nargs = "+", default = [1, 2, 3])
+    parser.add_argument("--modes", nargs = "+", default = ["sync"],
+                        choices = ["sync", "threads", "async"])
+    parser.add_argument("--workers", type = int, default = 8,
+                        help = "threads, or calls in flight for async")
+    parser.add_argument("--companies", type = int, default = 200)
+    parser.add_argument("--people", type = int, default = 300)
+    parser.add_argument("--fan-out", type = float, default = 4)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--latency", type = float, default = 0.0,
+                        help = "seconds the mock waits before each response")
+    parser.add_argument("--error-rate", type = float, default = 0.0,
+                        help = "share of calls the mock answers with a 502")
+    parser.add_argument("--json", help = "also write the results here")
+    parser.add_argument("--child", action = "store_true", help = argparse.SUPPRESS)
+    parser.add_argument("--url", help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_one(args.url, args.depths[0], args.modes[0], args.workers)))
+        return
+
+    server, url = start_server(args)
+    try:
+        results = []
+        for mode in args.modes:
+            for depth in args.depths:
+                results.append(run_child(url, depth, mode, args.workers))
+                print("{} depth {}: {:.2f}s".format(mode, depth, results[-1]['wall']),
+                      file = sys.stderr)
+    finally:
+        server.terminate()
+        server.wait()
+
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args" : vars(args), "results" : results}, f, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
 # __init__.py
 
+import logging
+
 # Version of the chpy package
 name = "chpy"
 __version__ = "0.1.1"
+
+# chpy reports its progress through logging; showing it is up to the caller.
+logging.getLogger(__name__).addHandler(logging.NullHandler())
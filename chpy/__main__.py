@@ -0,0 +1,5 @@
+import sys
+
+from chpy.cli import main
+
+sys.exit(main())
@@ -0,0 +1,344 @@
+import asyncio
+import base64
+import collections
+import logging
+import threading
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from chpy.utils import *
+from chpy.search import *
+from chpy.transport import get_transport, retry_on_another_key, RETRY_STATUSES, MIN_RATE_LIMIT_WAIT
+from chpy.metrics import emit, endpoint_name
+from chpy.records import loads, from_response
+
+"""
+asyncio counterparts to the API calls in chpy.search, used by
+chpy.build.aget_company_network().
+
+Each function mirrors its namesake in chpy.search (get_company ->
+aget_company, and so on) and returns exactly the same data, but makes its
+calls through an AsyncTransport so that many can be in flight at once. The
+AsyncTransport borrows its rate limiters, key pools, cache, snapshot store,
+memo and retry settings from a normal Transport, so sync and async calls made in
+the same session draw on the same budget.
+
+Needs aiohttp (pip install aiohttp).
+"""
+
+logger = logging.getLogger(__name__)
+
+AsyncResponse = collections.namedtuple('AsyncResponse',
+                                       ['status_code', 'headers', 'body'])
+
+
+class AsyncTransport(object):
+    """
+    An aiohttp-based transport.
+
+    Arguments:
+        - concurrency: most requests in flight at once. Requests waiting on
+          the rate limiter count towards this, so it bounds the backlog too.
+        - transport: the Transport whose limiters, key pools, cache,
+          timeouts and retry settings are used; the shared one by default.
+
+    Use it as an async context manager, or call close() when done:
+
+        async with AsyncTransport() as t:
+            profile = await aget_company("00000006", "profile", api_key,
+                                         transport = t)
+    """
+
+    def __init__(self, concurrency = 8, transport = None):
+        if aiohttp is None:
+            raise ImportError("chpy's async functions need aiohttp: "
+                              "pip install aiohttp")
+        self.concurrency = concurrency
+        self.transport = transport if transport is not None else get_transport()
+        self._semaphore = None
+        self._session = None
+
+    @property
+    def cache(self):
+        return self.transport.cache
+
+    @property
+    def snapshot(self):
+        return self.transport.snapshot
+
+    @property
+    def memo(self):
+        return self.transport.memo
+
+    @property
+    def compact(self):
+        return self.transport.compact
+
+    def session(self):
+        if self._session is None:
+            timeout = self.transport.timeout
+            connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit = self.concurrency),
+                timeout = aiohttp.ClientTimeout(sock_connect = connect,
+                                                sock_read = read))
+        return self._session
+
+    async def get(self, url, api_key):
+        """
+        As Transport.get(), returning an AsyncResponse (status_code, headers,
+        body) or None if no response was ever received.
+        """
+        session = self.session()
+        pool = self.transport.key_pool(api_key)
+        max_retries = self.transport.max_retries
+        endpoint = endpoint_name(url)
+        response = None
+        for attempt in range(max_retries + 1):
+            async with self._semaphore:
+                start = time.perf_counter()
+                key = await pool.aacquire()
+                waited = time.perf_counter() - start
+                if waited > MIN_RATE_LIMIT_WAIT:
+                    emit("rate_limit_wait", seconds = waited)
+
+                auth = {"Authorization" : basic_auth(key)}
+                start = time.perf_counter()
+                try:
+                    async with session.get(url, headers = auth) as r:
+                        response = AsyncResponse(r.status, r.headers, await r.read())
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    response = None
+                else:
+                    pool.update(key, response)
+                status = None if response is None else response.status_code
+                emit("request", endpoint = endpoint, status = status,
+                     latency = time.perf_counter() - start)
+
+            if response is None:
+                pass
+            elif retry_on_another_key(pool, key, response):
+                emit("retry", endpoint = endpoint, status = status, wait = 0.0)
+                continue
+            elif response.status_code not in RETRY_STATUSES:
+                return response
+
+            if attempt < max_retries:
+                wait = self.transport.backoff_time(attempt, response)
+                emit("retry", endpoint = endpoint, status = status, wait = wait)
+                await asyncio.sleep(wait)
+
+        return response
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def basic_auth(key):
+    """ The Authorization header requests sends for auth = (key, ""). """
+    return "Basic " + base64.b64encode("{}:".format(key).encode("latin1")).decode("ascii")
+
+
+def run_async(coro):
+    """
+    Runs a coroutine to completion from synchronous code and returns its
+    result. If an event loop is already running in this thread (as it is in
+    Jupyter), the coroutine is run on a fresh loop in a helper thread, so this
+    works there too -- though in a notebook you can simply `await` it.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    out = {}
+    def runner():
+        try:
+            out['result'] = asyncio.run(coro)
+        except BaseException as e:
+            out['error'] = e
+    thread = threading.Thread(target = runner)
+    thread.start()
+    thread.join()
+    if 'error' in out:
+        raise out['error']
+    return out['result']
+
+
+async def aget_generic(url, api_key, *, transport):
+    """ Async get_generic(). """
+    memo = transport.memo
+    if memo is not None:
+        data = await memo.aget(url, lambda: afetch_generic(url, api_key, transport))
+    else:
+        data = (await afetch_generic(url, api_key, transport))[1]
+    if transport.compact:
+        return from_response(url, data)
+    return data
+
+
+async def afetch_generic(url, api_key, transport):
+    """
+    Async fetch_generic(). The snapshot and cache are SQLite underneath, so
+    they're looked up (and the cache filled) on the loop's default executor
+    rather than holding up every other call in flight.
+    """
+    loop = asyncio.get_running_loop()
+    snapshot = transport.snapshot
+    if snapshot is not None:
+        hit, local = await loop.run_in_executor(None, snapshot.get, url)
+        emit("lookup", source = "snapshot", endpoint = endpoint_name(url), hit = hit)
+        if hit:
+            return (404 if local is None else 200), local
+
+    cache = transport.cache
+    if cache is not None:
+        hit, cached = await loop.run_in_executor(None, cache.get, url)
+        emit("lookup", source = "cache", endpoint = endpoint_name(url), hit = hit)
+        if hit:
+            return (404 if cached is None else 200), cached
+
+    data = await transport.get(url, api_key)
+    if data is None:
+        return None, None
+
+    if data.status_code == 200:
+        try:
+            out = loads(data.body)
+        except ValueError:
+            return None, None
+        if cache is not None:
+            await loop.run_in_executor(None, cache.set, url, 200, out)
+        return 200, out
+    elif data.status_code == 404:
+        if cache is not None:
+            await loop.run_in_executor(None, cache.set, url, 404, None)
+        return 404, None
+    else:
+        return data.status_code, None
+
+
+async def aget_company(number, search_type, api_key, iteration = None, *, transport):
+    """ Async get_company(). """
+    url = company_url(number, search_type)
+    if url is None:
+        logger.warning("Please specify 'profile', 'officers', or 'psc'")
+        return
+
+    data = await aget_generic(url, api_key, transport = transport)
+    return mark_company_data(data, search_type, iteration = iteration)
+
+
+async def aget_search_officers(string,
+                               api_key,
+                               items_per_page = 100,
+                               start_index = 0,
+                               *,
+                               transport):
+    """ Async get_search_officers(). """
+    url = officer_search_url(string, items_per_page, start_index)
+    return await aget_generic(url, api_key, transport = transport)
+
+
+async def aget_officer_appointments(uri,
+                                    api_key,
+                                    items_per_page = 100,
+                                    start_index = 0,
+                                    *,
+                                    transport):
+    """ Async get_officer_appointments(). """
+    url = officer_appointments_url(uri, items_per_page, start_index)
+    return await aget_generic(url, api_key, transport = transport)
+
+
+async def aget_company_search(string, api_key, *, transport):
+    """ Async get_company_search(). """
+    url = company_search_url(string)
+    return await aget_generic(url, api_key, transport = transport)
+
+
+async def apaginate_search(in_data,
+                           search_type,
+                           api_key,
+                           start_index = 0,
+                           items_per_page = 100,
+                           prefetch = True,
+                           max_pages = None,
+                           *,
+                           transport):
+    """
+    Async paginate_search(), driving the same walk_pages(), so the output is
+    identical. Pages are fetched ahead as tasks on the running loop.
+    """
+    if search_type == "search":
+        query = in_data['name']
+        fetch = aget_search_officers
+    elif search_type == "appointments":
+        query = get_officer_uid(in_data)
+        fetch = aget_officer_appointments
+    else:
+        logger.warning("Please specify 'search' or 'appointments'")
+        return
+
+    walk = walk_pages(in_data, search_type, start_index, items_per_page, max_pages)
+    ahead = {}
+    try:
+        request, arg = next(walk)
+        while True:
+            if request == "ahead":
+                for start in arg if prefetch else ():
+                    if start not in ahead:
+                        ahead[start] = asyncio.ensure_future(
+                            fetch(query, api_key, items_per_page, start, transport = transport))
+                request, arg = walk.send(None)
+            elif arg in ahead:
+                request, arg = walk.send(await ahead.pop(arg))
+            else:
+                request, arg = walk.send(await fetch(query, api_key, items_per_page, arg,
+                                                     transport = transport))
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        for task in ahead.values():
+            task.cancel()
+
+
+async def aget_appointments(node, api_key, iteration = 0, search = True, skip = (),
+                            found = None, *, transport):
+    """
+    Async get_appointments(), driving the same walk_appointments(). The
+    appointment lists for every search hit are fetched concurrently.
+    """
+    snapshot = transport.snapshot
+    walk = walk_appointments(node, iteration, search, skip, found, snapshot)
+    loop = asyncio.get_running_loop()
+    try:
+        request, arg = next(walk)
+        while True:
+            try:
+                if request == "psc":
+                    result = await loop.run_in_executor(None, snapshot.psc_appointments, arg)
+                else:
+                    result = await asyncio.gather(*[apaginate_search(record, search_type, api_key,
+                                                                     max_pages = max_pages,
+                                                                     transport = transport)
+                                                    for record, search_type, max_pages in arg])
+            except Exception as e:
+                request, arg = walk.throw(e)
+            else:
+                request, arg = walk.send(result)
+    except StopIteration as stop:
+        return stop.value
@@ -1,64 +1,464 @@
+import collections
+import hashlib
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 # import progressbar
 import networkx as nx
 from fuzzywuzzy import fuzz
 import pandas as pd
+# Not used here, but `from chpy.build import *` has always brought it in.
+from pandas.io.json import json_normalize
 
 from chpy.utils import *
 from chpy.search import *
 from chpy.networks import *
-
-def get_company_network(company_number, api_key, depth):
-    ## Initial definitions for appending later
-    edge_table = []
-    dup_list = []
-    psc_table = []
-    company_table = []
-    appointments = []
-
-    # Search for profile of the root company and append to company_table
-    root_company = get_company(company_number, "profile", api_key, iteration = 0)
-    company_table.append(root_company)
-
-    # Begin pulling down the network
-    print("Building network for {}".format(root_company['name']))
+from chpy.checkpoint import *
+from chpy.sink import *
+from chpy.export import *
+from chpy.metrics import *
+from chpy.memo import RequestMemo, crawl_memo
+from chpy.frontier import *
+from chpy.identity import IdentityResolver
+from chpy.records import is_record
+from chpy.frames import company_frame, edge_frame, clean_names
+
+logger = logging.getLogger(__name__)
+
+def get_company_network(company_number, api_key, depth,
+                        workers = None,
+                        checkpoint = True,
+                        resume = False,
+                        output_formats = DEFAULT_FORMATS,
+                        max_calls = None,
+                        max_nodes = None,
+                        max_time = None,
+                        priority = None,
+                        resolve_ids = False):
+    """
+    Builds a network of companies, officers and pscs out from a company
+    number, to the given depth. Returns a networkx MultiDiGraph, an edge list
+    and a company table, and writes them to ./data/{company_number}_{depth}/
+    in each of output_formats (CSV and GEXF by default; see chpy.export for
+    Parquet, Feather and compressed graphs). See the README for more on how it
+    works.
+
+    With workers set, the independent calls within each depth iteration
+    (officers, pscs, appointment searches, company searches and profiles)
+    are spread over a pool of that many threads, all sharing one Transport
+    and so one connection pool and rate limiter. Output is the same either
+    way.
+
+    Everything found is written to ./data/{company_number}_{depth}/stream/
+    as the crawl goes, rather than held in memory (see chpy.sink), and the
+    outputs are built from there at the end. What is held in memory is the
+    crawl's RequestMemo (see chpy.memo): the answer to every call, so none
+    is made twice, a few KB apiece up to its limit of 50,000 answers.
+
+    Unless checkpoint is False, the state of the crawl is saved as it goes
+    (see chpy.checkpoint). If a crawl dies, run it again with resume = True
+    and it will carry on from the last checkpoint rather than starting over.
+
+    max_calls, max_nodes and max_time (in seconds) put a budget on the crawl,
+    which stops cleanly once any is spent and returns what it found, so depth
+    can be set higher than would otherwise be safe. Within each depth,
+    companies are expanded in the order given by priority: "fewest_hops"
+    (the default), "most_links", "active_first" or a function of your own.
+    See chpy.frontier.
+
+    With resolve_ids, officers are followed by their ids rather than
+    searched for by name, and nobody the crawl has already met is looked up
+    again (see chpy.identity). Far fewer calls, but only the appointments
+    the crawl can reach by id are found.
+
+    company_number can also be a list of them, to crawl from all of them at
+    once; see get_companies_network().
+    """
+    output_formats = check_formats(output_formats)
+    budget = Budget(max_calls, max_nodes, max_time)
+    crawl = start_crawl(company_number, api_key, depth, checkpoint, resume,
+                        budget = budget,
+                        priority = get_priority(priority),
+                        resolve_ids = resolve_ids)
+    try:
+        if workers:
+            with ThreadPoolExecutor(max_workers = workers) as pool:
+                sink = drive_crawl(crawl, thread_calls(pool))
+        else:
+            sink = drive_crawl(crawl, run_calls)
+    finally:
+        budget.stop()
+    sink.close()
+    return build_network(sink, crawl_id(company_number, depth), output_formats,
+                         roots = crawl_roots(company_number), depth = depth)
+
+async def aget_company_network(company_number, api_key, depth,
+                               concurrency = 8,
+                               transport = None,
+                               checkpoint = True,
+                               resume = False,
+                               output_formats = DEFAULT_FORMATS,
+                               max_calls = None,
+                               max_nodes = None,
+                               max_time = None,
+                               priority = None,
+                               resolve_ids = False):
+    """
+    asyncio version of get_company_network(), with the same output. Every
+    independent call within a depth iteration is made concurrently, up to
+    `concurrency` at a time, through an AsyncTransport (see chpy.aio) that
+    shares its rate limiting with the rest of chpy.
+
+    In Jupyter, which already has an event loop running, just await it:
+
+        graph, edge_list, company_table = await aget_company_network(...)
+
+    From a script, use asyncio.run() or chpy.aio.run_async(). checkpoint,
+    resume, output_formats, the budget (max_calls, max_nodes, max_time),
+    priority and resolve_ids work as they do for get_company_network().
+    """
+    output_formats = check_formats(output_formats)
+    priority = get_priority(priority)
+    own_transport = transport is None
+    if own_transport:
+        # chpy.aio (and aiohttp) are only imported for async crawls.
+        from chpy.aio import AsyncTransport
+        transport = AsyncTransport(concurrency = concurrency)
+    budget = Budget(max_calls, max_nodes, max_time)
+    try:
+        crawl = start_crawl(company_number, api_key, depth, checkpoint, resume,
+                            budget = budget,
+                            priority = priority,
+                            resolve_ids = resolve_ids)
+        sink = await adrive_crawl(crawl, transport)
+    finally:
+        budget.stop()
+        if own_transport:
+            await transport.close()
+    sink.close()
+    return build_network(sink, crawl_id(company_number, depth), output_formats,
+                         roots = crawl_roots(company_number), depth = depth)
+
+def get_companies_network(company_numbers, api_key, depth, **kwargs):
+    """
+    As get_company_network(), but building one network out from several
+    companies at once -- a portfolio, say -- rather than one per company.
+
+    The crawl starts with every root company in its frontier, and shares
+    what it's visited, and everything it's fetched, between them, so where
+    their networks overlap nothing is fetched twice: API calls go with the
+    size of the networks put together, not their sum. Names are
+    de-duplicated across the lot, once, and there's one graph, edge list and
+    company table, written to ./data/batch_{id}_{depth}/ (see crawl_id()).
+
+    Each node in the graph has a 'roots' attribute, and each company in the
+    company table a 'roots' column: the root companies, by number and
+    separated by ";", whose own network to the same depth it falls in.
+
+    Takes the same keyword arguments as get_company_network(). A budget
+    applies to the crawl as a whole. As in any crawl, each name is only
+    searched for once, so the network can come out a little different from
+    those of separate crawls put together.
+    """
+    if not isinstance(company_numbers, (list, tuple, set)):
+        company_numbers = [company_numbers]
+    return get_company_network(crawl_roots(company_numbers), api_key, depth, **kwargs)
+
+async def aget_companies_network(company_numbers, api_key, depth, **kwargs):
+    """
+    asyncio version of get_companies_network(), taking the same keyword
+    arguments as aget_company_network().
+    """
+    if not isinstance(company_numbers, (list, tuple, set)):
+        company_numbers = [company_numbers]
+    return await aget_company_network(crawl_roots(company_numbers), api_key, depth, **kwargs)
+
+'''
+The crawl itself is written as a generator, so that one copy of the logic can
+be driven one call at a time, from a thread pool (get_company_network) or with
+everything in a batch running at once (aget_company_network). It yields
+batches of calls, as (function, args, kwargs) tuples of chpy.search
+functions, and is sent back their results in the same order. All the
+bookkeeping (visited sets and so on) happens between batches, in a fixed
+order, so the output doesn't depend on which call in a batch happens to finish
+first.
+'''
+
+def crawl_roots(company_number):
+    """
+    None for a single company number, as a str or int. Otherwise, for
+    several (a list, tuple or set), a list of them as strs, without repeats.
+    """
+    if not isinstance(company_number, (list, tuple, set)):
+        return None
+    roots = list(dict.fromkeys(str(n) for n in company_number))
+    if not roots:
+        raise ValueError("No company numbers to crawl from")
+    return roots
+
+def crawl_id(company_number, depth):
+    """
+    The name of a crawl's directory in ./data/: {company_number}_{depth}
+    for one company, and for several batch_{id}_{depth}, where id is a hash
+    of their numbers, in order.
+    """
+    roots = crawl_roots(company_number)
+    if roots is None:
+        return "{}_{}".format(company_number, depth)
+    digest = hashlib.blake2b(",".join(roots).encode(), digest_size = 5).hexdigest()
+    return "batch_{}_{}".format(digest, depth)
+
+def start_crawl(company_number, api_key, depth, checkpoint = True, resume = False,
+                budget = None, priority = None, resolve_ids = False):
+    """
+    Sets up crawl_network(), saving checkpoints to and (if resuming) loading
+    the state from ./data/{file_id}/checkpoint/, where file_id is
+    crawl_id(company_number, depth). The streams in ./data/{file_id}/stream/
+    are cut back to where that checkpoint left them, or emptied if starting
+    afresh. budget and priority are passed on to crawl_network(), along with
+    an IdentityResolver if resolve_ids is set.
+    """
+    file_id = crawl_id(company_number, depth)
+    path = checkpoint_path(file_id)
+    state = load_checkpoint(path) if resume else None
+    sink = CrawlSink(stream_path(file_id),
+                     counts = state.get('written') if state is not None else None)
+    if state is not None:
+        sink.expanded = state['expanded']
+        state['edge_keys'] = set(edge_key(i) for i in sink.read("edges"))
+        state['nodes'] = crawl_nodes(sink)
+    save = (lambda state: save_checkpoint(state, path)) if checkpoint else None
+    return crawl_network(company_number, api_key, depth,
+                         state = state, checkpoint = save, sink = sink,
+                         budget = budget, priority = priority,
+                         resolver = IdentityResolver() if resolve_ids else None)
+
+def crawl_nodes(sink):
+    """
+    The names of every officer, psc and company in a sink's edges and psc
+    lists, as counted against a Budget's max_nodes.
+    """
+    nodes = set()
+    for item in sink.read("edges"):
+        if type(item) == dict:
+            nodes.update((item.get('source'), item.get('target')))
+    for psc in sink.read("pscs"):
+        if type(psc) == dict:
+            nodes.update(p.get('name') for p in psc.get('items') or [])
+    nodes.discard(None)
+    return nodes
+
+def run_calls(calls):
+    """ Runs a batch of calls from crawl_network() one after the other. """
+    return [function(*args, **kwargs) for function, args, kwargs in calls]
+
+def thread_calls(pool):
+    """
+    Returns a function that runs a batch of calls from crawl_network() on a
+    concurrent.futures pool, with results in the order the calls were given.
+    """
+    def run(calls):
+        return list(pool.map(lambda call: call[0](*call[1], **call[2]), calls))
+    return run
+
+def drive_crawl(crawl, run):
+    """
+    Feeds crawl_network() the results of each batch of calls, as run by
+    run(), and returns whatever the crawl returns. The shared Transport is
+    given a RequestMemo for the crawl (see chpy.memo), so nothing is
+    fetched twice.
+    """
+    results = None
+    with crawl_memo(get_transport()):
+        try:
+            while True:
+                results = run(crawl.send(results))
+        except StopIteration as stop:
+            return stop.value
+
+async def adrive_crawl(crawl, transport):
+    """
+    As drive_crawl(), but running each batch concurrently through an
+    AsyncTransport, whose Transport gets the RequestMemo.
+    """
+    import asyncio
+    from chpy.aio import aget_company, aget_company_search, aget_appointments
+
+    # The async version of each function the crawl calls.
+    async_calls = {get_company : aget_company,
+                   get_company_search : aget_company_search,
+                   get_appointments : aget_appointments}
+    results = None
+    with crawl_memo(transport.transport):
+        try:
+            while True:
+                calls = crawl.send(results)
+                results = await asyncio.gather(*[async_calls[function](*args,
+                                                                       transport = transport,
+                                                                       **kwargs)
+                                                 for function, args, kwargs in calls])
+        except StopIteration as stop:
+            return stop.value
+
+def crawl_network(company_number, api_key, depth,
+                  state = None,
+                  checkpoint = None,
+                  chunk_size = 50,
+                  sink = None,
+                  budget = None,
+                  priority = None,
+                  resolver = None):
+    """
+    The crawl behind get_company_network(), as a generator (see above).
+    Edges, psc lists and company profiles are handed to sink (a CrawlSink,
+    see chpy.sink; one in ./data/{crawl_id()}/stream/ by default) as they're
+    found, and the sink is returned at the end.
+
+    company_number may be a list of them, as for get_companies_network():
+    the crawl then starts from all of them at once, and none of them is
+    taken on again if it's found from another.
+
+    Everything else the crawl knows lives in one state dict (see
+    chpy.checkpoint), which is handed to checkpoint() every time a chunk of
+    chunk_size companies is finished and at the end of each depth iteration.
+    Passing a saved state back in, with the sink it was saved with, picks the
+    crawl up from there.
+
+    Each depth iteration's companies are expanded in the order given by
+    priority, and the crawl stops early, between chunks, once budget (a
+    chpy.frontier.Budget) is spent. See chpy.frontier.
+
+    With a resolver (a chpy.identity.IdentityResolver), it decides which
+    appointment lookups are needed, and how. It isn't checkpointed: a
+    resumed crawl starts with a fresh one.
+    """
+    if sink is None:
+        sink = CrawlSink(stream_path(crawl_id(company_number, depth)))
+    priority = get_priority(priority)
+    if budget is None:
+        budget = Budget()
+    roots = crawl_roots(company_number)
+    budget.start(None if state is None else state['spent'])
+
+    if state is None:
+        # Search for profile of the root company and append to company_table
+        root_companies = yield [(get_company, (number, "profile", api_key),
+                                 {'iteration' : 0})
+                                for number in roots or [company_number]]
+        if roots is not None:
+            for number, company in zip(roots, root_companies):
+                if not is_record(company):
+                    logger.warning("Couldn't find %s; leaving it out", number)
+            root_companies = [c for c in root_companies if is_record(c)]
+            if not root_companies:
+                raise ValueError("None of the companies to crawl from were found")
+        state = new_crawl_state(company_number, depth, root_companies)
+        for root_company in root_companies:
+            root_company['_index'] = sink.add("companies", root_company)
+        if roots is not None:
+            state['visited']['companies'].update(roots)
+
+        # Begin pulling down the network
+        if roots is None:
+            logger.info("Building network for %s", root_companies[0]['name'])
+        else:
+            logger.info("Building network for %s companies", len(root_companies))
+    else:
+        logger.info("Resuming network for %s at iteration %s",
+                    next(sink.read("companies"))['name'], state['depth_it'] + 1)
+
+    edge_keys = state['edge_keys']
+    nodes = state['nodes']
+    visited = state['visited']
+    links = state['links']
+    company_table = state['company_table']
+    next_companies = state['next_companies']
+    state['stopped'] = None
+
+    def spend():
+        nodes.discard(None)
+        return budget.spent(len(nodes))
+
+    def appointments_call(record, it):
+        # The get_appointments() call for a record, or None if the resolver
+        # says there's no need.
+        if resolver is None:
+            return (get_appointments, (record, api_key), it)
+        extra = resolver.plan(record)
+        if extra is None:
+            return None
+        return (get_appointments, (record, api_key), dict(it, **extra))
+
+    def save():
+        # Flushed every time, so that the streams can be read mid-crawl.
+        sink.flush()
+        state['written'] = dict(sink.counts)
+        state['expanded'] = sink.expanded
+        state['spent'] = spend()
+        if checkpoint is not None:
+            checkpoint(state)
 
     # Outer loop for depth
-    for depth_it in range(depth):
-        print("Iteration: {} of {}".format(depth_it + 1, depth))
-        companies = []
-
-        # Loop through all companies in the company_table
-        for n, company in enumerate(company_table):
-            # If not already done:
-            if company.get('done') != True:
-
-                # Pull officers, pscs and appointments for company
-                print("Getting officers, pscs and appointments for {}"
-                      .format(company['company_name']))
-                officers = get_company(company['company_number'],
-                                       "officers", api_key,
-                                       iteration = depth_it)
-                psc = get_company(company['company_number'],
-                                  "psc", api_key, iteration = depth_it)
-                psc_table.append(psc)
-
-                '''
-                # I'm not sure if there is some duplicate duplication checking,
-                but at this stage I can't be bothered to re-write. Here we chain
-                a number of functions in chpy.search to retrun a filtered list of
-                appointments from a company name, officer list and psc list'''
-
-                if company['name'] not in dup_list:
-                    dup_list.append(company['name'])
-                    appointments.append(get_appointments(company,
-                                                         api_key,
-                                                         iteration = depth_it))
-
-
-                print("Getting officer appointments for {}"
-                      .format(company['company_name']))
-                officers = [i for i in officers['items']]
+    while state['depth_it'] < depth:
+        depth_it = state['depth_it']
+        logger.info("Iteration: %s of %s", depth_it + 1, depth)
+        it = {'iteration' : depth_it}
+
+        # All the companies in the company_table not already done, most
+        # important first.
+        company_table.sort(key = lambda company: priority(company, links))
+        pending = list(company_table)
+        emit("frontier", depth = depth_it, size = len(pending))
+
+        start = 0
+        while start < len(pending):
+            # Stop if the budget's spent, and otherwise take as many
+            # companies as it looks like it'll stretch to.
+            spent = spend()
+            stopped = budget.exhausted(spent)
+            if stopped is not None:
+                logger.info("Stopping: the crawl's %s budget is spent (%s)",
+                            stopped, spent[stopped])
+                state['stopped'] = stopped
+                save()
+                budget.stop()
+                emit("stopped", limit = stopped, spent = spent)
+                return sink
+            size = budget.companies_left(spent, len(sink.expanded), chunk_size)
+            chunk = pending[start:start + size]
+
+            # Pull officers and pscs for every company in the chunk at once
+            logger.info("Getting officers and pscs for companies %s-%s of %s",
+                        start + 1, start + len(chunk), len(pending))
+            fetched = yield [call for company in chunk for call in
+                             [(get_company, (company['company_number'], "officers", api_key), it),
+                              (get_company, (company['company_number'], "psc", api_key), it)]]
+
+            '''
+            Then work out what else each company needs. Everything that needs
+            fetching goes into `calls`, and each company gets a plan of its
+            edges in order: officer records as they are, and appointment
+            searches as the index of the call that will return them.
+            '''
+            calls = []
+            plans = []
+            for n, company in enumerate(chunk):
+                officers, psc = fetched[2 * n], fetched[2 * n + 1]
+                sink.add("pscs", psc)
+                if type(psc) == dict:
+                    nodes.update(p.get('name') for p in psc.get('items') or [])
+                plan = {'company' : company, 'edges' : [], 'searches' : []}
+                plans.append(plan)
+
+                # Appointment searches go by name, so names are what we check.
+                if company['name'] not in visited['names']:
+                    visited['names'].add(company['name'])
+                    call = appointments_call(company, it)
+                    if call is not None:
+                        plan['edges'].append(len(calls))
+                        calls.append(call)
+
+                officers = [i for i in (officers or {}).get('items', [])]
                 for officer in officers:
                     '''
                     If the officer is a company, we check if it appears in the
@@ -70,109 +470,151 @@ def get_company_network(company_number, api_key, depth):
                     examination in a later pass.
                     '''
                     if human_check(officer['name']) == "Corporate":
-                        company_searched = get_company_search(officer['name'], api_key)
-                        try:
-                            searched_name = company_searched['items'][0]['title']
-                        except (IndexError, TypeError, KeyError) as e:
-                            searched_name = False
-
-                        if searched_name == officer['name']:
-                            searched_num = company_searched['items'][0]['company_number']
-                            companies.append(get_company(searched_num, "profile",
-                                             api_key, iteration = depth_it))
-                            dup_list.append(searched_num)
+                        plan['searches'].append((officer['name'], len(calls)))
+                        calls.append((get_company_search, (officer['name'], api_key), {}))
                     '''
                     Add officer records to the edge_table because sometimes the
                     appointment search misses things.
                     '''
                     officer['source'] = officer['name']
                     officer['target'] = company['name']
-                    appointments.append(officer)
-
-                    '''
-                    Then we pull each officer's appointments
-                    '''
-                    if officer['name'] not in dup_list:
-                        dup_list.append(officer['name'])
-                        appointments.append(get_appointments(officer,
-                                                             api_key,
-                                                             iteration = depth_it))
-
-                if type(psc) == list or type(psc) == dict:
-                    psc = [i for i in psc['items']]
-                    print("Getting psc appointments for {}"
-                          .format(company['company_name']))
-                    for p in psc:
-                        if p['name'] not in dup_list:
-                            dup_list.append(p['name'])
-                            appointments.append(get_appointments(p, api_key,
-                                                                 iteration = depth_it))
+                    plan['edges'].append(officer)
+
+                    # Then we pull each officer's appointments
+                    officer_uid = get_officer_id(officer)
+                    if (officer['name'] not in visited['names']
+                        and officer_uid not in visited['officers']):
+                        visited['names'].add(officer['name'])
+                        if officer_uid is not None:
+                            visited['officers'].add(officer_uid)
+                        call = appointments_call(officer, it)
+                        if call is not None:
+                            plan['edges'].append(len(calls))
+                            calls.append(call)
+
+                if type(psc) == dict:
+                    for p in psc.get('items', []):
+                        psc_link = (p.get('links') or {}).get('self')
+                        if (p['name'] not in visited['names']
+                            and psc_link not in visited['pscs']):
+                            visited['names'].add(p['name'])
+                            if psc_link is not None:
+                                visited['pscs'].add(psc_link)
+                            call = appointments_call(p, it)
+                            if call is not None:
+                                plan['edges'].append(len(calls))
+                                calls.append(call)
                 else:
-                    print("No PSC found")
+                    logger.debug("No PSC found for %s", company['company_name'])
+
+            logger.info("Getting officer and psc appointments")
+            results = yield calls
+            if resolver is not None:
+                resolver.settle()
+
+            '''
+            From all the appointments found, we pick out the next companies,
+            to be added to the company_table at the end of the iteration
+            cycle, and write out the edges.
+            '''
+            logger.info("Pulling next companies from appointments")
+            numbers = []
+            found = collections.Counter()
+            for plan in plans:
+                for name, i in plan['searches']:
+                    company_searched = results[i]
+                    try:
+                        searched_name = company_searched['items'][0]['title']
+                    except (IndexError, TypeError, KeyError) as e:
+                        searched_name = False
 
-                # Messy and slow, but needed to filter out any hicoughs that arise.
-                appointments = [i for i in flatten(appointments) if type(i) == dict]
+                    if searched_name == name:
+                        searched_num = company_searched['items'][0]['company_number']
+                        if searched_num not in visited['companies']:
+                            visited['companies'].add(searched_num)
+                            numbers.append(searched_num)
 
-                '''
-                From all the appointments found, we update a temporary
-                companies list to be appended at the end of the iteration cycle.
-                '''
+                # Messy, but needed to filter out any hicoughs that arise.
+                appointments = [results[i] if type(i) == int else i for i in plan['edges']]
+                appointments = [i for i in flatten(appointments) if is_record(i)]
 
-                print("Pulling next companies from appointments")
                 for appointment in appointments:
                     try:
                         app_num = appointment['appointed_to']['company_number']
                     except (KeyError, TypeError) as e:
                         continue
-                    if app_num not in dup_list:
-                        companies.append(get_company(app_num, "profile",
-                                         api_key, iteration = depth_it))
-                        dup_list.append(app_num)
-
-                '''
-                Finally, we update the edge_table with all the appointments from
-                above. Could be earlier in the function, I guess. Things to look
-                at another time.
-                '''
+                    links[app_num] = links.get(app_num, 0) + 1
+                    if app_num not in visited['companies']:
+                        numbers.append(app_num)
+                        visited['companies'].add(app_num)
 
+                # Hashed, rather than scanning the whole edge_table each time.
                 for item in appointments:
-                    if item not in edge_table : edge_table.append(item)
-
-                # So we don't do the same company twice.
-                company['done'] = True
+                    key = edge_key(item)
+                    if key not in edge_keys:
+                        edge_keys.add(key)
+                        sink.add("edges", item)
+                        nodes.update((item.get('source'), item.get('target')))
+                        found['accepted'] += 1
+                    else:
+                        found['rejected'] += 1
+
+            emit("edges", accepted = found['accepted'], rejected = found['rejected'])
+            companies = yield [(get_company, (number, "profile", api_key), it)
+                               for number in numbers]
+            for company in companies:
+                if is_record(company):
+                    next_companies.append(company)
+                    company['_index'] = sink.add("companies", company)
+
+            # So we don't do the same company twice.
+            del company_table[:len(chunk)]
+            sink.expanded.update(company['_index'] for company in chunk)
+            start += len(chunk)
+            save()
 
         '''
         When all the companies in the iteration are done, we update the
         company_table for the next round.
         '''
-        company_table.append(companies)
-        company_table = [i for i in flatten(company_table) if type(i) == dict]
-
-
+        company_table += next_companies
+        del next_companies[:]
+        state['depth_it'] += 1
+        save()
+
+    budget.stop()
+    return sink
+
+def read_company_table(sink):
+    """
+    The company table as the crawl saw it: every company written to the sink,
+    in order, with the ones the crawl expanded marked 'done'.
+    """
+    for n, company in enumerate(sink.read("companies")):
+        if n in sink.expanded:
+            company['done'] = True
+        yield company
+
+def build_network(sink, file_id, output_formats = DEFAULT_FORMATS, roots = None, depth = None):
+    """
+    Turns the output of crawl_network(), read back from its sink, into a
+    graph, edge list and company table, and writes them to ./data/{file_id}/
+    in each of output_formats (see chpy.export).
+
+    Given the root company numbers of a crawl from several, and its depth,
+    each node and company is marked with the roots that reach it (see
+    chpy.networks.root_provenance()).
+    """
     '''
     Still a little messy, this bit, but following the pull, we dump the output
     to dataframes and export to csv and gexf.
     '''
 
-    # Step one, build the dataframes we need.
-    df = json_normalize([i for i in flatten(edge_table) if type(i) == dict])
-    df['company_name'] = df['appointed_to.company_name']
-    df['company_number'] = df['appointed_to.company_number']
-
-    ct = json_normalize(company_table)
-    psc_df = json_normalize([a for a in flatten([i.get('items')
-                             for i in flatten(psc_table)
-                             if type(i) == dict
-                             and i.get('items') != None])])
-
-    # Bring the fields in the psc dataframe in line with the others
-    if len(psc_df) > 0:
-        psc_df['company_number'] = psc_df['links.self'].apply(lambda x: x.split("/")[2])
-        psc_df = pd.merge(psc_df, ct[['company_number', 'company_name']],
-                          on = 'company_number', how = "left")
-
-        # Merge pscs with the main df
-        df = pd.concat([df, psc_df], sort = True)
+    # Step one, build the dataframes we need, a record at a time straight
+    # from the streams (see chpy.frames). pscs get their company's number
+    # and name, and every row its target, on the way in.
+    ct = company_frame(read_company_table(sink))
+    df, names = edge_frame(sink.read("edges"), sink.read("pscs"), ct)
 
     '''
     We need the names of appointees to be consistent when we build our network.
@@ -184,27 +626,22 @@ def get_company_network(company_number, api_key, depth):
     interested in the csv output, but a methodolical challenge for the author.
     '''
 
-    df['clean_name'] = df['name'].apply(lambda x: x.replace(" LTD", " LIMITED")
-                                        .replace("The Hon", "")
-                                        .replace("Dr ", "")
-                                        .replace("Mr ", "")
-                                        .replace("Mrs ", "")
-                                        .replace("Ms ", "")
-                                        .replace(".", "").upper())
-    clean = fuzz_dict(df['clean_name'], 90)
-    df['clean_name'] = df['clean_name'].apply(lambda x: clean_dict(x, clean))
+    # Each distinct name is cleaned once. fuzz_dict() gets the cleaned names
+    # as often as they appear in the rows read, duplicates included.
+    raw = list(names)
+    cleaned = clean_names(raw)
+    counts = collections.Counter()
+    for name, clean_name in zip(raw, cleaned):
+        counts[clean_name] += names[name]
+    clean = fuzz_dict(pd.Series(list(counts), dtype = object).repeat(list(counts.values())), 90)
+    df['clean_name'] = df['name'].map({name : clean_dict(clean_name, clean)
+                                       for name, clean_name in zip(raw, cleaned)})
     df['source'] = df['clean_name']
 
-    '''
-    Updating the targets where missing (i.e. on pscs). Should have done this
-    before merging, oh well, next time.
-    '''
-    # Silencing an error. Don't worry, it's totally fine :-)
-    pd.options.mode.chained_assignment = None
-    df['target'].loc[df['target'].isna()] = df['company_name'].loc[df['target'].isna()]
-
     '''
     Removing some duplicates that arise from using both officers and appointments.
+    Most are already gone (see chpy.frames.edge_frame()); these are the ones
+    only fuzzy matching shows up.
     '''
     df.drop_duplicates(subset=['source', 'target', 'officer_role', 'appointed_on'], inplace = True)
 
@@ -250,31 +687,43 @@ def get_company_network(company_number, api_key, depth):
 
     attribute_list = [i for i in edge_list_fields if i in df.columns]
 
-    for row in df.iterrows():
-        for item in attribute_list:
-            if type(row[1][item]) != list and type(row[1][item]) != dict:
-                try:
-                    G.nodes[row[1]['source']][item] = row[1][item]
-                except KeyError:
-                    continue
-
-    for row in ct.iterrows():
-        for item in ct.columns:
-            if type(row[1][item]) != list and type(row[1][item]) != dict:
-                try:
-                    G.nodes[row[1]['company_name']][item] = row[1][item]
-                except KeyError:
-                    continue
-    
+    nx.set_node_attributes(G, node_attributes(df, 'source', attribute_list))
+    nx.set_node_attributes(G, node_attributes(ct, 'company_name', ct.columns))
+
+    if roots is not None:
+        provenance = root_provenance(G, ct, roots, depth)
+        nx.set_node_attributes(G, provenance, 'roots')
+        if len(ct) > 0:
+            ct['roots'] = ct['company_name'].map(provenance)
+
     # Write everything to disk
-    file_id = "{}_{}".format(company_number, depth)
-    os.makedirs('./data/{}/'.format(file_id), exist_ok = True)
-    nx.write_gexf(G,'./data/{}/{}.gexf'.format(file_id, file_id))
-    df.to_csv('./data/{}/{}_edge_list.csv'.format(file_id, file_id))
-    ct.to_csv('./data/{}/{}_companies.csv'.format(file_id, file_id))
+    write_outputs(G, df, ct, file_id, output_formats)
 
     return G, df, ct
 
+def rebuild_network(file_id, output_formats = DEFAULT_FORMATS):
+    """
+    Builds the graph, edge list and company table of an earlier crawl again,
+    from what's on disk in ./data/{file_id}/ (e.g. "00000006_2"), and writes
+    them in output_formats. No API calls are made, so it's a quick way to
+    get a crawl's outputs in other formats, or those of a crawl that died or
+    ran out of budget, as far as it got.
+
+    Needs the crawl's checkpoint, to know how much of each stream to read and
+    which companies were expanded. Only that much is read (see StreamReader)
+    and nothing on disk but the outputs is changed, so a crawl that's still
+    going can be rebuilt as of its last checkpoint.
+    """
+    output_formats = check_formats(output_formats)
+    state = load_checkpoint(checkpoint_path(file_id))
+    if state is None:
+        raise FileNotFoundError("No checkpoint for {} in {}"
+                                .format(file_id, checkpoint_path(file_id)))
+    reader = StreamReader(stream_path(file_id), state['written'], state['expanded'])
+    return build_network(reader, file_id, output_formats,
+                         roots = crawl_roots(state['company_number']),
+                         depth = state.get('depth'))
+
 
 
 # def get_company_network(cn_query, api_key):
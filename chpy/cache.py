@@ -0,0 +1,217 @@
+import collections
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from chpy.records import dumps, loads
+
+"""
+A response cache for the Companies House API.
+
+chpy asks for the same things over and over: company profiles, appointment
+lists and officer searches all get re-requested within a crawl, and again
+the next time a neighbouring network is pulled. ResponseCache sits under
+chpy.search.get_generic() and answers those from a size-bounded in-memory LRU,
+backed by a SQLite file that survives between sessions.
+
+Entries are keyed on a normalised url (path plus sorted query, without the
+host) and expire after a TTL that depends on the kind of resource, as company
+profiles change far less often than search results. 404s and searches with no
+results are cached too ("negative caching"), on a shorter TTL.
+
+To use it, hand one to the Transport:
+
+    set_transport(Transport(cache = ResponseCache("./data/cache.sqlite")))
+"""
+
+DAY = 24 * 60 * 60
+
+# Default time-to-live, in seconds, for each kind of resource.
+DEFAULT_TTLS = {"profile" : 30 * DAY,
+                "officers" : 7 * DAY,
+                "psc" : 7 * DAY,
+                "appointments" : 7 * DAY,
+                "search" : 1 * DAY,
+                "other" : 1 * DAY}
+
+
+def normalize_url(url):
+    """
+    Expects a full API url. Returns the path and query with the host dropped
+    and query parameters sorted, so that equivalent calls share a key.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values = True)))
+    path = parts.path.rstrip("/") or "/"
+    return path + ("?" + query if query else "")
+
+
+def endpoint_type(url):
+    """
+    Classifies an API url as "profile", "officers", "psc", "appointments",
+    "search" or "other". Used to pick a TTL.
+    """
+    path = [i for i in urlsplit(url).path.split("/") if i]
+    if len(path) > 0 and path[0] == "search":
+        return "search"
+    if len(path) == 3 and path[0] == "officers" and path[2] == "appointments":
+        return "appointments"
+    if len(path) == 2 and path[0] == "company":
+        return "profile"
+    if len(path) == 3 and path[0] == "company":
+        if path[2] == "officers":
+            return "officers"
+        if path[2] == "persons-with-significant-control":
+            return "psc"
+    return "other"
+
+
+def is_negative(status, data):
+    """ 404s, and searches/lists that came back empty. """
+    return status == 404 or (isinstance(data, dict)
+                             and data.get("total_results") == 0)
+
+
+class ResponseCache(object):
+    """
+    Two-tier (memory, then SQLite) cache of API responses.
+
+    Arguments:
+        - path: SQLite file for the persistent tier. None keeps everything
+          in memory only.
+        - max_items: size of the in-memory LRU.
+        - ttls: dict overriding DEFAULT_TTLS, by endpoint_type().
+        - negative_ttl: TTL for 404s and empty results.
+
+    Counters for memory hits, disk hits and misses are kept in stats().
+    """
+
+    def __init__(self,
+                 path = None,
+                 max_items = 10000,
+                 ttls = None,
+                 negative_ttl = 1 * DAY):
+        self.path = path
+        self.max_items = max_items
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.negative_ttl = negative_ttl
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+        self._memory = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            self._db = sqlite3.connect(path, check_same_thread = False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                             "key TEXT PRIMARY KEY, "
+                             "endpoint TEXT, "
+                             "status INTEGER, "
+                             "body TEXT, "
+                             "expires REAL)")
+            self._db.commit()
+
+    def ttl(self, url, status, data):
+        if is_negative(status, data):
+            return self.negative_ttl
+        return self.ttls.get(endpoint_type(url), self.ttls["other"])
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last = False)
+
+    def get(self, url):
+        """
+        Returns (hit, data). On a hit, data is a freshly decoded copy of the
+        stored response (None for a cached 404), so callers can mutate it.
+        """
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[2] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return True, self._decode(entry)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT status, body, expires FROM responses "
+                                       "WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[2] > now:
+                    self._remember(key, row)
+                    self.disk_hits += 1
+                    return True, self._decode(row)
+
+            self.misses += 1
+            return False, None
+
+    def _decode(self, entry):
+        return None if entry[1] is None else loads(entry[1])
+
+    def set(self, url, status, data):
+        """
+        Stores a response. Only 200s and 404s are kept; anything else (rate
+        limiting, server errors) is worth asking again.
+        """
+        if status not in (200, 404):
+            return
+        key = normalize_url(url)
+        body = None if data is None else dumps(data)
+        entry = (status, body, time.time() + self.ttl(url, status, data))
+        with self._lock:
+            self._remember(key, entry)
+            self.stores += 1
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                 (key, endpoint_type(url)) + entry)
+                self._db.commit()
+
+    def purge_expired(self):
+        """ Drops expired entries from both tiers. Returns the number dropped. """
+        now = time.time()
+        with self._lock:
+            for key in [k for k, e in self._memory.items() if e[2] <= now]:
+                del self._memory[key]
+            if self._db is None:
+                return 0
+            dropped = self._db.execute("DELETE FROM responses WHERE expires <= ?",
+                                       (now,)).rowcount
+            self._db.commit()
+            return dropped
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            out = {"hits" : self.hits,
+                   "disk_hits" : self.disk_hits,
+                   "misses" : self.misses,
+                   "stores" : self.stores,
+                   "hit_rate" : (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                   "memory_items" : len(self._memory)}
+            if self._db is not None:
+                out["disk_items"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return out
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
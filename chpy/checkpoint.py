@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+
+from chpy.records import plain
+
+"""
+Checkpoints for get_company_network().
+
+A deep crawl can run for hours under the rate limit. So that a crash, kernel
+restart or dropped connection doesn't throw all that away, the crawl's state
+is written to ./data/{company_number}_{depth}/checkpoint/ as it goes, and
+get_company_network(..., resume = True) picks up from the last one. What it
+has collected is already on disk, in the crawl's stream files (see
+chpy.sink), so the checkpoint only needs to say how far along each one was.
+
+The state is a plain dict of JSON-friendly data:
+    - company_number: the root company, or the list of them for a crawl
+      from several (see get_companies_network()).
+    - depth: how deep the crawl goes.
+    - depth_it: the depth iteration in progress.
+    - company_table: the frontier for depth_it, i.e. companies found but not
+      yet expanded (to begin with, the root company or companies), in the
+      order they'll be expanded. Each has an '_index':
+      its position in the companies stream. They may be CompanyProfile
+      records (see chpy.records), which are saved as dicts.
+    - next_companies: companies found during depth_it, to be expanded in the
+      next iteration.
+    - visited: sets of what's already been dealt with -- company numbers
+      ("companies"), names searched for appointments ("names"), officer
+      appointment ids ("officers") and psc links ("pscs").
+    - written: how many records each stream had at the time.
+    - expanded: the set of companies (by '_index') that have been expanded.
+    - links: how many appointments found point to each company number.
+    - spent: what the crawl's Budget has spent (see chpy.frontier).
+    - stopped: the budget limit that stopped the crawl, if one did.
+    - edge_keys: the edge_key() of every edge written, for de-duplication.
+      Not saved, as it's rebuilt from the edges stream on resuming.
+    - nodes: the names of every officer, psc and company found. Not saved,
+      as it's rebuilt from the streams on resuming.
+"""
+
+VISITED = ("companies", "names", "officers", "pscs")
+
+
+def new_crawl_state(company_number, depth, root_companies):
+    return {"company_number" : company_number,
+            "depth" : depth,
+            "depth_it" : 0,
+            "company_table" : list(root_companies),
+            "next_companies" : [],
+            "visited" : {v : set() for v in VISITED},
+            "written" : {},
+            "expanded" : set(),
+            "links" : {},
+            "spent" : {},
+            "stopped" : None,
+            "edge_keys" : set(),
+            "nodes" : set()}
+
+
+def checkpoint_path(file_id):
+    return "./data/{}/checkpoint/crawl.json".format(file_id)
+
+
+def save_checkpoint(state, path):
+    """
+    Writes the crawl state to path atomically: it goes to a temporary file in
+    the same directory first, which is then renamed over the old checkpoint,
+    so a crash mid-write never leaves a half-written file behind.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok = True)
+    state = dict(state,
+                 visited = {k : sorted(v) for k, v in state['visited'].items()},
+                 expanded = sorted(state['expanded']))
+    state.pop('edge_keys', None)
+    state.pop('nodes', None)
+
+    handle, tmp_path = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+    try:
+        with os.fdopen(handle, "w") as f:
+            json.dump(state, f, default = plain)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_checkpoint(path):
+    """ Returns the saved crawl state, or None if there isn't one. """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    state['visited'] = {k : set(state['visited'].get(k, [])) for k in VISITED}
+    state['expanded'] = set(state['expanded'])
+    return state
@@ -0,0 +1,226 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+from chpy.frontier import PRIORITIES
+
+"""
+The chpy command, for running crawls and looking after their outputs and
+cache without opening a notebook:
+
+    chpy crawl 00000006 --depth 2 --key-file API_KEY.txt
+    chpy crawl 00000006 00000081 00000140 --depth 2 --key-file API_KEY.txt
+    chpy company 00000006 officers
+    chpy export 00000006_2 --format parquet --format graphml.gz
+    chpy cache stats ./data/cache.sqlite
+
+`chpy <command> --help` lists each one's options. API keys come from --key
+(as many as you like), --key-file (one per line) or the CHPY_API_KEY
+environment variable (comma-separated), in that order.
+
+pandas, networkx and the fuzzy matching take the best part of a second to
+import, and requests a good fraction of one, so nothing here imports them, or
+the chpy modules that do, until a command needs them: crawl and export load
+everything, company only the search functions, cache nothing but sqlite.
+"""
+
+logger = logging.getLogger(__name__)
+
+KEY_VARIABLE = "CHPY_API_KEY"
+
+
+def api_keys(args):
+    """
+    The API key(s) from the command line or environment. Returns one key as
+    a str or several as a list, as get_company_network() takes them.
+    """
+    keys = args.key or []
+    if not keys and args.key_file:
+        with open(args.key_file) as f:
+            keys = [line.strip() for line in f if line.strip()]
+    if not keys:
+        keys = [k.strip() for k in os.environ.get(KEY_VARIABLE, "").split(",") if k.strip()]
+    if not keys:
+        raise SystemExit("chpy: no API key; use --key, --key-file or {}".format(KEY_VARIABLE))
+    return keys[0] if len(keys) == 1 else keys
+
+
+def set_up_transport(args):
+    """ Points chpy at --base-url and swaps in a Transport with the cache etc. asked for. """
+    import chpy.search as search
+    from chpy.transport import Transport, set_transport
+
+    if args.base_url:
+        search.base_url = args.base_url.rstrip("/")
+    if args.cache or args.snapshot or args.compact:
+        cache = snapshot = None
+        if args.cache:
+            from chpy.cache import ResponseCache
+            cache = ResponseCache(args.cache)
+        if args.snapshot:
+            from chpy.snapshot import SnapshotStore
+            snapshot = SnapshotStore(args.snapshot)
+        set_transport(Transport(cache = cache, snapshot = snapshot, compact = args.compact))
+
+
+def summarise(G, df, ct, file_id):
+    print("{} nodes, {} edges, {} companies; written to ./data/{}/"
+          .format(G.number_of_nodes(), G.number_of_edges(), len(ct), file_id))
+
+
+def run_crawl(args):
+    from chpy.build import get_company_network, aget_company_network, crawl_id, DEFAULT_FORMATS
+
+    # Several companies are crawled together, as get_companies_network() does.
+    company_number = args.company_number[0] if len(args.company_number) == 1 else args.company_number
+    api_key = api_keys(args)
+    set_up_transport(args)
+    options = dict(checkpoint = not args.no_checkpoint,
+                   resume = args.resume,
+                   output_formats = args.format or DEFAULT_FORMATS,
+                   max_calls = args.max_calls,
+                   max_nodes = args.max_nodes,
+                   max_time = args.max_time,
+                   priority = args.priority,
+                   resolve_ids = args.resolve_ids)
+    if args.use_async:
+        from chpy.aio import run_async
+        G, df, ct = run_async(aget_company_network(company_number, api_key, args.depth,
+                                                   concurrency = args.concurrency, **options))
+    else:
+        G, df, ct = get_company_network(company_number, api_key, args.depth,
+                                        workers = args.workers, **options)
+    summarise(G, df, ct, crawl_id(company_number, args.depth))
+
+
+def run_company(args):
+    from chpy.search import get_company
+    from chpy.records import plain
+
+    api_key = api_keys(args)
+    set_up_transport(args)
+    data = get_company(args.company_number, args.what, api_key)
+    if data is None:
+        print("Nothing found for {}".format(args.company_number), file = sys.stderr)
+        return 1
+    print(json.dumps(data, indent = 2, default = plain))
+
+
+def run_export(args):
+    from chpy.build import rebuild_network, DEFAULT_FORMATS
+
+    try:
+        G, df, ct = rebuild_network(args.file_id, args.format or DEFAULT_FORMATS)
+    except FileNotFoundError as e:
+        print(e, file = sys.stderr)
+        return 1
+    summarise(G, df, ct, args.file_id)
+
+
+def run_cache(args):
+    from chpy.cache import ResponseCache
+
+    if not os.path.exists(args.path):
+        print("No cache at {}".format(args.path), file = sys.stderr)
+        return 1
+    cache = ResponseCache(args.path)
+    try:
+        if args.action == "stats":
+            print(json.dumps(cache.stats(), indent = 2))
+        elif args.action == "purge":
+            print("Dropped {} expired responses".format(cache.purge_expired()))
+        else:
+            cache.clear()
+            print("Cleared {}".format(args.path))
+    finally:
+        cache.close()
+
+
+def add_key_arguments(parser):
+    parser.add_argument("--key", action = "append",
+                        help = "an API key; repeat for several")
+    parser.add_argument("--key-file", help = "a file of API keys, one per line")
+
+
+def add_transport_arguments(parser):
+    parser.add_argument("--cache", metavar = "PATH",
+                        help = "cache responses in this SQLite file (see chpy.cache)")
+    parser.add_argument("--snapshot", metavar = "PATH",
+                        help = "answer what it can from this snapshot store (see chpy.snapshot)")
+    parser.add_argument("--compact", action = "store_true",
+                        help = "keep responses as compact records (see chpy.records)")
+    parser.add_argument("--base-url", help = "the API's url, e.g. a chpy.mock server's")
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog = "chpy",
+                                     description = "Build networks from the Companies House API.")
+    common = argparse.ArgumentParser(add_help = False)
+    common.add_argument("-q", "--quiet", action = "store_true",
+                        help = "only log warnings and errors")
+    commands = parser.add_subparsers(dest = "command", metavar = "command")
+    commands.required = True
+
+    crawl = commands.add_parser("crawl", parents = [common],
+                                help = "crawl the network around a company, or several")
+    crawl.add_argument("company_number", nargs = "+")
+    crawl.add_argument("-d", "--depth", type = int, default = 2)
+    add_key_arguments(crawl)
+    crawl.add_argument("--workers", type = int,
+                       help = "make calls from a pool of this many threads")
+    crawl.add_argument("--async", dest = "use_async", action = "store_true",
+                       help = "make calls with asyncio (needs aiohttp)")
+    crawl.add_argument("--concurrency", type = int, default = 8,
+                       help = "calls at once with --async")
+    crawl.add_argument("--resume", action = "store_true",
+                       help = "carry on from the last checkpoint")
+    crawl.add_argument("--no-checkpoint", action = "store_true")
+    crawl.add_argument("-f", "--format", action = "append",
+                       help = "an output format (see chpy.export); repeat for several. "
+                              "csv and gexf by default")
+    crawl.add_argument("--max-calls", type = int)
+    crawl.add_argument("--max-nodes", type = int)
+    crawl.add_argument("--max-time", type = float, help = "in seconds")
+    crawl.add_argument("--priority", choices = sorted(PRIORITIES))
+    crawl.add_argument("--resolve-ids", action = "store_true",
+                       help = "follow officers by id (see chpy.identity)")
+    add_transport_arguments(crawl)
+    crawl.set_defaults(run = run_crawl)
+
+    company = commands.add_parser("company", parents = [common],
+                                  help = "look up one company, as JSON")
+    company.add_argument("company_number")
+    company.add_argument("what", nargs = "?", default = "profile",
+                         choices = ("profile", "officers", "psc"))
+    add_key_arguments(company)
+    add_transport_arguments(company)
+    company.set_defaults(run = run_company)
+
+    export = commands.add_parser("export", parents = [common],
+                                 help = "rebuild a crawl's outputs from disk")
+    export.add_argument("file_id", help = "the crawl's directory in ./data/, e.g. 00000006_2")
+    export.add_argument("-f", "--format", action = "append",
+                        help = "an output format (see chpy.export); repeat for several. "
+                               "csv and gexf by default")
+    export.set_defaults(run = run_export)
+
+    cache = commands.add_parser("cache", parents = [common],
+                                help = "look after a response cache")
+    cache.add_argument("action", choices = ("stats", "purge", "clear"),
+                       help = "show its counts, drop expired responses, or empty it")
+    cache.add_argument("path", help = "the cache's SQLite file")
+    cache.set_defaults(run = run_cache)
+    return parser
+
+
+def main(argv = None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(level = logging.WARNING if args.quiet else logging.INFO,
+                        format = "%(message)s")
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
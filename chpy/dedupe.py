@@ -0,0 +1,251 @@
+import collections
+
+import numpy as np
+from fuzzywuzzy import fuzz, utils as fuzz_utils
+
+try:
+    from rapidfuzz import fuzz as rapid_fuzz, process as rapid_process
+except ImportError:
+    rapid_fuzz = None
+
+"""
+Fuzzy de-duplication of names, for build_network() (via utils.fuzz_dict()).
+
+The original fuzz_dict() scored every unique name against every other one, and
+counted both names' occurrences in the column for every pair that matched.
+That's fine for a few hundred names and hopeless for tens of thousands.
+
+name_clusters() gives the same answer without doing that. Names are counted
+once, and a pair is only scored if it could possibly score over the threshold.
+token_set_ratio() takes the best of three comparisons, and each has a cheap
+test that every pair scoring over the threshold passes:
+
+    - "<shared words>" against "<shared words> <the rest of one name>" only
+      scores highly if nearly all of that name's words are in the other. Names
+      are indexed by word, and only names containing all of a name's longer
+      words are tried against it.
+    - "<shared words> <the rest of A>" against "<shared words> <the rest of
+      B>" only scores highly if A and B are made of nearly the same letters.
+      How many letters each pair of names has in common is worked out in bulk,
+      as one matrix product per block of names of similar length.
+
+Candidate pairs are then scored in bulk: by rapidfuzz if it's installed (pip
+install rapidfuzz, much quicker) and by fuzzywuzzy if not. Names are
+processed by fuzzywuzzy either way (see process_name()), and rapidfuzz's
+scorers then agree with fuzzywuzzy's as python-Levenshtein computes them.
+Without python-Levenshtein, fuzzywuzzy falls back to difflib, whose scores
+differ: by a lot for dissimilar names, but seldom for the close matches
+that clear the usual thresholds. The same scoring helpers are used by
+search.search_filter() and search.mark_appointments() to score a page of
+results at a time.
+"""
+
+# Candidate pairs are scored this many at a time, to keep memory flat.
+BATCH_SIZE = 100000
+
+# Rows per block in the letter-overlap matrix products.
+BLOCK_SIZE = 256
+
+
+def process_name(name):
+    """
+    Expects a name. Returns it as fuzzywuzzy's scorers see it: accented
+    letters dropped, then lower case, letters and numbers only. This is
+    fuzzywuzzy's own processing whichever scorer is used, as rapidfuzz's
+    default_process() keeps accented letters and so scores 'SÉBASTIEN PETER'
+    differently. Anything that isn't a string comes back empty.
+    """
+    if not isinstance(name, str):
+        return ""
+    return fuzz_utils.full_process(name, force_ascii = True)
+
+
+def scorer(name):
+    """
+    Expects the name of a scorer in fuzzywuzzy.fuzz ("ratio",
+    "token_set_ratio", ...). Returns a function scoring two processed strings
+    as fuzzywuzzy would, from rapidfuzz if it's installed. Empty strings
+    score 0, as in fuzzywuzzy.
+    """
+    if rapid_fuzz is not None:
+        score = getattr(rapid_fuzz, name)
+    elif name == "ratio":
+        score = fuzz.ratio
+    else:
+        score = lambda a, b: getattr(fuzz, name)(a, b, full_process = False)
+    return lambda a, b: int(round(score(a, b))) if a and b else 0
+
+
+def score_pairs(left, right, name = "token_set_ratio"):
+    """
+    Expects two equal-length lists of processed strings. Returns the score of
+    each pair, rounded as fuzzywuzzy rounds it.
+    """
+    if rapid_fuzz is None or not hasattr(rapid_process, "cpdist"):
+        score = scorer(name)
+        return [score(a, b) for a, b in zip(left, right)]
+    scores = rapid_process.cpdist(left, right,
+                                  scorer = getattr(rapid_fuzz, name),
+                                  dtype = np.float64,
+                                  workers = -1).tolist()
+    return [int(round(s)) if a and b else 0 for a, b, s in zip(left, right, scores)]
+
+
+def score_against(query, choices, name = "token_set_ratio"):
+    """
+    Expects a processed string and a list of them. Returns the score of each
+    choice against the query, as score_pairs(choices, [query, ...]) would,
+    in one cdist() call. Close matches score as fuzzywuzzy scores them; see
+    the note on difflib above for the rest.
+    """
+    if rapid_fuzz is None or not query or not choices:
+        score = scorer(name)
+        return [score(c, query) for c in choices]
+    scores = rapid_process.cdist([query], choices,
+                                 scorer = getattr(rapid_fuzz, name),
+                                 dtype = np.float64)[0].tolist()
+    return [int(round(s)) if c else 0 for c, s in zip(choices, scores)]
+
+
+def pair_codes(i, j, n):
+    """ Pairs of indices as single integers, lower index first. """
+    i, j = np.asarray(i, dtype = np.int64), np.asarray(j, dtype = np.int64)
+    return np.minimum(i, j) * n + np.maximum(i, j)
+
+
+def word_pairs(tokens, lengths, rho):
+    """
+    Pairs where nearly all of name i's words are in name j, as pair_codes().
+
+    Scoring "<shared>" against "<shared> <rest of i>" at rho or better leaves
+    room for at most `budget` characters of i's words to be missing from j.
+    So any word longer than that has to be in j, and if there isn't one, at
+    least one of the words making up more than `budget` does.
+    """
+    by_token = collections.defaultdict(set)
+    for i, ts in enumerate(tokens):
+        for t in ts:
+            by_token[t].add(i)
+
+    pairs = []
+    for i, ts in enumerate(tokens):
+        if not ts:
+            continue
+        budget = (2 - 2 * rho) * lengths[i] / (2 - rho)
+        ranked = sorted(ts, key = lambda t: (len(by_token[t]), t))
+        required = [by_token[t] for t in ranked if len(t) + 1 > budget]
+        if required:
+            found = required[0].intersection(*required[1:])
+        else:
+            found, weight = set(), 0
+            for t in ranked:
+                found |= by_token[t]
+                weight += len(t) + 1
+                if weight > budget:
+                    break
+        found.discard(i)
+        pairs.append(pair_codes(np.full(len(found), i), np.fromiter(found, int, len(found)),
+                                len(tokens)))
+    return np.concatenate(pairs) if pairs else np.zeros(0, dtype = np.int64)
+
+
+def letter_pairs(tokens, lengths, rho):
+    """
+    Pairs made of nearly the same letters, as pair_codes().
+
+    Comparing "<shared> <rest of A>" with "<shared> <rest of B>", every
+    letter that one name has more of than the other costs a match, so scoring
+    rho or better needs A and B to differ by at most (1 - rho) * (len(A) +
+    len(B)) letters. Each name is a 0/1 vector over (letter, nth occurrence),
+    so the dot product of two is the number of letters they share, and a
+    block of names is checked against every longer name at once. Only
+    lengths within the ratio 2 * shorter / total >= rho are compared.
+    """
+    live = [i for i, ts in enumerate(tokens) if ts]
+    if len(live) < 2:
+        return np.zeros(0, dtype = np.int64)
+
+    columns, rows, cols = {}, [], []
+    for row, i in enumerate(sorted(live, key = lambda i: lengths[i])):
+        seen = collections.Counter()
+        for c in "".join(tokens[i]):
+            seen[c] += 1
+            rows.append(row)
+            cols.append(columns.setdefault((c, seen[c]), len(columns)))
+    order = np.array(sorted(live, key = lambda i: lengths[i]))
+    letters = np.zeros((len(order), len(columns)), dtype = np.float32)
+    letters[rows, cols] = 1
+
+    length = np.array([lengths[i] for i in order], dtype = np.float32)
+    # Pair (r, c) passes if 2 * shared + slack[r] + slack[c] >= 0.
+    slack = (1 - rho) * length - letters.sum(axis = 1)
+    longest = length * (2 - rho) / rho
+
+    pairs = []
+    for start in range(0, len(order), BLOCK_SIZE):
+        end = min(start + BLOCK_SIZE, len(order))
+        stop = np.searchsorted(length, longest[end - 1] + 1e-3, side = "right")
+        shared = letters[start:end] @ letters[start:stop].T
+        shared *= 2
+        shared += slack[start:end, None]
+        shared += slack[None, start:stop]
+        r, c = np.nonzero(shared >= -1e-3)
+        c += start
+        keep = c > r + start
+        pairs.append(pair_codes(order[r[keep] + start], order[c[keep]], len(tokens)))
+    return np.concatenate(pairs)
+
+
+def candidate_pairs(processed, tol):
+    """
+    Expects a list of processed names. Returns the pairs of indices (i, j),
+    i < j, that could score more than tol, as two sorted arrays.
+    """
+    rho = (tol + 0.5) / 100
+    if rho > 1 or len(processed) < 2:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    tokens = [sorted(set(p.split())) for p in processed]
+    lengths = [len(" ".join(t)) for t in tokens]
+    codes = np.unique(np.concatenate([word_pairs(tokens, lengths, rho),
+                                      letter_pairs(tokens, lengths, rho)]))
+    return codes // len(processed), codes % len(processed)
+
+
+def name_clusters(col, tol = 90):
+    """
+    Expects a pandas series of names. Returns a dict mapping names to the
+    name they should be replaced with, exactly as the original fuzz_dict():
+
+    For each unique name i, every other unique name x with a
+    token_set_ratio() above tol is a match, and the last match x (in order
+    of appearance) decides: i maps to itself if it's more common in the
+    column than x, and to x otherwise. Names with no match are left out.
+    """
+    names = list(col.unique())
+    counts = col.value_counts().to_dict()
+    processed = [process_name(n) for n in names]
+    first, second = candidate_pairs(processed, tol)
+
+    last = {}
+    for start in range(0, len(first), BATCH_SIZE):
+        batch = list(zip(first[start:start + BATCH_SIZE].tolist(),
+                         second[start:start + BATCH_SIZE].tolist()))
+        left = [processed[i] for i, j in batch]
+        right = [processed[j] for i, j in batch]
+        forward = score_pairs(left, right)
+        # rapidfuzz scores are symmetric; fuzzywuzzy's SequenceMatcher isn't
+        # quite, so there each direction is scored as the original did.
+        backward = forward if rapid_fuzz is not None else score_pairs(right, left)
+        for (i, j), f, b in zip(batch, forward, backward):
+            if f > tol:
+                last[i] = max(last.get(i, j), j)
+            if b > tol:
+                last[j] = max(last.get(j, i), i)
+
+    out = {}
+    for i, j in sorted(last.items()):
+        if counts.get(names[i], 0) > counts.get(names[j], 0):
+            out[names[i]] = names[i]
+        else:
+            out[names[i]] = names[j]
+    return out
@@ -0,0 +1,125 @@
+import os
+
+import networkx as nx
+import pandas as pd
+
+"""
+Writing (and reading back) what get_company_network() produces.
+
+By default it writes what it always has to ./data/{file_id}/: the edge list
+and company table as CSV, and the graph as GEXF. output_formats picks any
+of:
+
+    - "csv", "csv.gz": {file_id}_edge_list.csv and {file_id}_companies.csv,
+      gzipped or not.
+    - "parquet", "feather": the same tables as Parquet or Arrow IPC
+      (Feather) files, zstd-compressed, with their dtypes kept. Far smaller
+      than CSV and much quicker to load -- see load_tables(). Needs pyarrow
+      (pip install pyarrow), which is only imported when they're asked for.
+    - "gexf", "gexf.gz": {file_id}.gexf, gzipped or not. Gephi opens either.
+    - "graphml", "graphml.gz": {file_id}.graphml, likewise.
+
+Leave a format out and it isn't written; output_formats = () writes nothing
+and just returns the graph and tables.
+"""
+
+TABLE_FORMATS = ("csv", "csv.gz", "parquet", "feather")
+GRAPH_FORMATS = ("gexf", "gexf.gz", "graphml", "graphml.gz")
+DEFAULT_FORMATS = ("csv", "gexf")
+
+
+def check_formats(output_formats):
+    """
+    Expects an iterable of format names (or one name). Returns them as a
+    tuple, raising a ValueError for any it doesn't know and an ImportError if
+    Parquet or Feather are asked for without pyarrow -- better to find out
+    before a long crawl than after it.
+    """
+    if isinstance(output_formats, str):
+        output_formats = (output_formats,)
+    output_formats = tuple(output_formats)
+    unknown = [f for f in output_formats if f not in TABLE_FORMATS + GRAPH_FORMATS]
+    if unknown:
+        raise ValueError("Unknown output format(s) {}; choose from {}"
+                         .format(unknown, TABLE_FORMATS + GRAPH_FORMATS))
+    if "parquet" in output_formats or "feather" in output_formats:
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("chpy's parquet and feather output needs pyarrow: "
+                              "pip install pyarrow")
+    return output_formats
+
+
+def table_path(file_id, table, fmt):
+    return "./data/{}/{}_{}.{}".format(file_id, file_id, table, fmt)
+
+
+def arrow_table(frame):
+    """
+    Expects a dataframe. Returns it as a pyarrow Table, without its index
+    (it's only a row number). Columns pyarrow can't type -- a mix of
+    numbers and strings, say -- have their values stored as strings.
+    """
+    import pyarrow as pa
+
+    frame = frame.reset_index(drop = True)
+    try:
+        return pa.Table.from_pandas(frame, preserve_index = False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        pass
+    for column in frame.columns[frame.dtypes == object]:
+        try:
+            pa.array(frame[column], from_pandas = True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            frame[column] = frame[column].map(lambda v: v if v is None or v != v else str(v))
+    return pa.Table.from_pandas(frame, preserve_index = False)
+
+
+def write_outputs(G, df, ct, file_id, output_formats = DEFAULT_FORMATS,
+                  compression = "zstd"):
+    """
+    Writes the graph, edge list and company table from build_network() to
+    ./data/{file_id}/ in each of output_formats (see above). compression is
+    used for Parquet and Feather.
+    """
+    output_formats = check_formats(output_formats)
+    os.makedirs('./data/{}/'.format(file_id), exist_ok = True)
+    tables = {"edge_list" : df, "companies" : ct}
+
+    for fmt in output_formats:
+        if fmt in ("csv", "csv.gz"):
+            for table, frame in tables.items():
+                frame.to_csv(table_path(file_id, table, fmt))
+        elif fmt == "parquet":
+            import pyarrow.parquet as pq
+            for table, frame in tables.items():
+                pq.write_table(arrow_table(frame), table_path(file_id, table, fmt),
+                               compression = compression)
+        elif fmt == "feather":
+            import pyarrow.feather as feather
+            for table, frame in tables.items():
+                feather.write_feather(arrow_table(frame), table_path(file_id, table, fmt),
+                                      compression = compression)
+        elif fmt.startswith("gexf"):
+            nx.write_gexf(G, './data/{}/{}.{}'.format(file_id, file_id, fmt))
+        else:
+            nx.write_graphml(G, './data/{}/{}.{}'.format(file_id, file_id, fmt))
+
+
+def load_tables(file_id, fmt = "parquet"):
+    """
+    Reads back the edge list and company table written by write_outputs()
+    in the given format. Returns (edge_list, companies).
+    """
+    fmt = check_formats(fmt)[0]
+    if fmt in ("csv", "csv.gz"):
+        read = lambda path: pd.read_csv(path, index_col = 0)
+    elif fmt == "parquet":
+        read = pd.read_parquet
+    elif fmt == "feather":
+        read = pd.read_feather
+    else:
+        raise ValueError("{} isn't a table format".format(fmt))
+    return (read(table_path(file_id, "edge_list", fmt)),
+            read(table_path(file_id, "companies", fmt)))
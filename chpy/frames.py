@@ -0,0 +1,231 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+from chpy.utils import flatten
+
+"""
+build_network()'s dataframes, built in one pass over the crawl's streams.
+
+json_normalize() needs the whole list of records in memory, so build_network()
+used to read every edge into a list, normalise that into a frame, normalise
+the psc lists into a second frame, merge that with the company table, concat
+the two and then clean the names row by row with apply(). A FrameBuilder
+instead takes one record at a time, flattening it straight into a list per
+column, and makes the frame once at the end, with the columns, their order
+and their dtypes exactly as json_normalize() would have them.
+
+edge_frame() uses one per stream for the edge list, and while it reads:
+    - each psc gets its company_number (from its links) and company_name
+      (from the company table), as the merge used to give it, and any row
+      without a target gets its company_name;
+    - a row with the same name, target, officer_role and appointed_on as one
+      already read is counted but not kept. The final drop_duplicates() is
+      keyed on those (with the name cleaned, which only ever merges names),
+      so it'd be dropped later anyway. It still counts towards the names
+      fuzz_dict() sees, and towards the columns and their dtypes.
+
+clean_names() then cleans each distinct name once, with pandas' vectorised
+string methods, rather than once per row.
+"""
+
+# Stands in for a field a row doesn't have, as in json_normalize().
+MISSING = np.nan
+
+# Applied in order by clean_names(), before upper-casing.
+NAME_REPLACEMENTS = ((" LTD", " LIMITED"),
+                     ("The Hon", ""),
+                     ("Dr ", ""),
+                     ("Mr ", ""),
+                     ("Mrs ", ""),
+                     ("Ms ", ""),
+                     (".", ""))
+
+# The fields the edge list is de-duplicated on, name standing in for source.
+DEDUPE_FIELDS = ("name", "target", "officer_role", "appointed_on")
+
+
+def flatten_record(record, sep = "."):
+    """
+    Expects a record. Returns it flattened as json_normalize() flattens it:
+    top-level fields first, then nested ones as "parent.child", in order.
+    Empty nested dicts disappear.
+    """
+    flat = {k : v for k, v in record.items() if not isinstance(v, dict)}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flatten_into(value, str(key), flat, sep)
+    return flat
+
+
+def flatten_into(nested, prefix, out, sep):
+    for key, value in nested.items():
+        name = "{}{}{}".format(prefix, sep, key)
+        if isinstance(value, dict):
+            flatten_into(value, name, out, sep)
+        else:
+            out[name] = value
+
+
+def is_null(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+class FrameBuilder(object):
+    """
+    A DataFrame built a row at a time. add() appends a flattened record to
+    a list per column; frame() makes the DataFrame. rows counts the rows
+    added, seen those added or skipped.
+
+    skip() takes a row that isn't to be kept, but that still counts towards
+    which columns there are and what their dtypes come out as, as if it had
+    been added and then dropped.
+
+    Columns named in tail go at the end, in that order, however early they
+    turn up; the rest are in the order they were first seen.
+    """
+
+    def __init__(self, tail = ()):
+        self.tail = tuple(tail)
+        self.columns = {}
+        self.index = []
+        self.rows = 0
+        self.seen = 0
+        # For each column, a value of each type found in skipped rows.
+        self._skipped = {}
+
+    def _skipped_value(self, key, value):
+        self._skipped.setdefault(key, {}).setdefault(type(value), value)
+
+    def _new_column(self, key):
+        # Any rows skipped so far didn't have it.
+        if self.seen > self.rows:
+            self._skipped_value(key, MISSING)
+        column = self.columns[key] = []
+        return column
+
+    def add(self, row, label = None):
+        rows = self.rows
+        for key, value in row.items():
+            column = self.columns.get(key)
+            if column is None:
+                column = self._new_column(key)
+            if len(column) < rows:
+                column.extend([MISSING] * (rows - len(column)))
+            column.append(value)
+        self.index.append(rows if label is None else label)
+        self.rows += 1
+        self.seen += 1
+
+    def skip(self, row):
+        for key, value in row.items():
+            if key not in self.columns:
+                self._new_column(key)
+            self._skipped_value(key, value)
+        for key in self.columns:
+            if key not in row:
+                self._skipped_value(key, MISSING)
+        self.seen += 1
+
+    def frame(self):
+        """
+        The DataFrame. Each column's dtype is inferred as json_normalize()
+        would, from everything added or skipped.
+        """
+        names = [c for c in self.columns if c not in self.tail] + \
+                [c for c in self.tail if c in self.columns]
+        data = {}
+        for name in names:
+            column = self.columns[name]
+            column.extend([MISSING] * (self.rows - len(column)))
+            extra = list(self._skipped.get(name, {}).values())
+            values = pd.Series(column + extra, dtype = object).infer_objects()
+            data[name] = values.to_numpy()[:self.rows]
+        if not names:
+            # json_normalize() of nothing, or of rows with no fields.
+            return pd.DataFrame(index = pd.RangeIndex(self.rows)) if self.rows else pd.DataFrame()
+        return pd.DataFrame(data, index = self.index, columns = names)
+
+
+def company_frame(companies):
+    """ The company table, from read_company_table(), as json_normalize() makes it. """
+    builder = FrameBuilder()
+    for company in companies:
+        builder.add(flatten_record(company))
+    return builder.frame()
+
+
+def edge_frame(edges, pscs, ct):
+    """
+    Expects a sink's edges and psc lists, and the company table. Returns the
+    edge list, pscs included, with company_name, company_number and target
+    filled in and the rows that are certain to be dropped as duplicates left
+    out (see above), plus a Counter of every row's name, kept or not, in the
+    order they were first seen.
+    """
+    names = collections.Counter()
+    keys = set()
+
+    def take(builder, row, label):
+        if row.get('target') is None or is_null(row['target']):
+            row['target'] = row['company_name']
+        name = row.get('name')
+        if not is_null(name):
+            names[name] += 1
+        key = tuple(None if is_null(v) else v for v in
+                    (row.get(f, MISSING) for f in DEDUPE_FIELDS))
+        try:
+            if key in keys:
+                builder.skip(row)
+                return
+            keys.add(key)
+        except TypeError:
+            pass
+        builder.add(row, label)
+
+    edge_rows = FrameBuilder(tail = ("company_name", "company_number"))
+    label = 0
+    for item in edges:
+        if type(item) == dict:
+            row = flatten_record(item)
+            row['company_name'] = row.get('appointed_to.company_name', MISSING)
+            row['company_number'] = row.get('appointed_to.company_number', MISSING)
+            take(edge_rows, row, label)
+            label += 1
+    df = edge_rows.frame()
+
+    # pscs are given the company's name from the company table, one row per
+    # company with that number, as a left merge would.
+    company_names = collections.defaultdict(list)
+    if len(ct) > 0:
+        for number, name in zip(ct['company_number'], ct['company_name']):
+            company_names[number].append(name)
+
+    psc_rows = FrameBuilder(tail = ("company_number", "company_name"))
+    label = 0
+    for psc in flatten([i.get('items') for i in pscs
+                        if type(i) == dict and i.get('items') != None]):
+        if not isinstance(psc, dict):
+            continue
+        flat = flatten_record(psc)
+        link = flat.get('links.self')
+        number = link.split("/")[2] if isinstance(link, str) else MISSING
+        for name in company_names.get(number) or [MISSING]:
+            take(psc_rows, dict(flat, company_number = number, company_name = name), label)
+            label += 1
+
+    if psc_rows.seen > 0:
+        df = pd.concat([df, psc_rows.frame()], sort = True)
+    return df, names
+
+
+def clean_names(names):
+    """
+    Expects a list of names. Returns them cleaned for matching, as a list:
+    titles dropped, " LTD" spelt out, full stops removed, upper case.
+    """
+    cleaned = pd.Series(names, dtype = object)
+    for old, new in NAME_REPLACEMENTS:
+        cleaned = cleaned.str.replace(old, new, regex = False)
+    return cleaned.str.upper().tolist()
@@ -0,0 +1,148 @@
+import threading
+import time
+
+from chpy.metrics import get_metrics
+
+"""
+Budgets and priorities for get_company_network()'s crawl.
+
+Depth alone is a blunt limit: every extra hop multiplies the size of the
+crawl, so depth 3 of one network might take a hundred calls and depth 3 of
+another a hundred thousand. A Budget caps the crawl directly instead, by any
+of:
+
+    - max_calls: API calls made. Only calls that go over the wire count;
+      answers from the snapshot, cache or memo are free. Retries count, as
+      they use up quota too.
+    - max_nodes: distinct officers, pscs and companies found, i.e. roughly
+      the nodes in the final graph (before names are de-duplicated).
+    - max_time: seconds spent crawling.
+
+Spending is saved in the crawl's checkpoint, so a resumed crawl carries on
+against the same totals. When the budget runs out the crawl stops cleanly,
+between chunks of companies: everything found so far is written out, and
+the graph, edge list and company table are built from it as usual, with the
+companies never expanded left without 'done'. To keep any overshoot small,
+chunks shrink as the budget runs low, going by what each company has cost
+so far.
+
+Within each depth iteration companies are expanded in priority order, so
+that a crawl cut short has spent its budget on the companies that matter
+most. A priority is a function priority(company, links) returning a sort key
+(lowest first), where company is a company profile and links is a dict of
+how many appointments found so far point to each company number. Built in,
+by name:
+
+    - "fewest_hops": the order companies were found in, i.e. plain
+      breadth-first search. The default.
+    - "most_links": companies the most officers and pscs lead to first.
+    - "active_first": active companies before dissolved, liquidated etc.
+"""
+
+LIMITS = ("calls", "nodes", "seconds")
+
+
+def fewest_hops(company, links):
+    return 0
+
+
+def most_links(company, links):
+    return -links.get(company.get('company_number'), 0)
+
+
+def active_first(company, links):
+    return company.get('company_status') != "active"
+
+
+PRIORITIES = {"fewest_hops" : fewest_hops,
+              "most_links" : most_links,
+              "active_first" : active_first}
+
+
+def get_priority(priority):
+    """
+    Expects the name of a built-in priority, a priority function, or None
+    (for "fewest_hops"). Returns the function.
+    """
+    if priority is None:
+        return fewest_hops
+    if callable(priority):
+        return priority
+    try:
+        return PRIORITIES[priority]
+    except KeyError:
+        raise ValueError("Unknown priority {!r}; choose from {} or pass a function"
+                         .format(priority, sorted(PRIORITIES)))
+
+
+class Budget(object):
+    """
+    Limits on a crawl; see above. Any left as None don't apply.
+
+    The crawl calls start() when it starts or resumes, and stop() when it's
+    done. In between, the budget counts the API calls chpy.metrics reports
+    with a callback of its own, so the calls made before the crawl, and
+    resetting the metrics during it, make no difference. Calls made by
+    anything else running in the same process at the same time, another
+    crawl say, are counted too.
+    """
+
+    def __init__(self, max_calls = None, max_nodes = None, max_time = None):
+        self.limits = {"calls" : max_calls,
+                       "nodes" : max_nodes,
+                       "seconds" : max_time}
+        self._metrics = None
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._seconds = -time.monotonic()
+
+    def start(self, spent = None):
+        """ Starts counting, carrying on from spent, as saved by spent(). """
+        self.stop()
+        spent = spent or {}
+        with self._lock:
+            self._calls = spent.get("calls", 0)
+        self._seconds = spent.get("seconds", 0.0) - time.monotonic()
+        self._metrics = get_metrics()
+        self._metrics.add_callback(self._count)
+
+    def stop(self):
+        """ Stops counting calls. Safe to call more than once. """
+        if self._metrics is not None:
+            self._metrics.remove_callback(self._count)
+            self._metrics = None
+
+    def _count(self, event, fields):
+        if event == "request":
+            with self._lock:
+                self._calls += 1
+
+    def spent(self, nodes):
+        """ What's been spent so far, given how many nodes have been found. """
+        with self._lock:
+            calls = self._calls
+        return {"calls" : calls,
+                "nodes" : nodes,
+                "seconds" : self._seconds + time.monotonic()}
+
+    def exhausted(self, spent):
+        """ The first limit that spent has reached, or None. """
+        for limit in LIMITS:
+            if self.limits[limit] is not None and spent[limit] >= self.limits[limit]:
+                return limit
+
+    def companies_left(self, spent, expanded, most):
+        """
+        How many more companies (up to most) look affordable, given what
+        the `expanded` companies so far have spent. At least one, so the
+        crawl always gets somewhere.
+        """
+        if expanded == 0:
+            return 1 if any(v is not None for v in self.limits.values()) else most
+        left = most
+        for limit in LIMITS:
+            if self.limits[limit] is None or spent[limit] <= 0:
+                continue
+            each = spent[limit] / expanded
+            left = min(left, int((self.limits[limit] - spent[limit]) / each))
+        return max(left, 1)
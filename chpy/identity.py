@@ -0,0 +1,240 @@
+import collections
+
+from chpy.dedupe import process_name, score_against
+from chpy.utils import get_officer_id
+
+"""
+Officer identity resolution, for get_company_network(..., resolve_ids = True).
+
+Companies House has no id for a person, only for each of their "officer
+appointment lists" -- and one person can have several of those. So by
+default the crawl looks for a person's other lists by searching for their
+name (see search_filter()), for every officer and psc it meets: a search,
+plus a call for each list it turns up, plus pages.
+
+An IdentityResolver instead keeps track of who the crawl has already met.
+Every officer id, psc and company it sees goes into a union-find, joined
+together when:
+
+    - a name search found them to be the same person, or
+    - their names match and so do their dates of birth or addresses, by
+      the same test search_filter() uses.
+
+With that, the crawl:
+
+    - fetches an officer's own appointment list, by id, and doesn't search
+      for their name at all;
+    - doesn't look at anyone already covered, i.e. whose lists have been
+      (or are being) fetched, or whose name has been searched. A psc who is
+      also a director of the company is covered by their officer record;
+    - only searches for a name where there's no id to go on (pscs and
+      corporate officers not met before), and skips the lists of any hits
+      already fetched.
+
+That's usually one call per officer rather than several, at the cost of the
+other appointment lists a name search would have turned up: those are only
+found if the crawl reaches them some other way.
+
+The resolver is used between batches of the crawl (see
+chpy.build.crawl_network()), never from inside the calls, so the crawl's
+output still doesn't depend on which call in a batch finishes first.
+"""
+
+# Titles dropped from names before they're compared; pscs have them,
+# officer records mostly don't.
+TITLES = {"mr", "mrs", "ms", "miss", "mx", "dr", "sir", "dame", "lord", "lady"}
+
+
+class UnionFind(object):
+    """ Disjoint sets of hashable items, with path halving and union by size. """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def __contains__(self, item):
+        return item in self.parent
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        """ Joins the sets holding a and b. Returns the new root. """
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size.pop(b)
+        return a
+
+
+def record_key(record):
+    """
+    The key a record goes into the union-find under: its officer id if it
+    has one, otherwise its psc link, company number or, failing those, name.
+    """
+    officer_id = get_officer_id(record)
+    if officer_id is not None:
+        return "officer:" + officer_id
+    if record.get('query_type') == "psc" and (record.get('links') or {}).get('self'):
+        return "psc:" + record['links']['self']
+    if record.get('company_number'):
+        return "company:" + record['company_number']
+    return "name:" + str(record.get('name'))
+
+
+def match_name(name):
+    """ A name normalised for comparison: processed, titles dropped, sorted. """
+    return " ".join(sorted(t for t in process_name(name).split() if t not in TITLES))
+
+
+def match_address(address):
+    if not isinstance(address, dict):
+        return ""
+    return process_name(" ".join(str(v) for v in address.values() if v))
+
+
+def match_dob(dob):
+    if not isinstance(dob, dict) or dob.get('year') is None:
+        return None
+    return (dob.get('year'), dob.get('month'))
+
+
+class IdentityResolver(object):
+    """
+    Who a crawl has met, and what's been fetched for them. See above.
+
+    Arguments:
+        - thresh: the score names (and addresses) must beat to match, as in
+          search_filter().
+
+    plan() decides what, if anything, to fetch for a record, and settle()
+    takes in what the planned calls found once they're done. Counts of
+    lists and searches skipped are kept in stats().
+    """
+
+    def __init__(self, thresh = 90):
+        self.thresh = thresh
+        self.people = UnionFind()
+        # Officer ids whose appointment lists have been, or are being, fetched.
+        self.fetched = set()
+        # Roots of the people who are covered.
+        self._covered = set()
+        # Records to match against, by date of birth (None if unknown), and
+        # their positions in those lists by date of birth and name word.
+        self._by_dob = collections.defaultdict(list)
+        self._by_word = collections.defaultdict(list)
+        self._pending = []
+
+        self.skipped = 0
+        self.searches = 0
+        self.by_id = 0
+
+    def _union(self, a, b):
+        covered = self.is_covered(a) or self.is_covered(b)
+        self._covered.discard(self.people.find(a))
+        self._covered.discard(self.people.find(b))
+        root = self.people.union(a, b)
+        if covered:
+            self._covered.add(root)
+        return root
+
+    def is_covered(self, key):
+        return self.people.find(key) in self._covered
+
+    def add(self, record):
+        """
+        Puts a record in the union-find, joined to anyone it matches.
+        Returns its key.
+
+        Only records with the same date of birth and at least one word of
+        the name in common are scored, as in chpy.dedupe, so a record isn't
+        scored against everyone met so far. Names that match without sharing
+        a word ("JOHNSMITH", "JOHN SMITH") aren't joined.
+        """
+        key = record_key(record)
+        if key in self.people:
+            return key
+        self.people.add(key)
+        if key.startswith("company:"):
+            return key
+
+        name = match_name(record.get('name'))
+        address = match_address(record.get('address'))
+        dob = match_dob(record.get('date_of_birth'))
+        bucket = self._by_dob[dob]
+        words = set(name.split())
+        found = set()
+        for word in words:
+            found.update(self._by_word.get((dob, word), ()))
+        if found:
+            candidates = [bucket[i] for i in sorted(found)]
+            names = score_against(name, [c[1] for c in candidates], "ratio")
+            addresses = score_against(address, [c[2] for c in candidates], "token_set_ratio")
+            for (other, _, _), name_score, address_score in zip(candidates, names, addresses):
+                if name_score > self.thresh and (dob is not None or address_score > self.thresh):
+                    self._union(key, other)
+        for word in words:
+            self._by_word[dob, word].append(len(bucket))
+        bucket.append((key, name, address))
+        return key
+
+    def plan(self, record):
+        """
+        Expects a record the crawl wants appointments for. Returns the extra
+        keyword arguments for its get_appointments() call, or None if it
+        needn't be made.
+        """
+        key = self.add(record)
+        officer_id = get_officer_id(record) if record.get('query_type') == "officers" else None
+        if self.is_covered(key) and (officer_id is None or officer_id in self.fetched):
+            self.skipped += 1
+            return None
+        self._covered.add(self.people.find(key))
+        if officer_id is not None:
+            self.fetched.add(officer_id)
+            self.by_id += 1
+            return {'search' : False}
+        # The set of ids is handed over as is: it isn't changed while the
+        # batch's calls are running, only between batches.
+        found = []
+        self._pending.append((key, found))
+        self.searches += 1
+        return {'skip' : self.fetched, 'found' : found}
+
+    def settle(self):
+        """
+        Takes in what the searches planned since the last settle() found:
+        the ids of the lists they matched are joined to the record searched
+        for, and count as fetched.
+        """
+        for key, found in self._pending:
+            for officer_id in found:
+                if officer_id is None:
+                    continue
+                other = "officer:" + officer_id
+                self.people.add(other)
+                self._union(key, other)
+                self.fetched.add(officer_id)
+        self._pending = []
+
+    def stats(self):
+        return {"records" : len(self.people),
+                "officer_ids" : len(self.fetched),
+                "fetched_by_id" : self.by_id,
+                "searches" : self.searches,
+                "skipped" : self.skipped}
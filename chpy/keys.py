@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import threading
+import time
+
+from chpy.ratelimit import RateLimiter
+
+"""
+Pools of Companies House API keys.
+
+Each key gets 600 calls per five minutes, which is the hard ceiling on how
+fast a crawl can go. A KeyPool spreads calls over several keys, each with its
+own RateLimiter kept in step with that key's X-Ratelimit-* headers, so N keys
+give close to N times the throughput.
+
+Anywhere chpy asks for an api_key, a KeyPool (or simply a list of keys) can
+be passed instead.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class KeyPool(object):
+    """
+    Routes calls to whichever key has the most budget left.
+
+    Keys that come back with a 401 are retired for good, as long as there's
+    another key left to use; keys that come back with a 429 are benched until
+    their rate limit window resets. The last key is never retired: its 401s
+    are logged and the call fails as it would with a single key, so one bad
+    response (or an expired key, replaced later) doesn't end a session.
+
+    Arguments:
+        - keys: an iterable of API key strings (or a single string).
+        - limiters: optional dict of key -> RateLimiter, for keys whose
+          accounting should be shared with something else.
+    """
+
+    def __init__(self, keys, limiters = None):
+        if isinstance(keys, str):
+            keys = [keys]
+        self.keys = list(dict.fromkeys(keys))
+        if len(self.keys) == 0:
+            raise ValueError("KeyPool needs at least one API key")
+
+        limiters = limiters or {}
+        self.limiters = {k : limiters.get(k) or RateLimiter() for k in self.keys}
+        self.retired = {}
+        self.benched = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def active(self):
+        """ Returns the keys currently in rotation. """
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, until in self.benched.items() if until <= now]:
+                del self.benched[key]
+            return [k for k in self.keys
+                    if k not in self.retired and k not in self.benched]
+
+    def choose(self):
+        """
+        Returns (key, seconds to wait before any key is back in rotation).
+        The wait is only non-zero when every live key is benched.
+        """
+        active = self.active()
+        if active:
+            return max(active, key = lambda k: (self.limiters[k].available(),
+                                                self.limiters[k].tokens)), 0.0
+        with self._lock:
+            if not self.benched:
+                # One came off the bench since active() looked. The last key
+                # is never retired, so there's always one to go back to.
+                return [k for k in self.keys if k not in self.retired][0], 0.0
+            key, until = min(self.benched.items(), key = lambda i: i[1])
+        return key, max(until - time.monotonic(), 0.0)
+
+    def acquire(self):
+        """ Picks a key and blocks until its rate limiter lets a call out. """
+        key, wait = self.choose()
+        if wait > 0:
+            time.sleep(wait)
+        self.limiters[key].acquire()
+        return key
+
+    async def aacquire(self):
+        """ As acquire(), but awaits rather than blocking the event loop. """
+        key, wait = self.choose()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self.limiters[key].aacquire()
+        return key
+
+    def update(self, key, response):
+        """
+        Feeds a response made with `key` back into the pool: syncs the key's
+        limiter from the headers and takes the key out of rotation on a
+        401 or 429.
+        """
+        headers = getattr(response, 'headers', {})
+        self.limiters[key].update(headers)
+        status = getattr(response, 'status_code', getattr(response, 'status', None))
+
+        with self._lock:
+            if status == 401:
+                if any(k != key and k not in self.retired for k in self.keys):
+                    self.retired[key] = status
+                    self.benched.pop(key, None)
+                    logger.warning("API key %s... was refused (401); carrying on with "
+                                   "the others", key[:4])
+                else:
+                    logger.warning("API key %s... was refused (401), and there's no "
+                                   "other key to use", key[:4])
+            elif status == 429:
+                try:
+                    left = float(headers['X-Ratelimit-Reset']) - time.time()
+                except (KeyError, TypeError, ValueError):
+                    left = 60.0
+                self.benched[key] = time.monotonic() + max(left, 1.0)
+
+    def stats(self):
+        return {k : dict(self.limiters[k].stats(),
+                         retired = k in self.retired,
+                         benched = k in self.benched)
+                for k in self.keys}
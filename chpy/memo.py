@@ -0,0 +1,172 @@
+import asyncio
+import collections
+import contextlib
+import threading
+
+from chpy.cache import normalize_url
+from chpy.metrics import emit, endpoint_name
+from chpy.records import dumps, loads
+
+"""
+Single-flight memoization of API calls, for the life of a crawl.
+
+A crawl asks for the same things again and again: the same corporate
+officer's name is searched for at every company it sits on, and officer
+searches keep turning up the same appointment lists. With threads or async,
+several of those can even be asked for at the same moment.
+
+A RequestMemo sits in front of everything else in get_generic() (snapshot,
+cache and the network). The first call for a url does the work; calls for
+the same url made while it's in flight wait for it and share its answer,
+and later calls get the answer straight from memory. Urls are keyed as
+chpy.cache keys them (path plus sorted query), and, as with the cache, only
+200s and 404s are kept: a call that failed is tried afresh next time.
+
+Unlike the ResponseCache, nothing expires and nothing is written to disk,
+so there's nothing to go stale: drive_crawl() and adrive_crawl() give the
+Transport a fresh RequestMemo for each crawl (see crawl_memo()) and drop it
+at the end. Give a Transport one of your own to keep it for longer.
+
+Answers are held as encoded JSON, a few KB each (appointment lists and
+searches run to a few tens of KB), so it's bounded like the ResponseCache's
+memory tier: past max_items, the least recently used answer is dropped,
+and asked for again if it's needed. The default of 50,000 keeps it to a few
+hundred MB at most, and a crawl makes as many calls as that before it fills.
+"""
+
+
+class RequestMemo(object):
+    """
+    Answers, by url, of the calls made through it, up to max_items of them
+    (the most recently used; see above). Safe to share between threads, and
+    between coroutines on an event loop.
+
+    Counters for hits (answered from memory), shared calls (answered by a
+    call already in flight) and misses (calls made) are kept in stats().
+    """
+
+    def __init__(self, max_items = 50000):
+        self.max_items = max_items
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+
+        self._done = collections.OrderedDict()
+        # Calls in flight, by key: threads wait on a threading.Event,
+        # coroutines on an asyncio.Event.
+        self._in_flight = {}
+        self._ain_flight = {}
+        self._lock = threading.Lock()
+
+    def _hit(self, url, body, waited):
+        """ Counts a hit, and decodes its data. """
+        with self._lock:
+            if waited:
+                self.shared += 1
+            else:
+                self.hits += 1
+        emit("lookup", source = "memo", endpoint = endpoint_name(url), hit = True)
+        return None if body is None else loads(body)
+
+    def _finish(self, key, status, data):
+        """ Keeps a call's answer, if it's worth keeping. Call with the lock held. """
+        if status in (200, 404):
+            self._done[key] = None if data is None else dumps(data)
+            while len(self._done) > self.max_items:
+                self._done.popitem(last = False)
+
+    def get(self, url, fetch):
+        """
+        Returns the data for url, calling fetch() -- which returns (status,
+        data) -- only if no other call for it has been, or is being, made.
+        The data is a fresh copy each time, so callers can mutate it.
+        """
+        key = normalize_url(url)
+        waited = False
+        while True:
+            with self._lock:
+                hit = key in self._done
+                body = self._done.get(key)
+                if hit:
+                    self._done.move_to_end(key)
+                flight = None if hit else self._in_flight.get(key)
+                if not hit and flight is None:
+                    flight = self._in_flight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            if hit:
+                return self._hit(url, body, waited)
+            # Someone else is fetching it. If they fail, we try ourselves.
+            flight.wait()
+            waited = True
+
+        emit("lookup", source = "memo", endpoint = endpoint_name(url), hit = False)
+        status, data = None, None
+        try:
+            status, data = fetch()
+        finally:
+            with self._lock:
+                self._finish(key, status, data)
+                del self._in_flight[key]
+            flight.set()
+        return data
+
+    async def aget(self, url, fetch):
+        """ As get(), for a coroutine function fetch. """
+        key = normalize_url(url)
+        waited = False
+        while True:
+            with self._lock:
+                hit = key in self._done
+                body = self._done.get(key)
+                if hit:
+                    self._done.move_to_end(key)
+                flight = None if hit else self._ain_flight.get(key)
+                if not hit and flight is None:
+                    flight = self._ain_flight[key] = asyncio.Event()
+                    self.misses += 1
+                    break
+            if hit:
+                return self._hit(url, body, waited)
+            await flight.wait()
+            waited = True
+
+        emit("lookup", source = "memo", endpoint = endpoint_name(url), hit = False)
+        status, data = None, None
+        try:
+            status, data = await fetch()
+        finally:
+            with self._lock:
+                self._finish(key, status, data)
+                del self._ain_flight[key]
+            flight.set()
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._done.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared + self.misses
+            return {"hits" : self.hits,
+                    "shared" : self.shared,
+                    "misses" : self.misses,
+                    "hit_rate" : (self.hits + self.shared) / lookups if lookups else 0.0,
+                    "items" : len(self._done)}
+
+
+@contextlib.contextmanager
+def crawl_memo(transport):
+    """
+    Gives transport a fresh RequestMemo for the duration of a with block,
+    unless it already has one, in which case that's used. Yields the memo.
+    """
+    if transport.memo is not None:
+        yield transport.memo
+        return
+    transport.memo = RequestMemo()
+    try:
+        yield transport.memo
+    finally:
+        transport.memo = None
@@ -0,0 +1,207 @@
+import bisect
+import collections
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+"""
+Instrumentation for chpy.
+
+Every API call, retry, rate-limit wait, cache lookup and crawl step is
+reported to a Metrics object as an event, which keeps running totals and
+passes each event on to any callbacks registered with it. One Metrics is
+shared by all of chpy, as the Transport is:
+
+    metrics = get_metrics()
+    metrics.add_callback(lambda event, fields: print(event, fields))
+    ...
+    metrics.snapshot().requests      # calls made so far, by endpoint
+
+The events, and the fields each comes with:
+
+    - "request": one attempt at an API call. endpoint, status (None if no
+      response came back), latency (seconds).
+    - "retry": an attempt that's about to be tried again. endpoint,
+      status, wait (seconds of backoff before the next attempt).
+    - "rate_limit_wait": a call held back by the rate limiter. seconds.
+    - "lookup": a call answered, or not, from local data. source
+      ("snapshot", "cache" or "memo", the last from a crawl's
+      RequestMemo), endpoint, hit (True/False).
+    - "frontier": the start of a crawl's depth iteration. depth, size
+      (companies to expand).
+    - "search_filter": a page of search hits filtered. accepted, rejected.
+    - "edges": edges found in a chunk of the crawl. accepted, rejected
+      (duplicates).
+    - "stopped": a crawl stopped early by its budget (see chpy.frontier).
+      limit (which ran out), spent.
+
+snapshot() returns the totals as a MetricsSnapshot, which is a namedtuple
+of plain dicts and numbers, safe to keep, compare or json.dump().
+
+chpy's progress messages go through the logging module, under the "chpy"
+logger; logging.basicConfig(level = logging.INFO) shows them.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram's buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+
+MetricsSnapshot = collections.namedtuple('MetricsSnapshot',
+                                         ['elapsed',
+                                          'requests',
+                                          'statuses',
+                                          'latency',
+                                          'retries',
+                                          'backoff_wait',
+                                          'rate_limit_wait',
+                                          'lookups',
+                                          'frontier',
+                                          'search_filter',
+                                          'edges'])
+
+
+def endpoint_name(url):
+    """
+    Expects an API url. Returns its path with company numbers and officer
+    ids blanked out, e.g. "/company/{}/officers", so calls can be counted by
+    endpoint.
+    """
+    return re.sub(r'/(company|officers)/[^/]+', r'/\1/{}', urlsplit(url).path)
+
+
+def bucket_label(bound):
+    return "+inf" if bound == float("inf") else "{:g}".format(bound)
+
+
+class Metrics(object):
+    """
+    Running totals of chpy's events, plus callbacks to pass them on to. See
+    above for the events. Thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reset()
+
+    def reset(self):
+        """ Zeroes every total. Callbacks stay registered. """
+        with self._lock:
+            self.started = time.time()
+            self.requests = collections.Counter()
+            self.statuses = collections.defaultdict(collections.Counter)
+            self.latency = collections.defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+            self.latency_total = collections.Counter()
+            self.retries = collections.Counter()
+            self.backoff_wait = 0.0
+            self.rate_limit_wait = 0.0
+            self.rate_limit_waits = 0
+            self.lookups = collections.defaultdict(collections.Counter)
+            self.frontier = {}
+            self.search_filter = collections.Counter()
+            self.edges = collections.Counter()
+
+    def add_callback(self, callback):
+        """
+        Registers callback(event, fields) to be called with every event, on
+        whichever thread it happened. Exceptions it raises are logged and
+        otherwise ignored.
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+        return callback
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def emit(self, event, **fields):
+        with self._lock:
+            if event == "request":
+                endpoint, latency = fields['endpoint'], fields['latency']
+                self.requests[endpoint] += 1
+                self.statuses[endpoint][fields['status']] += 1
+                self.latency[endpoint][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+                self.latency_total[endpoint] += latency
+            elif event == "retry":
+                self.retries[fields['endpoint']] += 1
+                self.backoff_wait += fields['wait']
+            elif event == "rate_limit_wait":
+                self.rate_limit_wait += fields['seconds']
+                self.rate_limit_waits += 1
+            elif event == "lookup":
+                self.lookups[fields['source']]["hits" if fields['hit'] else "misses"] += 1
+            elif event == "frontier":
+                self.frontier[fields['depth']] = fields['size']
+            elif event == "search_filter":
+                self.search_filter.update(accepted = fields['accepted'],
+                                          rejected = fields['rejected'])
+            elif event == "edges":
+                self.edges.update(accepted = fields['accepted'],
+                                  rejected = fields['rejected'])
+            callbacks = list(self._callbacks)
+
+        for callback in callbacks:
+            try:
+                callback(event, fields)
+            except Exception:
+                logger.exception("Metrics callback %r failed on %s", callback, event)
+
+    def calls(self):
+        """ API calls made so far, retries included. """
+        with self._lock:
+            return sum(self.requests.values())
+
+    def snapshot(self):
+        """ The totals so far, as a MetricsSnapshot. """
+        with self._lock:
+            latency = {}
+            for endpoint, counts in self.latency.items():
+                total = sum(counts)
+                latency[endpoint] = {
+                    "count" : total,
+                    "mean" : self.latency_total[endpoint] / total if total else 0.0,
+                    "buckets" : {bucket_label(b) : c for b, c in zip(LATENCY_BUCKETS, counts)}}
+            lookups = {}
+            for source, counts in self.lookups.items():
+                done = counts["hits"] + counts["misses"]
+                lookups[source] = {"hits" : counts["hits"],
+                                   "misses" : counts["misses"],
+                                   "hit_rate" : counts["hits"] / done if done else 0.0}
+            return MetricsSnapshot(
+                elapsed = time.time() - self.started,
+                requests = dict(self.requests),
+                statuses = {e : dict(s) for e, s in self.statuses.items()},
+                latency = latency,
+                retries = dict(self.retries),
+                backoff_wait = self.backoff_wait,
+                rate_limit_wait = {"seconds" : self.rate_limit_wait,
+                                   "waits" : self.rate_limit_waits},
+                lookups = lookups,
+                frontier = dict(self.frontier),
+                search_filter = dict(self.search_filter),
+                edges = dict(self.edges))
+
+
+_default_metrics = Metrics()
+
+
+def get_metrics():
+    """ The Metrics shared by all of chpy. """
+    return _default_metrics
+
+
+def set_metrics(metrics):
+    """ Replaces the shared Metrics. Returns the previous one. """
+    global _default_metrics
+    previous = _default_metrics
+    _default_metrics = metrics
+    return previous
+
+
+def emit(event, **fields):
+    """ Reports an event to the shared Metrics. """
+    _default_metrics.emit(event, **fields)
@@ -0,0 +1,428 @@
+import argparse
+import http.server
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+"""
+A stand-in for the Companies House API, for testing and benchmarking.
+
+MockServer serves a SyntheticRegister -- a made-up network of companies,
+officers and pscs of whatever size and fan-out you like, generated from a
+seed so it's the same every time -- over HTTP on localhost, at the same
+paths as the real API:
+
+    /company/{number}
+    /company/{number}/officers
+    /company/{number}/persons-with-significant-control
+    /officers/{id}/appointments
+    /search/officers?q=...
+    /search/companies?q=...
+
+Lists are paginated as the API paginates them (items_per_page, start_index,
+total_results), every response carries the X-Ratelimit-* headers, and the
+server can be made slow (latency), flaky (error_rate, as 502s) or strict
+(limit calls per window, then 429s). Point chpy at it by swapping base_url:
+
+    server = MockServer(SyntheticRegister(companies = 500)).start()
+    chpy.search.base_url = server.url
+    G, edges, companies = get_company_network(server.root(), "any key", 2)
+
+Or run one on its own with `python -m chpy.mock --port 8000`. Calls made,
+by endpoint, are kept in `calls`, and served as JSON at /_mock/stats
+(GET /_mock/reset clears them); neither counts as a call.
+
+Some quirks of the real register are reproduced on purpose: a fifth of
+people have their appointments split over two officer ids, some companies
+have another company as an officer, and search results are ordered by how
+many words of the query they match rather than alphabetically.
+"""
+
+FORENAMES = ["John", "Mary", "David", "Sarah", "James", "Helen", "Peter",
+             "Susan", "Michael", "Anne", "Robert", "Claire", "Paul", "Emma"]
+SURNAMES = ["SMITH", "JONES", "TAYLOR", "BROWN", "WILLIAMS", "WILSON",
+            "JOHNSON", "DAVIES", "ROBINSON", "WRIGHT", "THOMPSON", "EVANS",
+            "WALKER", "WHITE", "ROBERTS", "GREEN", "HALL", "WOOD", "JACKSON"]
+WORDS = ["ACME", "NORTHERN", "HOLDINGS", "TRADING", "CAPITAL", "VENTURES",
+         "ALPHA", "BRIDGE", "CROWN", "DELTA", "EAGLE", "FALCON", "GLOBAL",
+         "HARBOUR", "IRON", "JADE", "KESTREL", "LION", "MERIDIAN", "NOBLE"]
+STREETS = ["High Street", "Church Road", "Station Road", "Victoria Road",
+           "Green Lane", "Manor Road", "Park Road", "Queens Road"]
+TOWNS = ["London", "Manchester", "Leeds", "Bristol", "Glasgow", "Cardiff"]
+ROLES = ["director", "secretary", "llp-member"]
+
+# The API's page sizes where the caller doesn't ask for one.
+DEFAULT_PAGE_SIZES = {"officers" : 35,
+                      "psc" : 25,
+                      "appointments" : 35,
+                      "search" : 20}
+MAX_PAGE_SIZE = 100
+
+
+def search_key(string):
+    return re.sub('[^A-Za-z0-9 ]+', '', string).lower().split()
+
+
+class SyntheticRegister(object):
+    """
+    A made-up company register.
+
+    Arguments:
+        - companies: number of companies.
+        - people: number of people, each holding a few appointments.
+        - fan_out: mean number of companies a person is appointed to
+          (exponentially distributed, so a few hold a great many).
+        - corporate_officers: share of companies with another company as
+          an officer.
+        - seed: the same seed always gives the same register.
+    """
+
+    def __init__(self, companies = 200, people = 300, fan_out = 4,
+                 corporate_officers = 0.1, seed = 0):
+        rng = random.Random(seed)
+        self.companies = {}
+        self.officers = {}
+        self.company_officers = {}
+        self.company_pscs = {}
+
+        for n in range(companies):
+            number = "{:08d}".format(n + 1)
+            name = "{} {} {} LIMITED".format(rng.choice(WORDS), rng.choice(WORDS), n + 1)
+            self.companies[number] = {
+                "company_name" : name,
+                "company_number" : number,
+                "company_status" : rng.choice(["active"] * 4 + ["dissolved"]),
+                "type" : "ltd",
+                "date_of_creation" : "{}-{:02d}-{:02d}".format(rng.randint(1990, 2019),
+                                                               rng.randint(1, 12),
+                                                               rng.randint(1, 28)),
+                "registered_office_address" : self.address(rng),
+                "sic_codes" : [str(rng.randint(10000, 99999))],
+                "links" : {"self" : "/company/{}".format(number)}}
+            self.company_officers[number] = []
+            self.company_pscs[number] = []
+
+        numbers = sorted(self.companies)
+        for p in range(people):
+            forename = rng.choice(FORENAMES)
+            surname = rng.choice(SURNAMES)
+            dob = {"month" : rng.randint(1, 12), "year" : rng.randint(1940, 1995)}
+            address = self.address(rng)
+            held = rng.sample(numbers, min(len(numbers), max(1, int(rng.expovariate(1 / fan_out)))))
+            # Some people have their appointments split over two officer ids.
+            ids = ["P{:06d}".format(p)]
+            if rng.random() < 0.2 and len(held) > 1:
+                ids.append("P{:06d}X".format(p))
+            for oid in ids:
+                self.officers[oid] = {"name" : "{}, {}".format(surname, forename),
+                                      "forename" : forename, "surname" : surname,
+                                      "date_of_birth" : dob, "address" : address,
+                                      "appointments" : []}
+            for j, number in enumerate(held):
+                self.appoint(ids[j % len(ids)], number, rng)
+            if rng.random() < 0.5:
+                self.company_pscs[held[0]].append(self.psc_record(ids[0], held[0]))
+
+        for number in numbers:
+            if rng.random() < corporate_officers:
+                parent = rng.choice(numbers)
+                if parent == number:
+                    continue
+                oid = "C" + parent
+                if oid not in self.officers:
+                    self.officers[oid] = {"name" : self.companies[parent]['company_name'],
+                                          "date_of_birth" : None,
+                                          "address" : self.companies[parent]['registered_office_address'],
+                                          "appointments" : []}
+                self.appoint(oid, number, rng)
+
+        self.search_index = [(set(search_key(o['name'])), oid)
+                             for oid, o in sorted(self.officers.items())]
+
+    def address(self, rng):
+        return {"premises" : str(rng.randint(1, 200)),
+                "address_line_1" : rng.choice(STREETS),
+                "locality" : rng.choice(TOWNS),
+                "postal_code" : "AB{} {}CD".format(rng.randint(1, 99), rng.randint(1, 9)),
+                "country" : "United Kingdom"}
+
+    def appoint(self, oid, number, rng):
+        role = rng.choice(ROLES)
+        appointed_on = "{}-{:02d}-{:02d}".format(rng.randint(1995, 2019),
+                                                 rng.randint(1, 12),
+                                                 rng.randint(1, 28))
+        self.officers[oid]['appointments'].append((number, role, appointed_on))
+        self.company_officers[number].append((oid, role, appointed_on))
+
+    def psc_record(self, oid, number):
+        o = self.officers[oid]
+        return {"name" : "Mr {} {}".format(o['forename'], o['surname'].title()),
+                "kind" : "individual-person-with-significant-control",
+                "name_elements" : {"forename" : o['forename'],
+                                   "surname" : o['surname'].title(),
+                                   "title" : "Mr"},
+                "date_of_birth" : o['date_of_birth'],
+                "address" : o['address'],
+                "nationality" : "British",
+                "country_of_residence" : "England",
+                "natures_of_control" : ["ownership-of-shares-75-to-100-percent"],
+                "notified_on" : "2016-04-06",
+                "links" : {"self" : "/company/{}/persons-with-significant-control/individual/{}"
+                                    .format(number, oid)}}
+
+    def root(self):
+        """ The company with the most officers: a good place to start a crawl. """
+        return max(sorted(self.company_officers),
+                   key = lambda n: len(self.company_officers[n]))
+
+    def officer_item(self, oid, role, appointed_on):
+        o = self.officers[oid]
+        item = {"name" : o['name'],
+                "officer_role" : role,
+                "appointed_on" : appointed_on,
+                "address" : o['address'],
+                "links" : {"officer" : {"appointments" : "/officers/{}/appointments".format(oid)}}}
+        if o['date_of_birth'] is not None:
+            item['date_of_birth'] = o['date_of_birth']
+            item['nationality'] = "British"
+            item['occupation'] = "Director"
+        return item
+
+    def page(self, items, query, list_type, **extra):
+        """ One page of a list, as the API pages it. """
+        per_page = int(query.get('items_per_page', [DEFAULT_PAGE_SIZES[list_type]])[0])
+        per_page = min(per_page, MAX_PAGE_SIZE)
+        start = int(query.get('start_index', ['0'])[0].replace(",", ""))
+        out = {"items" : items[start:start + per_page],
+               "items_per_page" : per_page,
+               "start_index" : start,
+               "total_results" : len(items)}
+        out.update(extra)
+        return out
+
+    def respond(self, path, query):
+        """
+        Expects a url path and parsed query string. Returns (status, data)
+        as the API would answer.
+        """
+        parts = [p for p in path.split("/") if p]
+        if parts[:1] == ["company"] and len(parts) >= 2:
+            company = self.companies.get(parts[1])
+            if company is None:
+                return 404, None
+            if len(parts) == 2:
+                return 200, company
+            if parts[2:] == ["officers"]:
+                items = [self.officer_item(*i) for i in self.company_officers[parts[1]]]
+                return 200, self.page(items, query, "officers", active_count = len(items))
+            if parts[2:] == ["persons-with-significant-control"]:
+                items = self.company_pscs[parts[1]]
+                if not items:
+                    return 404, None
+                return 200, self.page(items, query, "psc")
+
+        if parts[:1] == ["officers"] and parts[2:] == ["appointments"]:
+            o = self.officers.get(parts[1])
+            if o is None:
+                return 404, None
+            items = [{"name" : o['name'],
+                      "officer_role" : role,
+                      "appointed_on" : on,
+                      "address" : o['address'],
+                      "appointed_to" : {"company_name" : self.companies[n]['company_name'],
+                                        "company_number" : n,
+                                        "company_status" : self.companies[n]['company_status']},
+                      "links" : {"company" : "/company/{}".format(n)}}
+                     for n, role, on in o['appointments']]
+            extra = {"name" : o['name'],
+                     "kind" : "personal-appointment",
+                     "links" : {"self" : "/officers/{}/appointments".format(parts[1])}}
+            if o['date_of_birth'] is not None:
+                extra['date_of_birth'] = o['date_of_birth']
+            return 200, self.page(items, query, "appointments", **extra)
+
+        if parts == ["search", "officers"]:
+            words = set(query.get('q', [''])[0].replace("+", " ").split())
+            items = [{"title" : self.officers[oid]['name'],
+                      "address" : self.officers[oid]['address'],
+                      "date_of_birth" : self.officers[oid]['date_of_birth'],
+                      "appointment_count" : len(self.officers[oid]['appointments']),
+                      "links" : {"self" : "/officers/{}/appointments".format(oid)}}
+                     for tokens, oid in self.search_index if words & tokens]
+            items.sort(key = lambda i: -len(words & set(search_key(i['title']))))
+            for i in items:
+                if i['date_of_birth'] is None:
+                    del i['date_of_birth']
+            return 200, self.page(items, query, "search")
+
+        if parts == ["search", "companies"]:
+            words = set(query.get('q', [''])[0].replace("+", " ").split())
+            items = [{"title" : c['company_name'],
+                      "company_number" : c['company_number'],
+                      "company_status" : c['company_status']}
+                     for c in self.companies.values()
+                     if words and words <= set(search_key(c['company_name']))]
+            return 200, self.page(items, query, "search")
+
+        return 404, None
+
+
+class MockServer(object):
+    """
+    Serves a SyntheticRegister over HTTP on localhost, in a background
+    thread.
+
+    Arguments:
+        - register: the SyntheticRegister to serve; a default-sized one if
+          not given.
+        - latency: seconds to sleep before answering each call.
+        - error_rate: share of calls answered with a 502.
+        - limit, window: calls allowed per API key per window (seconds),
+          after which calls get 429s until the window rolls over.
+        - port: 0 picks a free one; see url.
+        - seed: seeds the error injection.
+    """
+
+    def __init__(self, register = None, latency = 0.0, error_rate = 0.0,
+                 limit = 600, window = 300, port = 0, seed = 0):
+        self.register = register if register is not None else SyntheticRegister()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.limit = limit
+        self.window = window
+        self.rng = random.Random(seed)
+        self.calls = {}
+        self.used = {}
+        self.window_start = time.time()
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            wbufsize = 1 << 16
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.httpd.server_port)
+
+    def root(self):
+        return self.register.root()
+
+    def stats(self):
+        with self.lock:
+            return {"calls" : dict(self.calls), "total" : sum(self.calls.values())}
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.used = {}
+            self.window_start = time.time()
+
+    def send(self, request, status, data, headers = ()):
+        body = json.dumps(data if data is not None else {"errors" : []}).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        for header in headers:
+            request.send_header(*header)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def handle(self, request):
+        parts = urlsplit(request.path)
+        if parts.path == "/_mock/stats":
+            return self.send(request, 200, dict(self.stats(), root = self.root()))
+        if parts.path == "/_mock/reset":
+            self.reset()
+            return self.send(request, 200, self.stats())
+
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.used = {}
+            key = request.headers.get('Authorization', '')
+            self.used[key] = self.used.get(key, 0) + 1
+            remain = self.limit - self.used[key]
+            error = self.rng.random() < self.error_rate
+            endpoint = re.sub(r'/(company|officers)/[^/]+', r'/\1/{}', parts.path)
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            reset = int(self.window_start + self.window)
+        if self.latency:
+            time.sleep(self.latency)
+
+        if remain < 0:
+            status, data = 429, None
+        elif error:
+            status, data = 502, None
+        else:
+            status, data = self.register.respond(parts.path, parse_qs(parts.query))
+        self.send(request, status, data,
+                  [("X-Ratelimit-Limit", str(self.limit)),
+                   ("X-Ratelimit-Remain", str(max(remain, 0))),
+                   ("X-Ratelimit-Reset", str(reset)),
+                   ("X-Ratelimit-Window", "{}s".format(self.window))])
+
+    def start(self):
+        self.thread = threading.Thread(target = self.httpd.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Serve a synthetic Companies House register.")
+    parser.add_argument("--port", type = int, default = 0)
+    parser.add_argument("--companies", type = int, default = 200)
+    parser.add_argument("--people", type = int, default = 300)
+    parser.add_argument("--fan-out", type = float, default = 4)
+    parser.add_argument("--corporate-officers", type = float, default = 0.1)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--latency", type = float, default = 0.0)
+    parser.add_argument("--error-rate", type = float, default = 0.0)
+    parser.add_argument("--limit", type = int, default = 600)
+    parser.add_argument("--window", type = float, default = 300)
+    args = parser.parse_args(argv)
+
+    register = SyntheticRegister(companies = args.companies,
+                                 people = args.people,
+                                 fan_out = args.fan_out,
+                                 corporate_officers = args.corporate_officers,
+                                 seed = args.seed)
+    server = MockServer(register, latency = args.latency, error_rate = args.error_rate,
+                        limit = args.limit, window = args.window, port = args.port)
+    # The first line out is the url, for anything starting this as a subprocess.
+    print(server.url, flush = True)
+    print("Root company: {}".format(server.root()), flush = True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
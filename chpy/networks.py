@@ -1,7 +1,11 @@
+import logging
 import networkx as nx
+from fuzzywuzzy import fuzz
 from chpy.utils import *
 from chpy.search import *
 
+logger = logging.getLogger(__name__)
+
 def make_node_simple(item, graph):
     item = flatten_dict(item, sep = ".")
     graph.add_node(item['name'])
@@ -24,7 +28,7 @@ def make_node_from_officer(item, graph, api_key, thresh = 95):
         # print("Making Corporate Node: {}".format(item['name']))
         searched = get_company_search(item['name'], api_key)['items'][0]
         if fuzz.partial_ratio(searched['title'].lower(), item['name'].lower()) > thresh:
-            print("Good fuzz")
+            logger.debug("Good fuzz")
             profile = get_company(searched['company_number'], "profile", api_key)
             make_node_from_company(profile, graph)
         else:
@@ -66,3 +70,42 @@ def make_edge_from_officer(officer, company, graph):
     graph.add_edge(officer['name'], company['company_name'])
     for i in officer:
         graph.edges[officer['name'], company['company_name']][i] = officer[i]
+
+#########################################
+#########################################
+
+def root_provenance(G, ct, roots, depth):
+    """
+    Expects the graph and company table from build_network(), the root
+    company numbers of a crawl from several and its depth. Returns a dict of
+    each node reached to the roots that reach it, in the order given and
+    separated by ";" (so it can go in a GEXF or GraphML file).
+
+    A root reaches a node if it's in the root's own network to that depth,
+    i.e. no more than 2 * depth steps away in the graph, ignoring direction:
+    each level of the crawl goes from a company to its officers and pscs,
+    and from them to the companies they're appointed to. So it doesn't
+    matter which root the shared crawl happened to find a node from first.
+
+    It goes by the merged graph, though, where people with the same name are
+    one node (see build_network()), so a root can reach a little further
+    than a crawl from it alone would have.
+    """
+    names = {}
+    for number, name in zip(ct['company_number'], ct['company_name']):
+        if number in roots and name == name:
+            names.setdefault(number, name)
+
+    undirected = G.to_undirected(as_view = True)
+    reached = {}
+    for number in roots:
+        name = names.get(number)
+        if name is None:
+            continue
+        if name in G:
+            found = nx.single_source_shortest_path_length(undirected, name, cutoff = 2 * depth)
+        else:
+            found = [name]
+        for node in found:
+            reached.setdefault(node, []).append(number)
+    return {node : ";".join(numbers) for node, numbers in reached.items()}
@@ -0,0 +1,162 @@
+import asyncio
+import re
+import threading
+import time
+
+"""
+Rate limiting for the Companies House API.
+
+The API allows 600 calls per five minute window and reports where we are in
+that window on every response, through the X-Ratelimit-Limit,
+X-Ratelimit-Remain, X-Ratelimit-Reset and X-Ratelimit-Window headers.
+
+Rather than running flat out and then sleeping until the window resets (the
+old utils.rate_limit() approach), RateLimiter is a token bucket that releases
+calls at an even pace across the window (~2/second by default), and uses the
+headers to stay in step with what the server thinks we have left.
+"""
+
+
+def parse_window(value):
+    """
+    Expects an X-Ratelimit-Window header value, e.g. "5m", "300s" or "300".
+    Returns the window length in seconds, or None if it can't be read.
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*$', str(value))
+    if match is None:
+        return None
+    return float(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[match.group(2)]
+
+
+class RateLimiter(object):
+    """
+    A thread-safe token bucket. One instance can be shared by any number of
+    threads and asyncio tasks: acquire() blocks the calling thread, while
+    aacquire() awaits without blocking the event loop.
+
+    Arguments:
+        - limit: calls allowed per window.
+        - window: window length in seconds.
+        - burst: most calls that can go out back-to-back after a quiet spell.
+
+    The total time spent waiting is kept in `waited` (seconds) and `waits`
+    (number of calls that had to wait). See also stats().
+    """
+
+    def __init__(self, limit = 600, window = 300, burst = 10):
+        self.limit = limit
+        self.window = window
+        self.burst = burst
+        self.rate = limit / window
+
+        self.tokens = float(burst)
+        self.remaining = limit
+        self.reset_at = None
+        self.resume_at = None
+
+        self.calls = 0
+        self.waits = 0
+        self.waited = 0.0
+
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # Back to the normal pace once the server's window has rolled over.
+        if self.reset_at is not None and now >= self.reset_at:
+            self.rate = self.limit / self.window
+            self.remaining = self.limit
+            self.reset_at = None
+            self.resume_at = None
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """
+        Takes a token and returns the number of seconds the caller must wait
+        before using it. Callers that don't want to sleep themselves should
+        use acquire() or aacquire() instead.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            self.remaining -= 1
+            self.calls += 1
+
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if self.resume_at is not None:
+                wait = max(wait, self.resume_at - now)
+            if wait > 0:
+                self.waits += 1
+                self.waited += wait
+            return wait
+
+    def acquire(self):
+        """ Blocks until a call may be made. Returns the time waited. """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self):
+        """ As acquire(), but awaits rather than blocking the event loop. """
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def update(self, headers):
+        """
+        Brings the bucket in line with the X-Ratelimit-* headers of a
+        response. If the server says we have less left than we thought (e.g.
+        the key is being used elsewhere), the pace is slowed so that what
+        remains is spread over the rest of the window; if it says we have
+        nothing left, calls are held until the window resets.
+        """
+        try:
+            remain = int(headers['X-Ratelimit-Remain'])
+            reset = float(headers['X-Ratelimit-Reset'])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        with self._lock:
+            now = time.monotonic()
+
+            window = parse_window(headers.get('X-Ratelimit-Window'))
+            if window:
+                self.window = window
+            try:
+                self.limit = int(headers['X-Ratelimit-Limit'])
+            except (KeyError, TypeError, ValueError):
+                pass
+
+            self._refill(now)
+
+            left = max(reset - time.time(), 1.0)
+            self.reset_at = now + left
+            self.remaining = remain
+            self.tokens = min(self.tokens, remain)
+            if remain > 0:
+                self.rate = min(self.limit / self.window, remain / left)
+                self.resume_at = None
+            else:
+                self.rate = self.limit / self.window
+                self.resume_at = self.reset_at
+
+    def available(self):
+        """
+        Best estimate of the calls we can still make in the current window.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(self.remaining, 0)
+
+    def stats(self):
+        with self._lock:
+            return {"calls" : self.calls,
+                    "waits" : self.waits,
+                    "waited" : self.waited,
+                    "rate" : self.rate,
+                    "remaining" : self.remaining}
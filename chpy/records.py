@@ -0,0 +1,244 @@
+import json
+from collections.abc import MutableMapping
+
+from chpy.metrics import endpoint_name
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+Typed, compact records for API responses, and fast JSON.
+
+loads() and dumps() are what chpy decodes and encodes JSON with: responses,
+the memo, the cache and the crawl's streams. With orjson installed (pip
+install orjson) they're several times quicker than the json module; without
+it they fall back to it, and so they do for anything orjson won't handle
+(integers over 64 bits, say).
+
+A response decoded as it comes is a tree of dicts holding every field the
+API sends, most of which chpy never looks at. Give the Transport compact =
+True and get_generic() turns each response into typed records instead:
+
+    - CompanyProfile: a company profile.
+    - Officer: an item in a company's officer list.
+    - PSC: an item in a company's psc list.
+    - Appointment: an item in an officer's appointment list.
+    - SearchHit: an item in officer or company search results.
+
+Each keeps just the fields listed in its FIELDS -- the ones the crawl and
+build_network() use, or that end up in the edge list, company table and
+graph -- in __slots__ rather than a dict, plus the fields chpy adds as it
+marks records up (MARKS). Nested fields (addresses, links, ...) stay dicts,
+cut down to what's listed. List responses stay dicts too, with their items
+as records. Records behave like dicts, so the rest of chpy doesn't care which
+it's given, except that setting a field a record doesn't keep is a KeyError.
+
+That makes a crawl's records several times smaller. The catch is that fields
+not listed are gone, so they won't be in the outputs either; hence it's off
+by default.
+"""
+
+# Fields chpy adds to records as it goes: see mark_result(),
+# mark_appointments() and crawl_network().
+MARKS = ("name", "address", "date_of_birth", "query_type", "node_type",
+         "iteration", "source", "target", "_index", "done")
+
+
+def loads(data):
+    """ Decodes JSON from bytes or a str. """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def dumps(obj):
+    """ Encodes obj, which may hold records, as a JSON str. """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default = plain).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, default = plain)
+
+
+def plain(obj):
+    """ For json's default argument: records as dicts. """
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError("Object of type {} is not JSON serializable"
+                    .format(type(obj).__name__))
+
+
+def keep_spec(fields):
+    """
+    Turns a FIELDS tuple of dotted paths into {field : None (keep all of
+    it) or the same again for its subfields}, as used by prune().
+    """
+    spec = {}
+    for field in fields:
+        level = spec
+        parts = field.split(".")
+        for part in parts[:-1]:
+            if level.get(part, {}) is None:
+                break
+            level = level.setdefault(part, {})
+        else:
+            level[parts[-1]] = None
+    return spec
+
+
+def prune(value, spec):
+    """ A nested value cut down to the subfields in spec. """
+    if spec is None or not isinstance(value, dict):
+        return value
+    return {k : prune(v, spec[k]) for k, v in value.items() if k in spec}
+
+
+def slot_names(fields):
+    """ The __slots__ for a record keeping fields, plus MARKS. """
+    names = []
+    for field in fields + MARKS:
+        name = field.split(".")[0]
+        if name not in names:
+            names.append(name)
+    return tuple(names)
+
+
+class Record(MutableMapping):
+    """
+    Base for the typed records: a dict-like object holding the fields
+    listed in its class's FIELDS (and MARKS) that it was given, in slots.
+    Each subclass sets:
+
+        FIELDS = (...)
+        __slots__ = slot_names(FIELDS)
+        _keep = keep_spec(FIELDS + MARKS)
+    """
+    __slots__ = ()
+    FIELDS = ()
+    _keep = {}
+
+    def __init__(self, data = None):
+        keep = self._keep
+        for key, value in (data or {}).items():
+            if key in keep:
+                setattr(self, key, prune(value, keep[key]))
+
+    def __getitem__(self, key):
+        if key in self._keep:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def get(self, key, default = None):
+        if key in self._keep:
+            return getattr(self, key, default)
+        return default
+
+    def __contains__(self, key):
+        return key in self._keep and hasattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._keep:
+            raise KeyError("{} records don't keep {!r}".format(type(self).__name__, key))
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self._keep:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.__slots__:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def to_dict(self):
+        return {key : getattr(self, key) for key in self}
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.to_dict())
+
+
+class CompanyProfile(Record):
+    FIELDS = ("company_name", "company_number", "company_status", "type",
+              "date_of_creation", "date_of_cessation", "jurisdiction", "sic_codes",
+              "registered_office_address", "links.self")
+    __slots__ = slot_names(FIELDS)
+    _keep = keep_spec(FIELDS + MARKS)
+
+
+class Officer(Record):
+    FIELDS = ("officer_role", "appointed_on", "resigned_on", "appointed_before",
+              "is_pre_1992_appointment", "nationality", "country_of_residence",
+              "occupation", "identification", "name_elements", "links.self",
+              "links.officer.appointments")
+    __slots__ = slot_names(FIELDS)
+    _keep = keep_spec(FIELDS + MARKS)
+
+
+class PSC(Record):
+    FIELDS = ("kind", "natures_of_control", "notified_on", "ceased_on", "nationality",
+              "country_of_residence", "identification", "name_elements", "links.self")
+    __slots__ = slot_names(FIELDS)
+    _keep = keep_spec(FIELDS + MARKS)
+
+
+class Appointment(Record):
+    FIELDS = ("officer_role", "appointed_on", "resigned_on", "appointed_before",
+              "is_pre_1992_appointment", "appointed_to.company_name",
+              "appointed_to.company_number", "appointed_to.company_status",
+              "nationality", "country_of_residence", "occupation", "identification",
+              "name_elements", "links.company")
+    __slots__ = slot_names(FIELDS)
+    _keep = keep_spec(FIELDS + MARKS)
+
+
+class SearchHit(Record):
+    FIELDS = ("title", "company_number", "company_status", "links.self")
+    __slots__ = slot_names(FIELDS)
+    _keep = keep_spec(FIELDS + MARKS)
+
+
+# The record for each endpoint's response, or its items for lists.
+RESPONSES = {"/company/{}" : CompanyProfile,
+             "/company/{}/officers" : Officer,
+             "/company/{}/persons-with-significant-control" : PSC,
+             "/officers/{}/appointments" : Appointment,
+             "/search/officers" : SearchHit,
+             "/search/companies" : SearchHit}
+
+
+def from_response(url, data):
+    """
+    Expects an API url and the data it returned. Returns the data as
+    records, or as it is if it isn't something there's a record for (or is
+    records already).
+    """
+    record = RESPONSES.get(endpoint_name(url))
+    if record is None or type(data) != dict:
+        return data
+    if record is CompanyProfile:
+        return CompanyProfile(data)
+    items = data.get('items')
+    if type(items) != list:
+        return data
+    return dict(data, items = [i if isinstance(i, Record) else record(i) for i in items])
+
+
+def is_record(item):
+    """ True for a dict or a Record, i.e. anything chpy treats as a record. """
+    return isinstance(item, (dict, Record))
@@ -1,54 +1,102 @@
-import requests
-from fuzzywuzzy import fuzz
-
+import collections
+import logging
 import math
-import time                                      ## For rate limiting
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from chpy.utils import *
+from chpy.transport import Transport, get_transport, set_transport
+from chpy.ratelimit import RateLimiter
+from chpy.keys import KeyPool
+from chpy.cache import ResponseCache
+from chpy.metrics import emit, endpoint_name
+from chpy.records import loads, from_response
+
+logger = logging.getLogger(__name__)
 
 
 base_url = "https://api.companieshouse.gov.uk"
 
-def get_generic(url, api_key):
+def get_generic(url, api_key, transport = None):
     """
     Workhorse generic API call function. Relies on other functions to
     generate complete call urls, then applies rate limiting and error-checking.
+
+    The call itself is made by a Transport (see chpy.transport), which pools
+    connections, applies timeouts, paces calls through its RateLimiter and
+    retries 429s and 5xxs with backoff. Unless one is passed in, the shared
+    default Transport is used. If the Transport has a SnapshotStore of bulk
+    data (see chpy.snapshot) or a ResponseCache (see chpy.cache), they are
+    checked first, in that order, and the cache is filled on the way back.
+    In front of all of that, a crawl's RequestMemo (see chpy.memo) makes
+    sure each url is only fetched once per crawl. If the Transport is
+    compact, the data comes back as records (see chpy.records).
+
+    api_key can be a single key, a list of keys or a chpy.keys.KeyPool; the
+    same goes for every function in chpy that takes an api_key.
+    """
+
+    if transport is None:
+        transport = get_transport()
+
+    memo = transport.memo
+    if memo is not None:
+        data = memo.get(url, lambda: fetch_generic(url, api_key, transport))
+    else:
+        data = fetch_generic(url, api_key, transport)[1]
+    if transport.compact:
+        return from_response(url, data)
+    return data
+
+def fetch_generic(url, api_key, transport):
     """
+    get_generic() without the memo. Returns (status, data), where status is
+    200 or 404 for answers worth remembering (from the snapshot or cache too)
+    and anything else, or None, for failures.
+    """
+    # Answer from local bulk data, or the cache, where we can.
+    snapshot = transport.snapshot
+    if snapshot is not None:
+        hit, local = snapshot.get(url)
+        emit("lookup", source = "snapshot", endpoint = endpoint_name(url), hit = hit)
+        if hit:
+            return (404 if local is None else 200), local
+
+    cache = transport.cache
+    if cache is not None:
+        hit, cached = cache.get(url)
+        emit("lookup", source = "cache", endpoint = endpoint_name(url), hit = hit)
+        if hit:
+            return (404 if cached is None else 200), cached
 
     # print(url)
-    data = requests.get(url, auth=(api_key, ""))
-    rate_limit(data)
+    data = transport.get(url, api_key)
+    if data is None:
+        return None, None
 
     if data.status_code == 200:
         ## Output is in a try/except, as I had some very rare errors crop up.
         try:
-            return data.json()
-        except JSONDecodeError:
+            out = loads(data.content)
+        except ValueError:
             # print("Error: JSON")
             # data = {"total_results" : 0, "fail" : True}
-            return
-    elif data.status_code == 502:
-        for i in range(1,10):
-            data = requests.get(url, auth=(api_key, ""))
-            if data.status_code == 200:
-                ## Output is in a try/except, as I had some very rare errors crop up.
-                try:
-                    return data.json()
-                except JSONDecodeError:
-                    # print("Error: JSON")
-                    # data = {"total_results" : 0, "fail" : True}
-                    return
-            else:
-                pass
-        return
+            return None, None
+        if cache is not None:
+            cache.set(url, 200, out)
+        return 200, out
+    elif data.status_code == 404:
+        if cache is not None:
+            cache.set(url, 404, None)
+        return 404, None
     else:
         # print("Error", data.status_code)
         # print(url)
         # print(data)
         # data = {"total_results" : 0, "fail" : True}
-        return
+        return data.status_code, None
 
-def get_company(number, search_type, api_key, iteration = None):
+def get_company(number, search_type, api_key, iteration = None, transport = None):
     """
     Multi-functional function to get data from a known company number.
     search_type expects:
@@ -56,19 +104,32 @@ def get_company(number, search_type, api_key, iteration = None):
         - "officers": returning a list of company officers
         - "psc": returning persons of significant control
     """
+    url = company_url(number, search_type)
+    if url is None:
+        logger.warning("Please specify 'profile', 'officers', or 'psc'")
+        return
+
+    data = get_generic(url, api_key, transport = transport)
+    return mark_company_data(data, search_type, iteration = iteration)
+
+def company_url(number, search_type):
+    """
+    Builds the url used by get_company(). Returns None if the search_type
+    isn't one of "profile", "officers" or "psc".
+    """
     if search_type == "profile":
-        url = "{}/company/{}".format(base_url, number)
+        return "{}/company/{}".format(base_url, number)
     elif search_type == "officers":
-        url = "{}/company/{}/officers".format(base_url, number)
+        return "{}/company/{}/officers".format(base_url, number)
     elif search_type == "psc":
-        url = "{}/company/{}/persons-with-significant-control" \
+        return "{}/company/{}/persons-with-significant-control" \
         .format(base_url, number)
-    else:
-        print("Please specify 'profile', 'officers', or 'psc'")
-        return
-
-    data = get_generic(url, api_key)
 
+def mark_company_data(data, search_type, iteration = None):
+    """
+    Runs mark_result() over a resource returned for get_company(), item by
+    item for lists. Returns None if there was nothing to mark.
+    """
     try:
         if data.get("items") != None:
             for item in data['items']:
@@ -85,19 +146,21 @@ def get_company(number, search_type, api_key, iteration = None):
 
 
 
-def get_search_officers(string, api_key, items_per_page = 100, start_index = 0):
+def get_search_officers(string,
+                        api_key,
+                        items_per_page = 100,
+                        start_index = 0,
+                        transport = None):
     """
     Searches for company officers based on a string, returns an OfficerSearch
     resource. Later used by paginate_search() and search_filter() to trawl
     through multiple pages of potential hits.
     """
 
-    s_string = prep_for_search(string)
-    url = "{}/search/officers?q={}&items_per_page={}&start_index={}" \
-    .format(base_url, s_string, items_per_page, format_nums(start_index))
+    url = officer_search_url(string, items_per_page, start_index)
     # print(url)
 
-    data = get_generic(url, api_key)
+    data = get_generic(url, api_key, transport = transport)
 
     # if data['total_results'] == 0:
     #     print("No results found for {}".format(string))
@@ -105,10 +168,16 @@ def get_search_officers(string, api_key, items_per_page = 100, start_index = 0):
     # else:
     return data
 
+def officer_search_url(string, items_per_page = 100, start_index = 0):
+    s_string = prep_for_search(string)
+    return "{}/search/officers?q={}&items_per_page={}&start_index={}" \
+    .format(base_url, s_string, items_per_page, format_nums(start_index))
+
 def get_officer_appointments(uri,
                              api_key,
                              items_per_page = 100,
-                             start_index = 0):
+                             start_index = 0,
+                             transport = None):
     """
     Returns an appointmentList resource based on an officer's uri. Used by
     paginate_search().
@@ -116,12 +185,36 @@ def get_officer_appointments(uri,
     #roomforimprovement: This could actually be fed most of the url directly
     without calling the get_officer_uid() function.
     """
-    url = "{}/officers/{}/appointments?items_per_page={}&start_index={}" \
-    .format(base_url, uri, items_per_page, format_nums(start_index))
-    data = get_generic(url, api_key)
+    url = officer_appointments_url(uri, items_per_page, start_index)
+    data = get_generic(url, api_key, transport = transport)
     return data
 
-def search_filter(search_results, check_against, thresh = 90):
+def officer_appointments_url(uri, items_per_page = 100, start_index = 0):
+    return "{}/officers/{}/appointments?items_per_page={}&start_index={}" \
+    .format(base_url, uri, items_per_page, format_nums(start_index))
+
+MatchQuery = collections.namedtuple('MatchQuery', ['name', 'address', 'record'])
+
+def sort_tokens(string):
+    return " ".join(sorted(string.split()))
+
+def join_address(address):
+    return " ".join([i for i in address.values()])
+
+def match_query(check_against):
+    """
+    Expects an officer record. Returns its name and address normalised as
+    search_filter() compares them, so that's done once per record rather than
+    once per search result.
+    """
+    # chpy.dedupe is imported where it's used, here and below, so single
+    # lookups (chpy company, say) don't load numpy and rapidfuzz.
+    from chpy.dedupe import process_name
+    return MatchQuery(sort_tokens(process_name(check_against['name'])),
+                      process_name(join_address(check_against['address'])),
+                      check_against)
+
+def search_filter(search_results, check_against, thresh = 90, scores = False):
     """
     A critical function which works to address the absence of effective uids
     for officer appointment resources. It matches search results with
@@ -141,6 +234,8 @@ def search_filter(search_results, check_against, thresh = 90):
           by it, automatically performing different checks on the basis of
           entity-type (i.e. "Individual" or "Corporate").
         - It could provide some form of confidence score in the reult provided.
+          Done: pass scores = True to get each hit's name, address and date of
+          birth scores alongside it.
         - It is currently configured with a conservative sampling methodology
           in mind, additional options (aside from the threshold) could be
           provided to relax criteria.
@@ -164,46 +259,81 @@ def search_filter(search_results, check_against, thresh = 90):
         - Being too open presents serious issues of false positivity, for
           example where an officer is called "John Smith", significant
           numbers of false positives could be found.
-    """
-    out_data = []
 
+    Scoring is done a page at a time (see chpy.dedupe.score_against()): the
+    record's name and address are normalised once, by match_query(), and the
+    page's names and addresses are scored against them in one go. Pass
+    match_query(record) as check_against to reuse it across pages. The
+    scores are fuzzywuzzy's, or rapidfuzz's equivalents; chpy.dedupe says
+    how closely those agree.
+    """
     # try:
     #     if search_results['total_results'] == 0:
     #         return
     # except TypeError:
     #     print(search_results)
 
-    search_results = strip_headers(search_results)
-
-    for search_result in search_results:
-        ## Name check vs. fuzz
-        name_check = fuzz.token_sort_ratio(
-        search_result['title'].lower(),
-        check_against['name'].lower()) > thresh
+    from chpy.dedupe import process_name, score_against
 
-        search_add = " ".join(
-        [i for i in search_result['address'].values()])
-        check_add = " ".join(
-        [i for i in check_against['address'].values()])
+    search_results = list(strip_headers(search_results))
+    if len(search_results) == 0:
+        return []
+    if not isinstance(check_against, MatchQuery):
+        check_against = match_query(check_against)
 
-        add_check = fuzz.token_set_ratio(search_add.lower(), check_add.lower()) > thresh
+    ## Name check (token_sort_ratio) and address check (token_set_ratio)
+    name_scores = score_against(check_against.name,
+                                [sort_tokens(process_name(i['title']))
+                                 for i in search_results],
+                                "ratio")
+    add_scores = score_against(check_against.address,
+                               [process_name(join_address(i['address']))
+                                for i in search_results],
+                               "token_set_ratio")
 
+    out_data = []
+    for search_result, name_score, add_score in zip(search_results, name_scores, add_scores):
         try:
-            dob_check = search_result['date_of_birth'] == check_against['date_of_birth']
+            dob_check = search_result['date_of_birth'] == check_against.record['date_of_birth']
         except (TypeError, KeyError) as e:
             dob_check = False
 
-
+        name_check = name_score > thresh
+        add_check = add_score > thresh
         if (name_check and add_check) or (name_check and dob_check):
-            out_data.append(search_result)
+            if scores:
+                out_data.append((search_result, {"name" : name_score,
+                                                 "address" : add_score,
+                                                 "date_of_birth" : dob_check}))
+            else:
+                out_data.append(search_result)
 
+    emit("search_filter", accepted = len(out_data),
+         rejected = len(search_results) - len(out_data))
     return out_data
 
+# Threads shared by every paginate_search() for fetching pages ahead.
+PREFETCH_WORKERS = 8
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+def page_pool():
+    """ The thread pool paginate_search() prefetches pages on, created on first use. """
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ThreadPoolExecutor(max_workers = PREFETCH_WORKERS,
+                                            thread_name_prefix = "chpy-pages")
+        return _page_pool
+
 def paginate_search(in_data,
                     search_type,
                     api_key,
                     start_index = 0,
-                    items_per_page = 100):
+                    items_per_page = 100,
+                    prefetch = True,
+                    max_pages = None,
+                    transport = None):
     """
     Another large and important function. This paginates through resources
     that are returned across multiple pages (i.e. search results and
@@ -230,47 +360,106 @@ def paginate_search(in_data,
           necessary.
         - I should probably find a way to integrate the get_company_search()
           function.
-    """
 
-    out_data = []
+    Note the walk: the first page is read twice (harmless for searches,
+    whose hits are de-duplicated, but appointment lists get it twice), and
+    the last page is never read. It's kept that way so results don't change,
+    but the last page is no longer fetched just to be thrown away.
+
+    max_pages stops the walk once that many different pages have been read.
+    get_appointments() only ever looks at the first page of an appointment
+    list, so it asks for that one alone.
+
+    The walk itself is walk_pages(), shared with apaginate_search(). With
+    prefetch (the default), pages are fetched ahead on a shared thread pool
+    rather than one after another. Appointment lists are always read
+    to the end (or max_pages), so once the first page says how many there
+    are, the rest are all fetched at once. Searches can stop early, so only the next page
+    is fetched while the current one is filtered; if the search stops there,
+    that one call is wasted. Either way the pages are read in the same order
+    and the output is the same.
+
+    Pages are fetched through transport, or the shared Transport if it's None.
+    """
 
     # Set type of search and call appropriate function.
     if search_type == "search":
         query = in_data['name']
-        # print("SRCHQ: ", query)
-        data = get_search_officers(query, api_key,
-                                   items_per_page, start_index)
-
+        fetch = get_search_officers
     elif search_type == "appointments":
         query = get_officer_uid(in_data)
-        # print("APPT Q: ", query)
-        data = get_officer_appointments(query, api_key,
-                                        items_per_page, start_index)
-
+        fetch = get_officer_appointments
     else:
-        print("Please specify 'search' or 'appointments'")
+        logger.warning("Please specify 'search' or 'appointments'")
         return
 
-    # if data['total_results'] == 0:
-    #     return data
+    walk = walk_pages(in_data, search_type, start_index, items_per_page, max_pages)
+    ahead = {}
+    try:
+        request, arg = next(walk)
+        while True:
+            if request == "ahead":
+                for start in arg if prefetch else ():
+                    if start not in ahead:
+                        ahead[start] = page_pool().submit(fetch, query, api_key,
+                                                          items_per_page, start,
+                                                          transport = transport)
+                request, arg = walk.send(None)
+            elif arg in ahead:
+                request, arg = walk.send(ahead.pop(arg).result())
+            else:
+                request, arg = walk.send(fetch(query, api_key, items_per_page, arg,
+                                               transport = transport))
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        # Anything fetched ahead for a search that stopped early.
+        for future in ahead.values():
+            future.cancel()
+
+def walk_pages(in_data, search_type, start_index = 0, items_per_page = 100, max_pages = None):
+    """
+    The walk through the pages behind paginate_search() and
+    apaginate_search(), as a generator, so that the sync and async versions
+    share it. It yields requests and is sent back what they ask for:
+
+        - ("get", start): the page starting at start. Send it back.
+        - ("ahead", [start, ...]): pages that will be asked for later, to
+          fetch ahead if wanted. Send back None.
+
+    It returns what paginate_search() does.
+    """
+    out_data = []
+    data = yield "get", start_index
 
     # Pull total number of results from header.
     total_results = data['total_results']
     if total_results == 0:
         return
+    if search_type == "search":
+        match = match_query(in_data)
     # Iterate through the number pages required (identified by dividing the
     # total_results by items_per_page)
     total_pages = math.ceil(total_results/items_per_page)
+
+    # Page n is read at iteration n + 1, and only pages 1 to total_pages - 2
+    # are read after the first (and none from max_pages on).
+    last_page = total_pages - 1 if max_pages is None else min(total_pages - 1, max_pages)
+
+    def starts(pages):
+        return [page * items_per_page for page in pages if 0 < page < last_page]
+
+    if search_type == "appointments":
+        yield "ahead", starts(range(1, total_pages))
+
     for iteration in range(total_pages):
-        # try:
+        if search_type == "search":
+            yield "ahead", starts([max(iteration, 1)])
 
         data_len = len(data['items'])
 
-        # except (TypeError, KeyError) as e:
-        #     print("Insufficient information for search")
-        #     return
         if search_type == "search":
-            filtered_data = search_filter(data, in_data)
+            filtered_data = search_filter(data, match)
             # For the "search" type, we'll start running out of "good" results
             # at some point. This try/except block gives up when we stop getting
             # a reasonable amount of hits.
@@ -292,64 +481,158 @@ def paginate_search(in_data,
         if hit_rate < 0.2:
             break
 
+        # Iteration n has read pages 0 to n - 1 (and iteration 0, page 0).
+        if max_pages is not None and max(iteration, 1) >= max_pages:
+            break
+
         if iteration == 0:
              continue
 
-        start_index = iteration * items_per_page
+        # The last page is never read, so there's no need to fetch it.
+        if iteration == total_pages - 1:
+            break
+
+        data = yield "get", iteration * items_per_page
 
-        if search_type == "search":
-            data = get_search_officers(query, api_key, items_per_page, start_index)
-        elif search_type == "appointments":
-            data = get_officer_appointments(query, api_key, items_per_page, start_index)
-
-        # try:
-        #     if data['total_results'] == 0:
-        #         break
-        # except (TypeError, KeyError) as e:
-        #     break
     return out_data
 
-def get_appointments(node, api_key, iteration = 0):
+# mark_appointments() only reads the first page of an appointment list, so
+# that's all get_appointments() fetches.
+APPOINTMENT_PAGES = 1
+
+def get_appointments(node, api_key, iteration = 0, search = True, skip = (), found = None,
+                     transport = None):
+    """
+    Expects an officer, psc or company record. Returns the appointments
+    found for it, marked up as edges (see mark_appointments()): an officer's
+    own appointment list, then the lists of everyone a name search matches
+    to the record (see search_filter()).
+
+    search = False stops after the officer's own list. Lists whose officer
+    ids are in skip aren't fetched, and the ids of every list the search
+    matched, fetched or not, are appended to found if it's given. See
+    chpy.identity, which uses these to avoid searching for the same people
+    over and over.
+
+    Calls go through transport, or the shared Transport if it's None, and
+    its SnapshotStore, if it has one with pscs in, answers for pscs.
+    """
+    if transport is None:
+        transport = get_transport()
+    snapshot = transport.snapshot
+    walk = walk_appointments(node, iteration, search, skip, found, snapshot)
+    try:
+        request, arg = next(walk)
+        while True:
+            try:
+                if request == "psc":
+                    result = snapshot.psc_appointments(arg)
+                else:
+                    result = [paginate_search(record, search_type, api_key,
+                                              max_pages = max_pages,
+                                              transport = transport)
+                              for record, search_type, max_pages in arg]
+            except Exception as e:
+                request, arg = walk.throw(e)
+            else:
+                request, arg = walk.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+def walk_appointments(node, iteration, search, skip, found, snapshot):
+    """
+    get_appointments() and aget_appointments() as a generator (see
+    walk_pages()), so the two share it. It yields requests and is sent back
+    their results, or has the exception they raised thrown in:
+
+        - ("pages", [(record, search_type, max_pages), ...]):
+          paginate_search() for each, with the results in the same order.
+        - ("psc", record): snapshot.psc_appointments(record).
+
+    It returns what get_appointments() does.
+    """
     out_data = []
     dup_list = []
     try:
         if node.get('query_type') == "officers":
-            listed_appts = list(flatten(paginate_search(node, "appointments", api_key)))
+            listed, = yield "pages", [(node, "appointments", APPOINTMENT_PAGES)]
+            listed_appts = list(flatten(listed))
             dup_list.append(listed_appts[0]['links']['self'])
-            for appointment in listed_appts[0]['items']:
-                appointment = mark_result(appointment, "appointment", iteration = iteration)
-                appointment['source'] = appointment['name']
-                appointment['target'] = appointment['appointed_to']['company_name']
-                appointment['date_of_birth'] = listed_appts[0].get('date_of_birth')
-                out_data.append(appointment)
+            mark_appointments(listed_appts, out_data, iteration)
     except (KeyError, AttributeError, TypeError) as e:
         pass
 
+    # With a PSC snapshot to hand, a psc's other companies come from there
+    # rather than an officer search (see chpy.snapshot).
+    if node.get('query_type') == "psc" and snapshot is not None and snapshot.has_pscs:
+        mark_psc_appointments((yield "psc", node), out_data, iteration)
+        return out_data
+
+    if not search:
+        return out_data
+
     try:
-        appt_search = list(flatten(paginate_search(node, "search", api_key)))
+        searched, = yield "pages", [(node, "search", None)]
+        appt_search = list(flatten(searched))
     except TypeError as e:
         return
 
-    for appt in appt_search:
-        if appt['links']['self'] not in dup_list:
-            appointments = list(flatten(paginate_search(appt, "appointments", api_key)))
-            for appointment in appointments[0]['items']:
-                if fuzz.token_sort_ratio(node['name'], appointment['name']) < 90:
-                    continue
-                else:
-                    appointment = mark_result(appointment, "appointment", iteration = iteration)
-                    appointment['source'] = appointment['name']
-                    appointment['target'] = appointment['appointed_to']['company_name']
-                    appointment['date_of_birth'] = appointments[0].get('date_of_birth')
-                    out_data.append(appointment)
+    appt_search = [appt for appt in appt_search
+                   if appt['links']['self'] not in dup_list]
+    if found is not None:
+        found.extend(get_officer_id(appt) for appt in appt_search)
+    appt_search = [appt for appt in appt_search
+                   if get_officer_id(appt) not in skip]
+    listed = yield "pages", [(appt, "appointments", APPOINTMENT_PAGES)
+                             for appt in appt_search]
+    for appointments in listed:
+        appointments = list(flatten(appointments))
+        mark_appointments(appointments, out_data, iteration, name = node['name'])
     return out_data
 
-def get_company_search(string, api_key):
+def mark_appointments(appointments, out_data, iteration = 0, name = None):
+    """
+    Expects the (flattened) pages of an appointmentList from paginate_search().
+    Marks up each appointment on the first page as an edge from the officer
+    (source) to the company (target) and appends it to out_data. If a name is
+    given, appointments held under a dissimilar name are skipped: those whose
+    token_sort_ratio() against it is under 90, scored for the whole page at
+    once as search_filter() scores names.
+    """
+    items = appointments[0]['items']
+    if name is not None:
+        from chpy.dedupe import process_name, score_against
+        scores = score_against(sort_tokens(process_name(name)),
+                               [sort_tokens(process_name(i['name'])) for i in items],
+                               "ratio")
+        items = [i for i, score in zip(items, scores) if score >= 90]
+    for appointment in items:
+        appointment = mark_result(appointment, "appointment", iteration = iteration)
+        appointment['source'] = appointment['name']
+        appointment['target'] = appointment['appointed_to']['company_name']
+        appointment['date_of_birth'] = appointments[0].get('date_of_birth')
+        out_data.append(appointment)
+
+def mark_psc_appointments(appointments, out_data, iteration = 0):
+    """
+    As mark_appointments(), for the psc appointments found in a PSC snapshot
+    by SnapshotStore.psc_appointments().
+    """
+    for appointment in appointments:
+        appointment = mark_result(appointment, "appointment", iteration = iteration)
+        appointment['source'] = appointment['name']
+        appointment['target'] = appointment['appointed_to']['company_name']
+        out_data.append(appointment)
+
+def get_company_search(string, api_key, transport = None):
     """
     Performs a basic, unpaginated (i.e. one page) search for a company by its
     name. Crude, but needed for something in the network component.
 
     #roomforimprovement: Needs to be integrated into the pagination component.
     """
-    url = "{}/search/companies?q={}".format(base_url, prep_for_search(string))
-    return get_generic(url, api_key)
+    url = company_search_url(string)
+    return get_generic(url, api_key, transport = transport)
+
+def company_search_url(string):
+    return "{}/search/companies?q={}".format(base_url, prep_for_search(string))
@@ -0,0 +1,163 @@
+import os
+
+from chpy.records import dumps, loads
+
+"""
+Streaming output for get_company_network().
+
+Rather than holding everything it finds in memory until the end, the crawl
+hands each edge, psc list and company profile to a CrawlSink as soon as it's
+accepted, which appends it to a JSON-lines file on disk. Files are split into
+chunks of chunk_lines records:
+
+    ./data/{company_number}_{depth}/stream/edges-00000.jsonl
+    ./data/{company_number}_{depth}/stream/pscs-00000.jsonl
+    ./data/{company_number}_{depth}/stream/companies-00000.jsonl
+
+The final edge list, company table and graph are built from these files once
+the crawl is done. They're flushed at every checkpoint, so a long crawl's
+results so far can be read while it's still running:
+
+    edges = json_normalize(list(read_stream("./data/00000006_2/stream/", "edges")))
+
+A checkpoint (see chpy.checkpoint) records how many records each stream had;
+on resuming, anything written after that is dropped, as it'll be written
+again.
+"""
+
+STREAMS = ("edges", "pscs", "companies")
+
+
+def stream_path(file_id):
+    return "./data/{}/stream/".format(file_id)
+
+
+def chunk_path(directory, stream, index):
+    return os.path.join(directory, "{}-{:05d}.jsonl".format(stream, index))
+
+
+def read_stream(directory, stream, count = None):
+    """
+    Expects a stream directory and the name of a stream. Yields its records
+    in the order they were written, stopping after count if given. A
+    half-written last line, as there may be mid-crawl, is skipped.
+    """
+    index = 0
+    while count is None or count > 0:
+        path = chunk_path(directory, stream, index)
+        if not os.path.exists(path):
+            return
+        with open(path, encoding = "utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    return
+                yield loads(line)
+                if count is not None:
+                    count -= 1
+                    if count == 0:
+                        return
+        index += 1
+
+
+class StreamReader(object):
+    """
+    Reads a crawl's streams as a CrawlSink would, up to the counts saved in
+    its checkpoint, without opening anything for writing: what's beyond the
+    counts is ignored rather than cut off. For build_network() on a crawl
+    that's finished, or still going.
+
+    Arguments:
+        - directory: where the stream files are.
+        - counts: {stream : number of records} to read, as saved in a
+          checkpoint.
+        - expanded: as for CrawlSink.
+    """
+
+    def __init__(self, directory, counts, expanded = ()):
+        self.directory = directory
+        self.counts = {s : counts.get(s, 0) for s in STREAMS}
+        self.expanded = set(expanded)
+
+    def read(self, stream):
+        """ Yields a stream's records, in the order they were added. """
+        return read_stream(self.directory, stream, self.counts[stream])
+
+
+class CrawlSink(object):
+    """
+    Appends crawl output to chunked JSON-lines files in `directory`.
+
+    Arguments:
+        - directory: where the stream files go.
+        - counts: {stream : number of records} to keep from a previous run,
+          as saved in a checkpoint. Anything beyond that is dropped. None
+          starts every stream afresh.
+        - chunk_lines: records per file.
+
+    `expanded` is the set of companies, by their position in the companies
+    stream, that the crawl has finished with, which build_network() marks
+    as 'done'.
+    """
+
+    def __init__(self, directory, counts = None, chunk_lines = 10000):
+        self.directory = directory
+        self.chunk_lines = chunk_lines
+        self.counts = {s : 0 for s in STREAMS}
+        self.expanded = set()
+        self._files = {}
+        os.makedirs(directory, exist_ok = True)
+        for stream in STREAMS:
+            self._truncate(stream, (counts or {}).get(stream, 0))
+
+    def _truncate(self, stream, count):
+        index = count // self.chunk_lines
+        keep = count % self.chunk_lines
+        path = chunk_path(self.directory, stream, index)
+        if os.path.exists(path):
+            with open(path, encoding = "utf-8") as f:
+                lines = [line for n, line in zip(range(keep), f)]
+            if len(lines) < keep:
+                raise ValueError("{} has fewer records than the checkpoint says"
+                                 .format(path))
+            with open(path + ".tmp", "w", encoding = "utf-8") as f:
+                f.writelines(lines)
+            os.replace(path + ".tmp", path)
+        elif keep > 0:
+            raise ValueError("{} is missing".format(path))
+        index += 1
+        while os.path.exists(chunk_path(self.directory, stream, index)):
+            os.remove(chunk_path(self.directory, stream, index))
+            index += 1
+        self.counts[stream] = count
+
+    def add(self, stream, record):
+        """
+        Appends one record (anything JSON-serialisable, records from
+        chpy.records included) to a stream. Returns its position in the
+        stream.
+        """
+        count = self.counts[stream]
+        f = self._files.get(stream)
+        if f is None or count % self.chunk_lines == 0:
+            if f is not None:
+                f.close()
+            f = open(chunk_path(self.directory, stream, count // self.chunk_lines), "a",
+                     encoding = "utf-8")
+            self._files[stream] = f
+        f.write(dumps(record) + "\n")
+        self.counts[stream] = count + 1
+        return count
+
+    def flush(self):
+        for f in self._files.values():
+            f.flush()
+
+    def read(self, stream):
+        """ Yields a stream's records, in the order they were added. """
+        self.flush()
+        return read_stream(self.directory, stream, self.counts[stream])
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
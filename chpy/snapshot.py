@@ -0,0 +1,543 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zipfile
+from urllib.parse import parse_qs, unquote_plus, urlsplit
+
+from chpy.cache import endpoint_type
+from chpy.records import loads
+
+logger = logging.getLogger(__name__)
+
+"""
+A local copy of Companies House's bulk data, consulted before the API.
+
+Companies House publishes a free monthly snapshot of every live company on
+the register, "Basic Company Data", as one big CSV (zipped):
+
+    http://download.companieshouse.gov.uk/en_output.html
+
+Most of the company profiles a crawl asks for are in it, as are the
+companies that corporate officers are looked up by name to find. Importing
+the snapshot once into a SnapshotStore (a SQLite file, indexed by company
+number and by normalised name) and handing that to the Transport lets
+get_generic() answer those calls from disk, and only go to the API for what
+isn't there -- dissolved companies, say, or ones registered since:
+
+    store = import_company_data("BasicCompanyDataAsOneFile-2020-01-01.zip",
+                                "./data/snapshot.sqlite")
+    set_transport(Transport(snapshot = store))
+
+After that, SnapshotStore("./data/snapshot.sqlite") opens it again. Profiles
+are rebuilt in the API's shape from the CSV's columns, so they carry fewer
+fields than the API gives (no etag, jurisdiction and so on), and they're as
+old as the snapshot.
+
+The same goes for persons with significant control. The whole PSC register
+is published daily as JSON lines, one record per line, split over a few
+dozen zip files:
+
+    http://download.companieshouse.gov.uk/en_pscdata.html
+
+import_psc_data() streams those into the same store, indexed by company
+number and by person (normalised name plus month and year of birth). Then
+a company's PSC list comes from disk for any company the snapshot covers,
+and get_appointments() finds the other companies a PSC controls in the index
+instead of searching the API for their name.
+"""
+
+# Basic Company Data's CompanyStatus and CompanyCategory, as the API has them.
+# Anything not listed is lower-cased and hyphenated.
+COMPANY_STATUSES = {"Active - Proposal to Strike off" : "active",
+                    "In Administration" : "administration",
+                    "Administration Order" : "administration",
+                    "Receivership Action" : "receivership",
+                    "Receiver Manager / Administrative Receiver" : "receivership",
+                    "Live but Receiver Manager on at least one charge" : "active",
+                    "Converted/Closed" : "converted-closed"}
+COMPANY_TYPES = {"Private Limited Company" : "ltd",
+                 "Public Limited Company" : "plc",
+                 "Limited Liability Partnership" : "llp",
+                 "Community Interest Company" : "ltd",
+                 "PRI/LTD BY GUAR/NSC (Private, limited by guarantee, no share capital)"
+                     : "private-limited-guarant-nsc",
+                 "PRI/LBG/NSC (Private, Limited by guarantee, no share capital, use of 'Limited' exemption)"
+                     : "private-limited-guarant-nsc-limited-exemption",
+                 "PRIV LTD SECT. 30 (Private limited company, section 30 of the Companies Act)"
+                     : "private-limited-shares-section-30-exemption",
+                 "Private Unlimited Company" : "private-unlimited",
+                 "Private Unlimited" : "private-unlimited",
+                 "Limited Partnership" : "limited-partnership",
+                 "Scottish Partnership" : "scottish-partnership",
+                 "Charitable Incorporated Organisation" : "charitable-incorporated-organisation",
+                 "Scottish Charitable Incorporated Organisation"
+                     : "scottish-charitable-incorporated-organisation",
+                 "Overseas Entity" : "registered-overseas-entity",
+                 "Other company type" : "other"}
+
+# Rows written per transaction on import.
+IMPORT_BATCH = 10000
+
+
+def normalize_company_name(name):
+    """
+    Expects a company name. Returns it as it's indexed: lower case, letters,
+    numbers and single spaces only, with "ltd" written out as "limited".
+    prep_for_search() output normalises to the same thing.
+    """
+    words = re.sub('[^a-z0-9 ]+', '', name.replace("+", " ").lower()).split()
+    return " ".join("limited" if w == "ltd" else w for w in words)
+
+
+def psc_key(record):
+    """
+    Expects a psc record. Returns the key it's indexed on: for people, their
+    normalised forename and surname and month and year of birth; for
+    companies and other legal persons, their normalised name. None for
+    records without a name (super-secure persons).
+    """
+    kind = record.get('kind') or ""
+    elements = record.get('name_elements') or {}
+    if kind.startswith("individual") and elements.get('surname'):
+        name = normalize_company_name("{} {}".format(elements.get('forename') or "",
+                                                     elements['surname']))
+    else:
+        name = normalize_company_name(record.get('name') or "")
+    if not name:
+        return None
+    if kind.startswith("individual"):
+        dob = record.get('date_of_birth') or {}
+        return "{}|{}-{}".format(name, dob.get('year'), dob.get('month'))
+    return name
+
+
+def is_psc(record):
+    """ PSCs proper, rather than statements or exemptions. """
+    kind = record.get('kind') or ""
+    return (kind.endswith("person-with-significant-control")
+            or kind.endswith("beneficial-owner"))
+
+
+def slug(value):
+    return re.sub('[^a-z0-9]+', '-', value.lower()).strip("-")
+
+
+def iso_date(value):
+    """ "31/12/2019" -> "2019-12-31". Blanks come back as None. """
+    try:
+        day, month, year = value.split("/")
+    except ValueError:
+        return None
+    return "{}-{}-{}".format(year, month.zfill(2), day.zfill(2))
+
+
+def company_profile(row):
+    """
+    Expects a row of Basic Company Data, as a dict with its column names
+    stripped. Returns the company's profile as the API would, as near as the
+    CSV allows.
+    """
+    get = lambda column: (row.get(column) or "").strip()
+    number = get("CompanyNumber")
+    status = get("CompanyStatus")
+    category = get("CompanyCategory")
+
+    address = [("care_of", "RegAddress.CareOf"),
+               ("po_box", "RegAddress.POBox"),
+               ("address_line_1", "RegAddress.AddressLine1"),
+               ("address_line_2", "RegAddress.AddressLine2"),
+               ("locality", "RegAddress.PostTown"),
+               ("region", "RegAddress.County"),
+               ("country", "RegAddress.Country"),
+               ("postal_code", "RegAddress.PostCode")]
+    profile = {"company_name" : get("CompanyName"),
+               "company_number" : number,
+               "company_status" : COMPANY_STATUSES.get(status, slug(status)),
+               "type" : COMPANY_TYPES.get(category, slug(category)),
+               "date_of_creation" : iso_date(get("IncorporationDate")),
+               "registered_office_address" : {k : get(c) for k, c in address if get(c)},
+               "links" : {"self" : "/company/{}".format(number)}}
+
+    sic_codes = [get("SICCode.SicText_{}".format(n)).split(" - ")[0] for n in range(1, 5)]
+    sic_codes = [c for c in sic_codes if c not in ("", "None Supplied")]
+    if sic_codes:
+        profile['sic_codes'] = sic_codes
+
+    if iso_date(get("DissolutionDate")):
+        profile['date_of_cessation'] = iso_date(get("DissolutionDate"))
+
+    accounts = {}
+    if get("Accounts.AccountRefDay") and get("Accounts.AccountRefMonth"):
+        accounts['accounting_reference_date'] = {"day" : get("Accounts.AccountRefDay"),
+                                                 "month" : get("Accounts.AccountRefMonth")}
+    if iso_date(get("Accounts.NextDueDate")):
+        accounts['next_due'] = iso_date(get("Accounts.NextDueDate"))
+    if iso_date(get("Accounts.LastMadeUpDate")):
+        accounts['last_accounts'] = {"made_up_to" : iso_date(get("Accounts.LastMadeUpDate")),
+                                     "type" : slug(get("Accounts.AccountCategory"))}
+    if accounts:
+        profile['accounts'] = accounts
+
+    statement = {k : iso_date(get(c)) for k, c in [("next_due", "ConfStmtNextDueDate"),
+                                                    ("last_made_up_to", "ConfStmtLastMadeUpDate")]
+                 if iso_date(get(c))}
+    if statement:
+        profile['confirmation_statement'] = statement
+
+    if get("Mortgages.NumMortCharges"):
+        profile['has_charges'] = get("Mortgages.NumMortCharges") not in ("0", "")
+
+    previous = [{"name" : get("PreviousName_{}.CompanyName".format(n)),
+                 "ceased_on" : iso_date(get("PreviousName_{}.CONDATE".format(n)))}
+                for n in range(1, 11)
+                if get("PreviousName_{}.CompanyName".format(n))]
+    if previous:
+        profile['previous_company_names'] = previous
+    return profile
+
+
+def open_snapshot(path):
+    """
+    Opens a Basic Company Data file, zipped or not, as text. The zip holds a
+    single CSV (or several parts, which are read one after the other).
+    """
+    if not zipfile.is_zipfile(path):
+        yield open(path, newline = "", encoding = "utf-8", errors = "replace")
+        return
+    with zipfile.ZipFile(path) as z:
+        for name in sorted(n for n in z.namelist() if n.lower().endswith(".csv")):
+            yield io.TextIOWrapper(z.open(name), newline = "",
+                                   encoding = "utf-8", errors = "replace")
+
+
+def open_lines(paths):
+    """
+    Opens each of a path (or list of paths) to JSON-lines files, zipped or
+    not, as text, members of a zip one after the other.
+    """
+    for path in [paths] if isinstance(paths, str) else paths:
+        if not zipfile.is_zipfile(path):
+            yield open(path, encoding = "utf-8", errors = "replace")
+            continue
+        with zipfile.ZipFile(path) as z:
+            for name in sorted(z.namelist()):
+                yield io.TextIOWrapper(z.open(name), encoding = "utf-8", errors = "replace")
+
+
+def read_psc_data(paths):
+    """
+    Expects the path (or a list of paths) to the PSC snapshot's files.
+    Yields (company_number, record) for each line, reading a line at a time.
+    The totals line at the end of each file is skipped.
+    """
+    for f in open_lines(paths):
+        with f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = loads(line)
+                if entry.get('company_number'):
+                    yield entry['company_number'], entry.get('data') or {}
+
+
+def read_company_data(path):
+    """
+    Expects the path to a Basic Company Data snapshot. Yields each company's
+    profile, reading the file a row at a time.
+    """
+    for f in open_snapshot(path):
+        with f:
+            reader = csv.reader(f)
+            header = [c.strip() for c in next(reader, [])]
+            for row in reader:
+                yield company_profile(dict(zip(header, row)))
+
+
+class SnapshotStore(object):
+    """
+    Bulk Companies House data in a SQLite file, answering API calls by url.
+
+    Arguments:
+        - path: the SQLite file, as written by import_company_data().
+
+    get(url) works like ResponseCache.get(): it returns (hit, data), and on
+    a miss the caller goes to the API as usual. Company profiles, company
+    name searches and, for companies in the PSC snapshot, PSC lists are
+    answered here. Counters for hits and misses are kept in stats().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS companies ("
+                         "company_number TEXT PRIMARY KEY, "
+                         "name TEXT, "
+                         "status TEXT, "
+                         "profile TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS pscs ("
+                         "company_number TEXT, "
+                         "person TEXT, "
+                         "record TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS psc_companies ("
+                         "company_number TEXT PRIMARY KEY)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta ("
+                         "key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+        self.has_pscs = self._db.execute("SELECT 1 FROM psc_companies LIMIT 1").fetchone() is not None
+
+    def add_companies(self, profiles):
+        """
+        Stores an iterable of company profiles, replacing any already held
+        for the same company number, in batches of IMPORT_BATCH. Returns
+        the number stored.
+        """
+        count = 0
+        with self._lock:
+            self._db.execute("DROP INDEX IF EXISTS companies_name")
+            batch = []
+            for profile in profiles:
+                batch.append((profile['company_number'],
+                              normalize_company_name(profile['company_name']),
+                              profile.get('company_status'),
+                              json.dumps(profile)))
+                if len(batch) == IMPORT_BATCH:
+                    self._db.executemany("INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?)", batch)
+                    self._db.commit()
+                    count += len(batch)
+                    batch = []
+            self._db.executemany("INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?)", batch)
+            count += len(batch)
+            # Quicker to index once at the end than row by row.
+            self._db.execute("CREATE INDEX companies_name ON companies (name)")
+            self._db.commit()
+        return count
+
+    def add_pscs(self, entries):
+        """
+        Replaces the stored PSC register with an iterable of (company_number,
+        record), as read_psc_data() yields, in batches of IMPORT_BATCH.
+        Every company mentioned is noted as covered, so one with only
+        statements ("no registrable person") gets an empty PSC list rather
+        than a trip to the API. Returns the number of PSCs stored.
+        """
+        count = 0
+        with self._lock:
+            self._db.execute("DROP INDEX IF EXISTS pscs_company")
+            self._db.execute("DROP INDEX IF EXISTS pscs_person")
+            self._db.execute("DELETE FROM pscs")
+            self._db.execute("DELETE FROM psc_companies")
+            rows, companies = [], set()
+            for number, record in entries:
+                companies.add(number)
+                if is_psc(record):
+                    record.pop('etag', None)
+                    rows.append((number, psc_key(record),
+                                 json.dumps(record, separators = (",", ":"))))
+                if len(rows) >= IMPORT_BATCH or len(companies) >= IMPORT_BATCH:
+                    count += self._write_pscs(rows, companies)
+                    rows, companies = [], set()
+            count += self._write_pscs(rows, companies)
+            self._db.execute("CREATE INDEX pscs_company ON pscs (company_number)")
+            self._db.execute("CREATE INDEX pscs_person ON pscs (person)")
+            self._db.commit()
+            self.has_pscs = count > 0 or self._db.execute(
+                "SELECT 1 FROM psc_companies LIMIT 1").fetchone() is not None
+        return count
+
+    def _write_pscs(self, rows, companies):
+        self._db.executemany("INSERT INTO pscs VALUES (?, ?, ?)", rows)
+        self._db.executemany("INSERT OR IGNORE INTO psc_companies VALUES (?)",
+                             [(c,) for c in companies])
+        self._db.commit()
+        return len(rows)
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+            self._db.commit()
+
+    def company(self, number):
+        """ The stored profile for a company number, or None. """
+        with self._lock:
+            row = self._db.execute("SELECT profile FROM companies WHERE company_number = ?",
+                                   (number,)).fetchone()
+        return None if row is None else loads(row[0])
+
+    def search_companies(self, name):
+        """
+        Stored companies whose normalised name is the same as name's, active
+        ones first, as the items of a company search.
+        """
+        name = normalize_company_name(name)
+        if not name:
+            return []
+        with self._lock:
+            rows = self._db.execute("SELECT profile FROM companies WHERE name = ? "
+                                    "ORDER BY status != 'active', company_number",
+                                    (name,)).fetchall()
+        items = []
+        for row in rows:
+            profile = loads(row[0])
+            items.append({"kind" : "searchresults#company",
+                          "title" : profile['company_name'],
+                          "company_number" : profile['company_number'],
+                          "company_status" : profile['company_status'],
+                          "company_type" : profile['type'],
+                          "date_of_creation" : profile.get('date_of_creation'),
+                          "address" : profile['registered_office_address'],
+                          "links" : profile['links']})
+        return items
+
+    def pscs(self, number):
+        """
+        The company's PSC list, as the API returns it; None if it has no
+        PSCs (a 404 from the API). Returns (covered, list), where covered is
+        False if the company isn't in the PSC snapshot at all.
+        """
+        with self._lock:
+            covered = self._db.execute("SELECT 1 FROM psc_companies WHERE company_number = ?",
+                                       (number,)).fetchone() is not None
+            rows = self._db.execute("SELECT record FROM pscs WHERE company_number = ? "
+                                    "ORDER BY rowid", (number,)).fetchall()
+        items = [loads(row[0]) for row in rows]
+        if not items:
+            return covered, None
+        ceased = len([i for i in items if i.get('ceased_on')])
+        return covered, {"items" : items,
+                         "items_per_page" : len(items),
+                         "start_index" : 0,
+                         "total_results" : len(items),
+                         "active_count" : len(items) - ceased,
+                         "ceased_count" : ceased,
+                         "links" : {"self" : "/company/{}/persons-with-significant-control"
+                                             .format(number)}}
+
+    def psc_appointments(self, psc):
+        """
+        Expects a psc record. Returns the same person's PSC records at other
+        companies, shaped like officer appointments (appointed_to and so on)
+        for mark_psc_appointments(). Companies that aren't in the company
+        snapshot are left out, as there's no name to give them.
+        """
+        key = psc_key(psc)
+        if key is None:
+            return []
+        own = ((psc.get('links') or {}).get('self') or "").split("/")[2:3]
+        with self._lock:
+            rows = self._db.execute("SELECT p.company_number, p.record, c.profile "
+                                    "FROM pscs p JOIN companies c "
+                                    "ON c.company_number = p.company_number "
+                                    "WHERE p.person = ? ORDER BY p.rowid", (key,)).fetchall()
+        out = []
+        for number, record, profile in rows:
+            if [number] == own:
+                continue
+            record, profile = loads(record), loads(profile)
+            appointment = {"name" : record.get('name'),
+                           "officer_role" : "person-with-significant-control",
+                           "kind" : record.get('kind'),
+                           "notified_on" : record.get('notified_on'),
+                           "natures_of_control" : record.get('natures_of_control'),
+                           "address" : record.get('address'),
+                           "date_of_birth" : record.get('date_of_birth'),
+                           "appointed_to" : {"company_name" : profile['company_name'],
+                                             "company_number" : number,
+                                             "company_status" : profile.get('company_status')},
+                           "links" : {"self" : (record.get('links') or {}).get('self'),
+                                      "company" : "/company/{}".format(number)}}
+            if record.get('ceased_on'):
+                appointment['ceased_on'] = record['ceased_on']
+            out.append(appointment)
+        return out
+
+    def lookup(self, url):
+        """ (hit, data) for an API url, as get(), without the counting. """
+        path = [i for i in urlsplit(url).path.split("/") if i]
+        kind = endpoint_type(url)
+        if kind == "profile":
+            data = self.company(path[1])
+            return data is not None, data
+        if kind == "psc" and self.has_pscs:
+            return self.pscs(path[1])
+        if path == ["search", "companies"]:
+            query = unquote_plus(parse_qs(urlsplit(url).query).get('q', [''])[0])
+            items = self.search_companies(query)
+            if items:
+                return True, {"kind" : "search#companies",
+                              "items" : items,
+                              "items_per_page" : len(items),
+                              "start_index" : 0,
+                              "total_results" : len(items)}
+        return False, None
+
+    def get(self, url):
+        """
+        Returns (hit, data) for an API url. data is freshly decoded, so
+        callers can mutate it; it's None for what the API would 404.
+        """
+        hit, data = self.lookup(url)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return hit, data
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            meta = dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+            return dict(meta,
+                        hits = self.hits,
+                        misses = self.misses,
+                        hit_rate = self.hits / lookups if lookups else 0.0,
+                        companies = self._db.execute("SELECT COUNT(*) FROM companies").fetchone()[0],
+                        pscs = self._db.execute("SELECT COUNT(*) FROM pscs").fetchone()[0])
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def import_company_data(path, store_path):
+    """
+    Expects the path to a Basic Company Data snapshot (the zip, or the CSV in
+    it) and a SQLite file to import it into. Streams the snapshot into the
+    store a batch at a time, so memory stays flat however large it is.
+    Returns the SnapshotStore.
+    """
+    store = store_path if isinstance(store_path, SnapshotStore) else SnapshotStore(store_path)
+    count = store.add_companies(read_company_data(path))
+    store.set_meta("company_data", os.path.basename(path))
+    logger.info("Imported %s companies from %s", count, path)
+    return store
+
+
+def import_psc_data(paths, store_path):
+    """
+    Expects the path (or a list of paths) to the PSC snapshot's files, zipped
+    or not, and a SQLite file to import them into, alongside any company
+    data. Streams the snapshot in a line at a time, so the multi-GB register
+    never has to fit in memory. Returns the SnapshotStore.
+    """
+    store = store_path if isinstance(store_path, SnapshotStore) else SnapshotStore(store_path)
+    count = store.add_pscs(read_psc_data(paths))
+    names = [paths] if isinstance(paths, str) else paths
+    store.set_meta("psc_data", ", ".join(os.path.basename(p) for p in names))
+    logger.info("Imported %s persons with significant control from %s", count, ", ".join(names))
+    return store
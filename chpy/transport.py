@@ -0,0 +1,213 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from chpy.ratelimit import RateLimiter
+from chpy.keys import KeyPool
+from chpy.metrics import emit, endpoint_name
+
+"""
+The HTTP layer underneath chpy.search.get_generic().
+
+Every call to the Companies House API goes through a Transport. It keeps
+connections alive in a pool (so we only pay for the TCP/TLS handshake once
+per connection, rather than once per call), sets connect/read timeouts so a
+hung socket can't stall a whole crawl, and retries 429s and 5xxs with
+exponential backoff and jitter. Every attempt, retries included, is paced by
+a RateLimiter (see chpy.ratelimit), one per API key when several keys are
+pooled (see chpy.keys). Attempts, retries and rate-limit waits are reported
+to chpy.metrics.
+
+By default all of the functions in chpy.search share one Transport, created
+on first use. A differently configured one can be swapped in with
+set_transport(), or passed to the search functions directly.
+"""
+
+# Status codes worth another go. Anything else is returned as-is.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Failures to connect, or to read a whole response, which are also worth
+# another go: a body cut off mid-read is as transient as a dropped connection.
+RETRY_ERRORS = (requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ContentDecodingError)
+
+# acquire() takes a few microseconds even when there's budget to spare; a
+# longer wait than this is the rate limiter holding a call back.
+MIN_RATE_LIMIT_WAIT = 0.001
+
+
+class Transport(object):
+    """
+    A pooled, retrying session for the Companies House API.
+
+    Arguments:
+        - pool_size: number of keep-alive connections held open to the API.
+        - timeout: (connect, read) timeout in seconds, as accepted by requests.
+        - max_retries: retries after the first attempt on a retryable status
+          or a connection error/timeout (see RETRY_ERRORS).
+        - backoff: base delay in seconds; attempt n waits a random amount
+          between 0 and backoff * 2 ** n ("full jitter").
+        - max_backoff: cap on any single wait.
+        - limiter: the RateLimiter pacing calls made with a single api_key
+          string; a fresh one by default. Pass the same instance to several
+          Transports to share one budget. Lists of keys get a KeyPool, with
+          a limiter per key.
+        - cache: an optional chpy.cache.ResponseCache, consulted by
+          get_generic() before anything goes over the wire.
+        - snapshot: an optional chpy.snapshot.SnapshotStore of bulk data,
+          consulted by get_generic() before the cache.
+        - memo: an optional chpy.memo.RequestMemo, consulted by get_generic()
+          before anything else. The crawl functions give the Transport a
+          fresh one for each crawl if it doesn't have one.
+        - compact: if True, get_generic() returns typed, compact records
+          keeping only the fields chpy uses (see chpy.records), rather than
+          everything the API sends.
+    """
+
+    def __init__(self,
+                 pool_size = 10,
+                 timeout = (3.05, 30),
+                 max_retries = 5,
+                 backoff = 0.5,
+                 max_backoff = 60,
+                 limiter = None,
+                 cache = None,
+                 snapshot = None,
+                 memo = None,
+                 compact = False):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.cache = cache
+        self.snapshot = snapshot
+        self.memo = memo
+        self.compact = compact
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = pool_size,
+                              pool_maxsize = pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def key_pool(self, api_key):
+        """
+        Returns the KeyPool for an api_key argument, which may be a KeyPool, a
+        single key or a list of keys. Pools are kept, so per-key rate
+        accounting carries over from one call to the next.
+        """
+        if isinstance(api_key, KeyPool):
+            return api_key
+        keys = (api_key,) if isinstance(api_key, str) else tuple(api_key)
+        with self._pools_lock:
+            if keys not in self._pools:
+                limiters = {keys[0] : self.limiter} if len(keys) == 1 else None
+                self._pools[keys] = KeyPool(keys, limiters = limiters)
+            return self._pools[keys]
+
+    def get(self, url, api_key):
+        """
+        GETs a url, retrying where it makes sense. Returns the final
+        requests.Response, or None if we never got a response at all (i.e.
+        every attempt failed to connect, timed out or was cut off).
+
+        api_key may be a single key, a list of keys or a KeyPool. With more
+        than one key, a 401 or 429 takes that key out of rotation and the
+        call is retried on another. A 401 on the last key left is returned
+        as it is (see KeyPool).
+        """
+        pool = self.key_pool(api_key)
+        endpoint = endpoint_name(url)
+        response = None
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            key = pool.acquire()
+            waited = time.perf_counter() - start
+            if waited > MIN_RATE_LIMIT_WAIT:
+                emit("rate_limit_wait", seconds = waited)
+
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url,
+                                            auth = (key, ""),
+                                            timeout = self.timeout)
+            except RETRY_ERRORS:
+                response = None
+            else:
+                pool.update(key, response)
+            status = None if response is None else response.status_code
+            emit("request", endpoint = endpoint, status = status,
+                 latency = time.perf_counter() - start)
+
+            if response is None:
+                pass
+            elif retry_on_another_key(pool, key, response):
+                # Another key is still good, so no need to back off.
+                emit("retry", endpoint = endpoint, status = status, wait = 0.0)
+                continue
+            elif response.status_code not in RETRY_STATUSES:
+                return response
+
+            if attempt < self.max_retries:
+                wait = self.backoff_time(attempt, response)
+                emit("retry", endpoint = endpoint, status = status, wait = wait)
+                time.sleep(wait)
+
+        return response
+
+    def backoff_time(self, attempt, response = None):
+        """
+        Seconds to wait before retry number `attempt` (counting from 0).
+        Honours a Retry-After header if the API sends one.
+        """
+        try:
+            return min(float(response.headers['Retry-After']), self.max_backoff)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def close(self):
+        self.session.close()
+
+
+def retry_on_another_key(pool, key, response):
+    """ True if response took key out of rotation and another key is still good. """
+    if response.status_code == 401:
+        return key in pool.retired and bool(pool.active())
+    return response.status_code == 429 and bool(pool.active())
+
+
+_default_transport = None
+_default_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Returns the shared Transport used when none is passed explicitly,
+    creating it on first use.
+    """
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
+
+
+def set_transport(transport):
+    """
+    Replaces the shared Transport, e.g. to change timeouts or pool size for
+    a whole crawl. Returns the previous one.
+    """
+    global _default_transport
+    with _default_lock:
+        previous = _default_transport
+        _default_transport = transport
+        return previous
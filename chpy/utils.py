@@ -1,10 +1,15 @@
-import pandas as pd
 import re
+import json
 import collections
-from pandas.io.json import json_normalize
+import hashlib
+import logging
 import time
 from datetime import datetime
-from fuzzywuzzy import fuzz, process
+from chpy.metrics import emit
+from chpy.records import Record
+
+logger = logging.getLogger(__name__)
+
 """
 Part 1: Helper functions
 
@@ -21,12 +26,16 @@ def rate_limit(data):
 
     #roomforimprovement: Currently waits at a five minute sleep when low, could be
     carefully shorter.
+
+    #depreciate: get_generic() no longer calls this. Calls are now paced by
+    the RateLimiter in chpy.ratelimit, which spreads them over the window.
     """
     try:
         if float(data.headers['X-Ratelimit-Remain']) < 10:
             wait = abs(datetime.fromtimestamp(int(data.headers['X-Ratelimit-Reset'])) - datetime.now())
+            logger.info("Pausing for %s seconds for rate limiting", wait.seconds + 10)
             time.sleep(wait.seconds + 10)
-            print("Pausing for {} seconds for rate limiting".format(wait.seconds + 10))
+            emit("rate_limit_wait", seconds = wait.seconds + 10)
     except KeyError:
         pass
 
@@ -48,6 +57,8 @@ def tabulate_output(data2tabulate):
 
     #depreciate
     """
+    from pandas.io.json import json_normalize
+
     table_data = []
     for i in data2tabulate:
         for a in i['items']:
@@ -60,7 +71,7 @@ def strip_headers(data):
     try:
         return data['items']
     except (TypeError, KeyError) as e:
-        print(e)
+        logger.debug("No headers to strip: %r", e)
         return data
 
 def prep_for_search(string):
@@ -122,10 +133,43 @@ def get_officer_uid(in_data):
     elif 'officer' in in_data['links']:
         uid = in_data['links']['officer']['appointments'].split("/")[2]
     else:
-        print("Not a vaild record.")
+        logger.warning("Not a vaild record.")
         return
     return uid
 
+def get_officer_id(in_data):
+    """
+    Like get_officer_uid(), but only ever returns an officer id (the part of
+    an /officers/{id}/appointments link), or None if the record doesn't have
+    one. Officer records from a company's officer list carry a links.self
+    pointing at the company, so the officer link is checked first.
+    """
+    links = in_data.get('links') or {}
+    try:
+        return links['officer']['appointments'].split("/")[2]
+    except (KeyError, TypeError, IndexError, AttributeError) as e:
+        pass
+    link = links.get('self') or ""
+    if link.startswith("/officers/"):
+        return link.split("/")[2]
+    return None
+
+def edge_key(item):
+    """
+    A hashable key for an edge record: a 16-byte digest of the whole record,
+    serialised with its keys sorted. Two records share a key when they are
+    equal (==), so a set of these de-duplicates edges exactly as a list scan
+    would, in O(1), without keeping a copy of every record in memory.
+
+    Keying on just (source, target, officer_role, appointed_on), as the final
+    drop_duplicates does, would drop records before names are cleaned and
+    shift the name counts fuzz_dict() relies on.
+    """
+    if isinstance(item, Record):
+        item = item.to_dict()
+    return hashlib.blake2b(json.dumps(item, sort_keys = True, default = str).encode(),
+                           digest_size = 16).digest()
+
 def flatten_appointment_search(appointment_search):
     """
     Expects a messy list of appointment searches record from paginate_search().
@@ -162,7 +206,7 @@ def flatten_officer_search(officers):
                     if len(x) == 1:
                         flat_officers.append(x[0])
         except (TypeError, KeyError) as e:
-            print(e)
+            logger.debug("Skipping officer list: %r", e)
             pass
     return flat_officers
 
@@ -179,7 +223,37 @@ def human_check(string):
             return "Individual"
     return "Corporate"
 
+def node_attributes(frame, key, columns):
+    """
+    Expects a dataframe, the column naming each row's node, and the columns to
+    take node attributes from. Returns a {node : {attribute : value}} dict for
+    nx.set_node_attributes(), giving the same result as setting attributes a
+    row at a time with iterrows(): per node and column, the last value that
+    isn't a list or dict wins, and attributes are in the order first set.
+
+    Works a column at a time over frame.values (the same objects iterrows()
+    hands out) rather than building a Series for every row.
+    """
+    values = frame.values
+    nodes = values[:, frame.columns.get_loc(key)]
+    rows = range(len(frame))
+    found = []
+    for position, column in enumerate(columns):
+        cells = values[:, frame.columns.get_loc(column)]
+        keep = [type(i) != list and type(i) != dict for i in cells]
+        kept_nodes = [n for n, k in zip(nodes, keep) if k]
+        last = dict(zip(kept_nodes, [v for v, k in zip(cells, keep) if k]))
+        first = dict(zip(reversed(kept_nodes), reversed([r for r, k in zip(rows, keep) if k])))
+        found += [(first[n], position, n, column, v) for n, v in last.items()]
+
+    out = {}
+    for first, position, node, column, value in sorted(found, key = lambda i: i[:2]):
+        out.setdefault(node, {})[column] = value
+    return out
+
 def nodes_to_csv(G, company_number):
+    from pandas.io.json import json_normalize
+
     out = []
     for node in G.nodes(data = True):
         out.append({"id" : node[0], **node[1]})
@@ -189,6 +263,8 @@ def nodes_to_csv(G, company_number):
     return
 
 def edges_to_csv(G, company_number):
+    from pandas.io.json import json_normalize
+
     out = []
     for edge in G.edges(data = True):
         out.append({"source" : edge[0], "target" : edge[1], **edge[2]})
@@ -218,16 +294,19 @@ def fuzz_count(col, string):
     return col[col == string].count()                                       ## Counts the occurances of a string in a column
 
 def fuzz_dict(col, tol):
-    test = {}
-    for i in col.unique():                                                  ## Iterate through everything in the column
-        for x in col.unique():                                              ## And do again, nested
-            if i != x:                                                      ## If our items are different, we test for similarity
-                if fuzz.token_set_ratio(i, x) > tol:                       ## If the fuzz ratio between the two is higher than cut-off
-                    if int(fuzz_count(col, i)) > int(fuzz_count(col, x)):   ## See which is used more often in the column
-                        test[i] = i                                         ## Set dict as i if i is more frequent
-                    else:
-                        test[i] = x                                         ## And also for x
-    return test
+    """
+    Expects a column of names and a threshold. Returns a dict of names to
+    replace, and what to replace them with, for clean_dict().
+
+    This used to compare every name in the column with every other, counting
+    them up with fuzz_count() as it went. It now hands over to
+    chpy.dedupe.name_clusters(), which gets the same dict while only scoring
+    pairs of names that could possibly match.
+    """
+    # Imported here so that chpy.utils, and everything that imports it,
+    # doesn't load numpy and rapidfuzz until names need de-duplicating.
+    from chpy.dedupe import name_clusters
+    return name_clusters(col, tol)
 
 def clean_dict(x, dct):                                                     ## Just a find and replace with a dictionary for
     try:                                                                    ## applying on a column
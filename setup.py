@@ -23,9 +23,10 @@ setup(
         "Programming Language :: Python :: 3",
         "Programming Language :: Python :: 3.7",
     ],
-    packages=find_packages(exclude=["collections", "time", "math", "re", "os"]),
+    packages=find_packages(exclude=["collections", "time", "math", "re", "os", "tests", "tests.*"]),
 
     include_package_data=True,
+    entry_points={"console_scripts": ["chpy=chpy.cli:main"]},
     # install_requires=["networkx", "pandas", "progressbar", "fuzzywuzzy",
     #                   "os", "requests", "math", "time", "collections", "re"]
 
@@ -0,0 +1,63 @@
+import asyncio
+
+import chpy.build as build
+import chpy.search as search
+from chpy.aio import AsyncTransport, aget_company, aget_appointments, run_async
+from chpy.metrics import get_metrics
+from chpy.mock import MockServer, SyntheticRegister
+from chpy.ratelimit import RateLimiter
+from chpy.transport import Transport
+
+from tests.test_build import server, root, assert_same_network
+
+
+def test_async_crawl_gives_the_same_network(server):
+    number = root(server)
+    threaded = build.get_company_network(number, "key", 2, checkpoint = False)
+    calls = server.stats()["total"]
+
+    server.reset()
+    concurrent = run_async(build.aget_company_network(number, "key", 2, concurrency = 4,
+                                                      checkpoint = False))
+    assert server.stats()["total"] == calls
+    assert_same_network(threaded, concurrent)
+
+
+def test_async_calls_retry_and_match_the_sync_ones(monkeypatch):
+    server = MockServer(register = SyntheticRegister(companies = 10, people = 15, seed = 4),
+                        error_rate = 0.3, limit = 10 ** 6, window = 10).start()
+    monkeypatch.setattr(search, "base_url", server.url)
+    transport = Transport(backoff = 0.001, max_retries = 20,
+                          limiter = RateLimiter(limit = 10 ** 6, window = 10, burst = 10 ** 6))
+    number = sorted(server.register.company_officers)[0]
+    retries = []
+    callback = get_metrics().add_callback(lambda event, fields: event == "retry"
+                                          and retries.append(fields['status']))
+
+    async def fetch():
+        async with AsyncTransport(concurrency = 4, transport = transport) as t:
+            officers = await aget_company(number, "officers", "key", transport = t)
+            appointments = await aget_appointments(officers["items"][0], "key", 1, transport = t)
+            return officers, appointments
+
+    try:
+        officers, appointments = asyncio.run(fetch())
+        assert officers == search.get_company(number, "officers", "key", transport = transport)
+        assert appointments == search.get_appointments(officers["items"][0], "key", 1,
+                                                       transport = transport)
+    finally:
+        get_metrics().remove_callback(callback)
+        server.stop()
+    assert 502 in retries
+    assert appointments
+
+
+def test_run_async_inside_a_running_loop():
+    async def double(n):
+        await asyncio.sleep(0)
+        return 2 * n
+
+    async def notebook():
+        return run_async(double(21))
+
+    assert asyncio.run(notebook()) == 42
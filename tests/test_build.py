@@ -0,0 +1,89 @@
+import networkx as nx
+import pytest
+from pandas.testing import assert_frame_equal
+
+import chpy.build as build
+from chpy.build import crawl_id, crawl_roots
+import chpy.search as search
+from chpy.mock import MockServer, SyntheticRegister
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    """ A mock API for the crawl, run from an empty directory. """
+    server = MockServer(register = SyntheticRegister(companies = 40, people = 60, seed = 1),
+                        limit = 10 ** 6, window = 10).start()
+    monkeypatch.setattr(search, "base_url", server.url)
+    monkeypatch.chdir(tmp_path)
+    yield server
+    server.stop()
+
+
+def root(server):
+    officers = server.register.company_officers
+    return max(sorted(officers), key = lambda n: len(officers[n]))
+
+
+def assert_same_network(left, right):
+    (G, df, ct), (G2, df2, ct2) = left, right
+    assert nx.utils.graphs_equal(G, G2)
+    assert sorted(G.edges(data = True), key = repr) == sorted(G2.edges(data = True), key = repr)
+    assert_frame_equal(df.reset_index(drop = True), df2.reset_index(drop = True))
+    assert_frame_equal(ct.reset_index(drop = True), ct2.reset_index(drop = True))
+
+
+def test_resume_gives_the_same_network(server, monkeypatch):
+    number = root(server)
+    whole = build.get_company_network(number, "key", 2, checkpoint = False)
+    assert len(whole[1]) > 0
+
+    calls = [0]
+    get_appointments = build.get_appointments
+    def crash(*args, **kwargs):
+        calls[0] += 1
+        if calls[0] > 20:
+            raise RuntimeError("crash")
+        return get_appointments(*args, **kwargs)
+    monkeypatch.setattr(build, "get_appointments", crash)
+    with pytest.raises(RuntimeError):
+        build.get_company_network(number, "key", 2)
+    monkeypatch.setattr(build, "get_appointments", get_appointments)
+
+    resumed = build.get_company_network(number, "key", 2, resume = True)
+    assert_same_network(whole, resumed)
+
+
+
+
+def test_rebuild_gives_the_same_network(server):
+    number = root(server)
+    whole = build.get_company_network(number, "key", 1)
+    server.reset()
+    rebuilt = build.rebuild_network("{}_1".format(number))
+    assert server.stats()["total"] == 0
+    assert_same_network(whole, rebuilt)
+
+
+def test_crawl_roots():
+    assert crawl_roots("00000006") is None
+    assert crawl_roots(12345678) is None
+    assert crawl_roots(["00000006", 81, "00000006", "81"]) == ["00000006", "81"]
+    with pytest.raises(ValueError):
+        crawl_roots([])
+    assert crawl_id(12345678, 2) == "12345678_2"
+    assert crawl_id(["1", "2"], 2) == crawl_id(("1", 2), 2) != crawl_id(["2", "1"], 2)
+
+
+def test_crawl_from_an_int(server):
+    # A company whose number has no leading zeros, so an int can name it.
+    register = server.register
+    number = root(server)
+    register.companies["12345678"] = dict(register.companies[number], company_number = "12345678")
+    register.company_officers["12345678"] = register.company_officers[number]
+    register.company_pscs["12345678"] = register.company_pscs[number]
+
+    G, df, ct = build.get_company_network(12345678, "key", 1)
+    assert len(df) > 0
+    assert "12345678" in set(ct['company_number'])
+    G2, df2, ct2 = build.get_companies_network([12345678, number], "key", 1)
+    assert len(df2) >= len(df)
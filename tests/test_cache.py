@@ -0,0 +1,89 @@
+import pytest
+
+import chpy.cache
+from chpy.cache import DAY, ResponseCache, endpoint_type, normalize_url
+
+PROFILE = "https://api.company-information.service.gov.uk/company/00000006"
+SEARCH = "https://api.company-information.service.gov.uk/search/officers?q=SMITH&items_per_page=100"
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(chpy.cache, "time", clock)
+    return clock
+
+
+def test_normalize_url():
+    assert normalize_url(SEARCH) == "/search/officers?items_per_page=100&q=SMITH"
+    assert normalize_url(PROFILE + "/") == "/company/00000006"
+
+
+@pytest.mark.parametrize("path, kind", [("/company/1", "profile"),
+                                        ("/company/1/officers", "officers"),
+                                        ("/company/1/persons-with-significant-control", "psc"),
+                                        ("/officers/x/appointments", "appointments"),
+                                        ("/search/officers?q=a", "search"),
+                                        ("/company/1/filing-history", "other")])
+def test_endpoint_type(path, kind):
+    assert endpoint_type("https://host" + path) == kind
+
+
+def test_entries_expire_by_endpoint(clock):
+    cache = ResponseCache(ttls = {"search" : 60})
+    cache.set(PROFILE, 200, {"company_name" : "A"})
+    cache.set(SEARCH, 200, {"total_results" : 1, "items" : [{}]})
+    clock.now += 61
+    assert cache.get(SEARCH) == (False, None)
+    assert cache.get(PROFILE) == (True, {"company_name" : "A"})
+    clock.now += 30 * DAY
+    assert cache.get(PROFILE) == (False, None)
+
+
+def test_negative_responses_use_negative_ttl(clock):
+    cache = ResponseCache(negative_ttl = 10)
+    cache.set(PROFILE, 404, None)
+    cache.set(SEARCH, 200, {"total_results" : 0, "items" : []})
+    assert cache.get(PROFILE) == (True, None)
+    assert cache.get(SEARCH)[0]
+    clock.now += 11
+    assert cache.get(PROFILE) == (False, None)
+    assert cache.get(SEARCH) == (False, None)
+
+
+def test_errors_are_not_cached(clock):
+    cache = ResponseCache()
+    cache.set(PROFILE, 429, None)
+    cache.set(PROFILE, 502, None)
+    assert cache.get(PROFILE) == (False, None)
+
+
+def test_hits_are_copies(clock):
+    cache = ResponseCache()
+    cache.set(PROFILE, 200, {"company_name" : "A"})
+    cache.get(PROFILE)[1]["company_name"] = "B"
+    assert cache.get(PROFILE)[1] == {"company_name" : "A"}
+
+
+def test_disk_tier_and_purge(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path, ttls = {"search" : 60})
+    cache.set(PROFILE, 200, {"company_name" : "A"})
+    cache.set(SEARCH, 200, {"total_results" : 1, "items" : [{}]})
+    cache.close()
+
+    cache = ResponseCache(path, max_items = 1)
+    assert cache.get(PROFILE) == (True, {"company_name" : "A"})
+    assert cache.stats()["disk_hits"] == 1
+    clock.now += 61
+    assert cache.purge_expired() == 1
+    assert cache.stats()["disk_items"] == 1
+    cache.close()
@@ -0,0 +1,24 @@
+from chpy.checkpoint import load_checkpoint, new_crawl_state, save_checkpoint
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "checkpoint" / "crawl.json")
+    state = new_crawl_state("00000006", 2, [{"company_number" : "00000006", "_index" : 0}])
+    state['visited']['companies'].update({"00000006", "00000081"})
+    state['expanded'].update({0, 3})
+    state['written'] = {"edges" : 5, "pscs" : 1, "companies" : 4}
+    state['edge_keys'].add(b"key")
+    state['nodes'].add("A")
+    save_checkpoint(state, path)
+
+    loaded = load_checkpoint(path)
+    assert 'edge_keys' not in loaded and 'nodes' not in loaded
+    expected = dict(state)
+    del expected['edge_keys'], expected['nodes']
+    assert loaded == expected
+    assert list((tmp_path / "checkpoint").iterdir()) == [tmp_path / "checkpoint" / "crawl.json"]
+
+
+def test_missing_checkpoint(tmp_path):
+    assert load_checkpoint(str(tmp_path / "crawl.json")) is None
+
@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+
+from chpy.cache import ResponseCache
+from chpy.cli import main
+import chpy.search as search
+from chpy.mock import MockServer, SyntheticRegister
+
+
+HEAVY = ("pandas", "networkx", "numpy", "rapidfuzz", "fuzzywuzzy", "aiohttp", "pyarrow")
+
+
+def loaded(code):
+    """ The HEAVY modules in sys.modules after running code in a fresh interpreter. """
+    check = "{}\nimport sys\nprint([m for m in {!r} if m in sys.modules])".format(code, HEAVY)
+    out = subprocess.run([sys.executable, "-c", check], check = True,
+                         stdout = subprocess.PIPE, universal_newlines = True).stdout
+    return eval(out)
+
+
+def test_lookups_dont_import_the_heavy_modules():
+    assert loaded("import chpy.cli, chpy.search, chpy.records") == []
+    assert "aiohttp" not in loaded("import chpy.build")
+
+
+def test_cache_stats(tmp_path, capsys):
+    path = str(tmp_path / "cache.sqlite")
+    assert main(["cache", "stats", path]) == 1
+
+    cache = ResponseCache(path)
+    cache.set("/company/00000006", 200, {"company_number" : "00000006"})
+    cache.close()
+    assert main(["cache", "stats", path]) is None
+    assert json.loads(capsys.readouterr().out)["disk_items"] == 1
+
+
+def test_crawl_then_export(monkeypatch, tmp_path, capsys):
+    server = MockServer(register = SyntheticRegister(companies = 20, people = 30, seed = 2),
+                        limit = 10 ** 6, window = 10).start()
+    monkeypatch.setattr(search, "base_url", search.base_url)
+    monkeypatch.chdir(tmp_path)
+    try:
+        number = sorted(server.register.company_officers)[0]
+        main(["crawl", number, "--depth", "1", "--key", "key", "--base-url", server.url, "-q"])
+        assert os.path.exists("data/{0}_1/{0}_1_edge_list.csv".format(number))
+
+        calls = server.stats()["total"]
+        main(["export", "{}_1".format(number), "-f", "graphml", "-q"])
+        assert os.path.exists("data/{0}_1/{0}_1.graphml".format(number))
+        assert server.stats()["total"] == calls
+    finally:
+        server.stop()
+    assert "written to ./data/{}_1/".format(number) in capsys.readouterr().out
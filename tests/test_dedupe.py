@@ -0,0 +1,57 @@
+import random
+
+import pandas as pd
+import pytest
+from fuzzywuzzy import fuzz
+
+from chpy.dedupe import name_clusters, process_name, score_against
+
+NAMES = ["SÉBASTIEN PETER", "SEBASTIEN PETER", "SBASTIEN PETER", "PETER SÉBASTIEN",
+         "Sébastien Peter", "ZOË MÜLLER", "ZO MLLER", "ZOE MULLER", "MÜLLER ZOË",
+         "ŁUKASZ NOWAK", "LUKASZ NOWAK", "UKASZ NOWAK", "José García", "JOSE GARCIA",
+         "JOHN SMITH", "SMITH, JOHN", "John  Smith Ltd", "O'BRIEN SEÁN", "OBRIEN SEAN",
+         "ACME HOLDINGS LIMITED", "ACME HOLDINGS LTD", "ÅCME HOLDINGS LIMITED",
+         "snake_case name", "snake case name"]
+
+
+def fuzz_dict(col, tol):
+    """ utils.fuzz_dict() before name_clusters() replaced it. """
+    count = lambda string: col[col == string].count()
+    test = {}
+    for i in col.unique():
+        for x in col.unique():
+            if i != x:
+                if fuzz.token_set_ratio(i, x) > tol:
+                    if int(count(i)) > int(count(x)):
+                        test[i] = i
+                    else:
+                        test[i] = x
+    return test
+
+
+def test_process_name_drops_accented_letters():
+    assert process_name("SÉBASTIEN PETER") == "sbastien peter"
+    assert process_name("Smith, John ") == "smith  john"
+    assert process_name(None) == ""
+
+
+@pytest.mark.parametrize("tol", [80, 85, 90, 95])
+def test_name_clusters_matches_fuzz_dict(tol):
+    rnd = random.Random(tol)
+    col = pd.Series([rnd.choice(NAMES) for _ in range(200)] + NAMES)
+    assert name_clusters(col, tol) == fuzz_dict(col, tol)
+
+
+def test_name_clusters_with_no_matches():
+    assert name_clusters(pd.Series(["ALPHA", "BETA", "ALPHA"])) == {}
+
+
+def test_score_against_matches_fuzzywuzzy_for_close_names():
+    names = NAMES + ["SEBASTIEN PIETER", "JON SMITH", "1 HIGH STREET LONDON",
+                     "1 High Street, London", "FLAT 1 1 HIGH ST LONDON"]
+    processed = [process_name(n) for n in names]
+    for query, q in zip(names, processed):
+        ours = score_against(q, processed, "token_set_ratio")
+        theirs = [fuzz.token_set_ratio(query, n) for n in names]
+        assert [(a, b) for a, b in zip(ours, theirs) if max(a, b) > 70] == \
+               [(b, b) for a, b in zip(ours, theirs) if max(a, b) > 70]
@@ -0,0 +1,66 @@
+import os
+
+import networkx as nx
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from chpy.export import check_formats, load_tables, write_outputs
+
+
+def network():
+    G = nx.MultiDiGraph()
+    G.add_node("JOHN SMITH", node_type = "Individual", iteration = 0)
+    G.add_node("ACME LIMITED", node_type = "Corporate", iteration = 1)
+    G.add_edge("JOHN SMITH", "ACME LIMITED", officer_role = "director")
+    df = pd.DataFrame({"source" : ["JOHN SMITH"],
+                       "target" : ["ACME LIMITED"],
+                       "appointed_on" : [None]})
+    ct = pd.DataFrame({"company_number" : ["00000006", "00000081"],
+                       "company_name" : ["ACME LIMITED", "ACME HOLDINGS PLC"],
+                       "iteration" : [0, 1],
+                       "done" : [True, None],
+                       # Numbers and strings mixed, which pyarrow can't type.
+                       "sic_codes" : [62012, "70100"]},
+                      index = [3, 7])
+    return G, df, ct
+
+
+def test_check_formats():
+    assert check_formats("csv") == ("csv",)
+    assert check_formats(["parquet", "gexf.gz"]) == ("parquet", "gexf.gz")
+    with pytest.raises(ValueError):
+        check_formats(["csv", "xlsx"])
+
+
+def test_csv_and_graphs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    G, df, ct = network()
+    write_outputs(G, df, ct, "00000006_1", ("csv.gz", "gexf", "graphml.gz"))
+    assert sorted(os.listdir("data/00000006_1")) == ["00000006_1.gexf",
+                                                     "00000006_1.graphml.gz",
+                                                     "00000006_1_companies.csv.gz",
+                                                     "00000006_1_edge_list.csv.gz"]
+
+    edges, companies = load_tables("00000006_1", "csv.gz")
+    assert list(edges["target"]) == ["ACME LIMITED"]
+    assert list(companies["company_number"]) == [6, 81]
+    for path in ("data/00000006_1/00000006_1.gexf", "data/00000006_1/00000006_1.graphml.gz"):
+        read = nx.read_gexf if path.endswith("gexf") else nx.read_graphml
+        assert sorted(read(path).edges()) == [("JOHN SMITH", "ACME LIMITED")]
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_columnar_round_trip(tmp_path, monkeypatch, fmt):
+    pytest.importorskip("pyarrow")
+    monkeypatch.chdir(tmp_path)
+    G, df, ct = network()
+    write_outputs(G, df, ct, "00000006_1", (fmt,))
+
+    edges, companies = load_tables("00000006_1", fmt)
+    assert_frame_equal(edges, df)
+    # Kept as strings, where CSV would lose the leading zeros.
+    assert list(companies["company_number"]) == ["00000006", "00000081"]
+    assert list(companies["iteration"]) == [0, 1]
+    assert list(companies["sic_codes"]) == ["62012", "70100"]
+    assert list(companies.index) == [0, 1]
@@ -0,0 +1,56 @@
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from chpy.frames import FrameBuilder, clean_names, company_frame, flatten_record
+
+ROWS = [{"name" : "A", "appointed_to" : {"company_number" : "1", "company_name" : "X"},
+         "iteration" : 0},
+        {"name" : "B", "appointed_on" : "2001-01-01", "iteration" : 1,
+         "date_of_birth" : {"year" : 1970, "month" : 5}},
+        {"name" : None, "appointed_to" : {"company_number" : "2"}, "resigned_on" : None},
+        {"name" : "D", "iteration" : 2.5, "links" : {"self" : "/x"}, "done" : True},
+        {"name" : "E", "date_of_birth" : {"year" : 1980}}]
+
+
+def build(rows, skip = ()):
+    builder = FrameBuilder()
+    for n, row in enumerate(rows):
+        if n in skip:
+            builder.skip(flatten_record(row))
+        else:
+            builder.add(flatten_record(row))
+    return builder.frame()
+
+
+def test_frame_builder_matches_json_normalize():
+    assert_frame_equal(build(ROWS), pd.json_normalize(ROWS))
+    assert_frame_equal(build(ROWS[1:]), pd.json_normalize(ROWS[1:]))
+
+
+def test_skipped_rows_count_towards_columns_and_dtypes():
+    expected = pd.json_normalize(ROWS).drop(index = [1, 3]).reset_index(drop = True)
+    assert_frame_equal(build(ROWS, skip = (1, 3)).reset_index(drop = True), expected)
+
+
+def test_company_frame_matches_json_normalize():
+    companies = [{"company_number" : "1", "company_name" : "X", "_index" : 0,
+                  "registered_office_address" : {"postal_code" : "AB1"}},
+                 {"company_number" : "2", "company_name" : "Y", "_index" : 1, "done" : True,
+                  "sic_codes" : ["1234"]}]
+    assert_frame_equal(company_frame(companies), pd.json_normalize(companies))
+    assert_frame_equal(company_frame([]), pd.json_normalize([]))
+
+
+def test_tail_columns_go_last():
+    builder = FrameBuilder(tail = ("company_name",))
+    builder.add({"company_name" : "X", "name" : "A"})
+    assert list(builder.frame().columns) == ["name", "company_name"]
+
+
+def test_clean_names():
+    assert clean_names(["Mr John Smith", "Acme LTD", "Dr. J. Smith"]) == \
+           ["JOHN SMITH", "ACME LIMITED", "DR J SMITH"]
+
+
+def test_rows_without_fields():
+    assert_frame_equal(build([{}, {}]), pd.json_normalize([{}, {}]))
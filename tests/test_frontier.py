@@ -0,0 +1,87 @@
+import pytest
+
+import chpy.build as build
+import chpy.search as search
+from chpy.frontier import Budget, get_priority, most_links, active_first, fewest_hops
+from chpy.metrics import emit, get_metrics
+from chpy.mock import MockServer, SyntheticRegister
+
+
+def request():
+    emit("request", endpoint = "company", status = 200, latency = 0.01)
+
+
+def test_get_priority():
+    assert get_priority(None) is fewest_hops
+    assert get_priority("most_links") is most_links
+    assert get_priority(active_first) is active_first
+    with pytest.raises(ValueError):
+        get_priority("biggest_first")
+
+
+def test_priorities():
+    companies = [{"company_number" : "1", "company_status" : "dissolved"},
+                 {"company_number" : "2", "company_status" : "active"}]
+    links = {"1" : 5, "2" : 1}
+    assert sorted(companies, key = lambda c: most_links(c, links))[0]["company_number"] == "1"
+    assert sorted(companies, key = lambda c: active_first(c, links))[0]["company_number"] == "2"
+
+
+def test_budget_counts_its_own_calls():
+    request()
+    budget = Budget(max_calls = 3)
+    budget.start()
+    try:
+        request()
+        get_metrics().reset()
+        request()
+        assert budget.spent(0)["calls"] == 2
+        assert budget.exhausted(budget.spent(0)) is None
+        request()
+        assert budget.exhausted(budget.spent(0)) == "calls"
+    finally:
+        budget.stop()
+    request()
+    assert budget.spent(0)["calls"] == 3
+    budget.stop()
+
+
+def test_budget_carries_on_from_what_was_spent():
+    budget = Budget(max_nodes = 10)
+    budget.start({"calls" : 7, "seconds" : 100.0})
+    try:
+        request()
+        spent = budget.spent(4)
+    finally:
+        budget.stop()
+    assert spent["calls"] == 8
+    assert spent["seconds"] >= 100.0
+    assert budget.exhausted(spent) is None
+    assert budget.exhausted(dict(spent, nodes = 10)) == "nodes"
+
+
+def test_companies_left():
+    budget = Budget(max_calls = 100)
+    assert budget.companies_left({"calls" : 0, "nodes" : 0, "seconds" : 0}, 0, 50) == 1
+    assert budget.companies_left({"calls" : 40, "nodes" : 0, "seconds" : 0}, 4, 50) == 6
+    assert Budget().companies_left({"calls" : 40, "nodes" : 0, "seconds" : 0}, 0, 50) == 50
+
+
+def test_crawl_stops_when_the_budget_is_spent(monkeypatch, tmp_path):
+    server = MockServer(register = SyntheticRegister(companies = 60, people = 90, seed = 3),
+                        limit = 10 ** 6, window = 10).start()
+    monkeypatch.setattr(search, "base_url", server.url)
+    monkeypatch.chdir(tmp_path)
+    try:
+        number = server.register.root()
+        G, df, ct = build.get_company_network(number, "key", 3, output_formats = ())
+        everything = server.stats()["total"]
+
+        server.reset()
+        G, df, ct = build.get_company_network(number, "key", 3, output_formats = (),
+                                              max_calls = 40)
+        calls = server.stats()["total"]
+    finally:
+        server.stop()
+    assert 40 <= calls < everything
+    assert not ct["done"].fillna(False).all()
@@ -0,0 +1,63 @@
+from chpy.identity import IdentityResolver, UnionFind
+
+
+def officer(officer_id, name, dob = None, address = None):
+    return {"name" : name,
+            "query_type" : "officers",
+            "date_of_birth" : dob,
+            "address" : address or {},
+            "links" : {"officer" : {"appointments" : "/officers/{}/appointments".format(officer_id)}}}
+
+
+def test_union_find():
+    people = UnionFind()
+    for item in "abcde":
+        people.add(item)
+    people.union("a", "b")
+    people.union("c", "d")
+    assert people.find("a") == people.find("b")
+    assert people.find("a") != people.find("c")
+    people.union("b", "d")
+    assert len({people.find(i) for i in "abcd"}) == 1
+    assert people.find("e") == "e"
+    assert len(people) == 5 and "e" in people and "f" not in people
+
+
+def test_resolver_joins_names_with_matching_dates_of_birth():
+    resolver = IdentityResolver()
+    dob = {"year" : 1970, "month" : 5}
+    a = resolver.add(officer("A1", "SMITH, John", dob))
+    b = resolver.add(officer("B2", "Mr John SMITH", dob))
+    c = resolver.add(officer("C3", "John SMITH", {"year" : 1981, "month" : 1}))
+    d = resolver.add(officer("D4", "Jane DOE", dob))
+    assert resolver.people.find(a) == resolver.people.find(b)
+    assert resolver.people.find(a) != resolver.people.find(c)
+    assert resolver.people.find(a) != resolver.people.find(d)
+
+
+def test_resolver_needs_addresses_without_dates_of_birth():
+    resolver = IdentityResolver()
+    home = {"premises" : "1", "address_line_1" : "High Street", "locality" : "London"}
+    away = {"premises" : "22", "address_line_1" : "Acacia Avenue", "locality" : "Leeds"}
+    a = resolver.add(officer("A1", "John SMITH", address = home))
+    b = resolver.add(officer("B2", "SMITH John", address = home))
+    c = resolver.add(officer("C3", "John SMITH", address = away))
+    assert resolver.people.find(a) == resolver.people.find(b)
+    assert resolver.people.find(a) != resolver.people.find(c)
+
+
+def test_resolver_only_scores_names_sharing_a_word(monkeypatch):
+    import chpy.identity as identity
+    scored = []
+    score_against = identity.score_against
+    def counting(query, choices, name):
+        scored.append(len(choices))
+        return score_against(query, choices, name)
+    monkeypatch.setattr(identity, "score_against", counting)
+
+    resolver = IdentityResolver()
+    for i in range(50):
+        resolver.add(officer("X{}".format(i), "Person{} Number{}".format(i, i)))
+    assert sum(scored) == 0
+    resolver.add(officer("Y", "Person7 Number7"))
+    assert scored == [1, 1]
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from chpy.keys import KeyPool
+from chpy.transport import retry_on_another_key
+
+
+class Response(object):
+    def __init__(self, status_code, headers = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_needs_a_key():
+    with pytest.raises(ValueError):
+        KeyPool([])
+
+
+def test_duplicate_keys_are_dropped():
+    assert KeyPool(["a", "b", "a"]).keys == ["a", "b"]
+    assert KeyPool("a").keys == ["a"]
+
+
+def test_chooses_the_key_with_most_left():
+    pool = KeyPool(["a", "b"])
+    pool.update("a", Response(200, {"X-Ratelimit-Remain" : "5",
+                                    "X-Ratelimit-Reset" : str(time.time() + 100)}))
+    assert pool.choose() == ("b", 0.0)
+
+
+def test_401_retires_a_key_while_there_are_others():
+    pool = KeyPool(["a", "b"])
+    response = Response(401)
+    pool.update("a", response)
+    assert "a" in pool.retired
+    assert pool.active() == ["b"]
+    assert retry_on_another_key(pool, "a", response)
+
+
+def test_401_never_retires_the_last_key():
+    pool = KeyPool(["a", "b"])
+    pool.update("a", Response(401))
+    pool.update("b", Response(401))
+    assert list(pool.retired) == ["a"]
+    assert pool.choose() == ("b", 0.0)
+    assert not retry_on_another_key(pool, "b", Response(401))
+
+    single = KeyPool("a")
+    single.update("a", Response(401))
+    assert not single.retired
+    assert single.choose() == ("a", 0.0)
+
+
+def test_429_benches_a_key_until_its_window_resets():
+    pool = KeyPool(["a", "b"])
+    response = Response(429, {"X-Ratelimit-Reset" : str(time.time() + 60)})
+    pool.update("a", response)
+    assert pool.active() == ["b"]
+    assert retry_on_another_key(pool, "a", response)
+
+    pool.update("b", Response(429, {"X-Ratelimit-Reset" : str(time.time() + 30)}))
+    key, wait = pool.choose()
+    assert key == "b" and wait == pytest.approx(30, abs = 1)
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chpy.memo import RequestMemo, crawl_memo
+from chpy.transport import Transport
+
+
+URL = "http://api/company/00000006?b=2&a=1"
+
+
+def test_calls_in_flight_are_shared():
+    memo = RequestMemo()
+    calls = []
+    release = threading.Event()
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return 200, {"company_number" : "00000006"}
+
+    with ThreadPoolExecutor(max_workers = 4) as pool:
+        futures = [pool.submit(memo.get, URL, fetch) for _ in range(4)]
+        while memo.stats()["misses"] == 0:
+            pass
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert len(calls) == 1
+    assert results == [{"company_number" : "00000006"}] * 4
+    assert memo.stats()["shared"] + memo.stats()["hits"] == 3
+    # Each caller gets a copy of its own.
+    results[0]["company_number"] = None
+    assert memo.get("http://api/company/00000006?a=1&b=2", fetch) == {"company_number" : "00000006"}
+
+
+def test_async_calls_in_flight_are_shared():
+    memo = RequestMemo()
+    calls = []
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 404, None
+
+    async def go():
+        return await asyncio.gather(*[memo.aget(URL, fetch) for _ in range(3)])
+
+    assert asyncio.run(go()) == [None] * 3
+    assert len(calls) == 1
+    assert memo.stats()["shared"] == 2
+
+
+def test_failures_are_tried_again():
+    memo = RequestMemo()
+    answers = [(502, None), (200, {"items" : []})]
+    assert memo.get(URL, lambda: answers.pop(0)) is None
+    assert memo.get(URL, lambda: answers.pop(0)) == {"items" : []}
+    assert memo.stats()["misses"] == 2
+
+
+def test_least_recently_used_answers_are_dropped():
+    memo = RequestMemo(max_items = 2)
+    fetched = []
+    def fetch(n):
+        def run():
+            fetched.append(n)
+            return 200, {"n" : n}
+        return run
+
+    for n in (1, 2):
+        memo.get("http://api/company/{}".format(n), fetch(n))
+    memo.get("http://api/company/1", fetch(1))
+    memo.get("http://api/company/3", fetch(3))
+    memo.get("http://api/company/1", fetch(1))
+    memo.get("http://api/company/2", fetch(2))
+    assert fetched == [1, 2, 3, 2]
+    assert memo.stats()["items"] == 2
+
+
+def test_crawl_memo():
+    transport = Transport()
+    with crawl_memo(transport) as memo:
+        assert transport.memo is memo
+        with crawl_memo(transport) as inner:
+            assert inner is memo
+    assert transport.memo is None
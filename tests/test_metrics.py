@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import chpy.build as build
+import chpy.search as search
+from chpy.metrics import Metrics, emit, endpoint_name, set_metrics
+from chpy.mock import MockServer, SyntheticRegister
+
+
+@pytest.fixture
+def metrics():
+    """ A fresh Metrics, swapped in for the shared one. """
+    metrics = Metrics()
+    previous = set_metrics(metrics)
+    yield metrics
+    set_metrics(previous)
+
+
+def test_endpoint_name():
+    assert endpoint_name("https://api/company/00000006/officers?start_index=0") == "/company/{}/officers"
+    assert endpoint_name("https://api/officers/abc-123/appointments") == "/officers/{}/appointments"
+    assert endpoint_name("https://api/search/officers?q=JOHN") == "/search/officers"
+
+
+def test_totals(metrics):
+    emit("request", endpoint = "/company/{}", status = 200, latency = 0.03)
+    emit("request", endpoint = "/company/{}", status = 502, latency = 0.3)
+    emit("retry", endpoint = "/company/{}", status = 502, wait = 0.5)
+    emit("rate_limit_wait", seconds = 2.0)
+    emit("lookup", source = "cache", endpoint = "/company/{}", hit = True)
+    emit("lookup", source = "cache", endpoint = "/company/{}", hit = False)
+    emit("edges", accepted = 3, rejected = 1)
+
+    snapshot = metrics.snapshot()
+    assert metrics.calls() == 2
+    assert snapshot.requests == {"/company/{}" : 2}
+    assert snapshot.statuses == {"/company/{}" : {200 : 1, 502 : 1}}
+    latency = snapshot.latency["/company/{}"]
+    assert latency["buckets"]["0.05"] == 1 and latency["buckets"]["0.5"] == 1
+    assert latency["mean"] == pytest.approx(0.165)
+    assert snapshot.retries == {"/company/{}" : 1}
+    assert snapshot.backoff_wait == 0.5
+    assert snapshot.rate_limit_wait == {"seconds" : 2.0, "waits" : 1}
+    assert snapshot.lookups["cache"]["hit_rate"] == 0.5
+    assert snapshot.edges == {"accepted" : 3, "rejected" : 1}
+    json.dumps(snapshot._asdict())
+
+    metrics.reset()
+    assert metrics.calls() == 0
+    assert metrics.snapshot().requests == {}
+
+
+def test_callbacks(metrics):
+    seen = []
+    def broken(event, fields):
+        raise RuntimeError("shouldn't stop anything")
+    metrics.add_callback(broken)
+    callback = metrics.add_callback(lambda event, fields: seen.append((event, fields)))
+
+    emit("frontier", depth = 0, size = 5)
+    metrics.remove_callback(callback)
+    emit("frontier", depth = 1, size = 9)
+    assert seen == [("frontier", {"depth" : 0, "size" : 5})]
+    assert metrics.snapshot().frontier == {0 : 5, 1 : 9}
+
+
+def test_a_crawl_reports_its_calls(metrics, monkeypatch, tmp_path):
+    server = MockServer(register = SyntheticRegister(companies = 20, people = 30, seed = 5),
+                        limit = 10 ** 6, window = 10).start()
+    monkeypatch.setattr(search, "base_url", server.url)
+    monkeypatch.chdir(tmp_path)
+    events = []
+    metrics.add_callback(lambda event, fields: events.append(event))
+    try:
+        build.get_company_network(server.root(), "key", 2, output_formats = ())
+        calls = server.stats()["total"]
+    finally:
+        server.stop()
+
+    snapshot = metrics.snapshot()
+    assert metrics.calls() == calls == events.count("request")
+    assert snapshot.requests["/company/{}"] > 0
+    assert sorted(snapshot.frontier) == [0, 1]
+    assert snapshot.lookups["memo"]["hits"] > 0
+    assert snapshot.edges["accepted"] > 0
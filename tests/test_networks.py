@@ -0,0 +1,22 @@
+import networkx as nx
+import pandas as pd
+
+from chpy.networks import root_provenance
+
+
+def test_root_provenance():
+    # Two roots' networks, joined through officer B, ignoring direction.
+    G = nx.DiGraph([("A", "ROOT ONE"), ("B", "ROOT ONE"), ("B", "ROOT TWO"),
+                    ("B", "OTHER"), ("C", "OTHER"), ("C", "FAR")])
+    ct = pd.DataFrame({"company_number" : ["1", "2", "3", "4", "5"],
+                       "company_name" : ["ROOT ONE", "ROOT TWO", "OTHER", "FAR", float("nan")]})
+    reached = root_provenance(G, ct, ["1", "2", "5"], depth = 1)
+    assert reached == {"ROOT ONE" : "1;2", "A" : "1", "B" : "1;2", "ROOT TWO" : "1;2",
+                       "OTHER" : "1;2"}
+    assert root_provenance(G, ct, ["2", "1"], depth = 2)["FAR"] == "2;1"
+
+
+def test_root_provenance_of_a_root_with_no_edges():
+    G = nx.DiGraph([("A", "ROOT ONE")])
+    ct = pd.DataFrame({"company_number" : ["1", "2"], "company_name" : ["ROOT ONE", "LONE"]})
+    assert root_provenance(G, ct, ["2"], depth = 1) == {"LONE" : "2"}
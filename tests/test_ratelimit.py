@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from chpy.ratelimit import RateLimiter, parse_window
+
+
+@pytest.mark.parametrize("value, seconds", [("5m", 300), ("300s", 300), ("300", 300),
+                                            ("1h", 3600), ("soon", None)])
+def test_parse_window(value, seconds):
+    assert parse_window(value) == seconds
+
+
+def test_burst_then_even_pace():
+    limiter = RateLimiter(limit = 600, window = 300, burst = 10)
+    assert [limiter.reserve() for _ in range(10)] == [0.0] * 10
+    # Each call past the burst waits another 1 / rate = 0.5 seconds.
+    assert limiter.reserve() == pytest.approx(0.5, abs = 0.01)
+    assert limiter.reserve() == pytest.approx(1.0, abs = 0.01)
+    assert limiter.stats()["waits"] == 2
+
+
+def test_update_slows_to_what_the_server_says_is_left():
+    limiter = RateLimiter(limit = 600, window = 300)
+    limiter.update({"X-Ratelimit-Remain" : "10",
+                    "X-Ratelimit-Reset" : str(time.time() + 100),
+                    "X-Ratelimit-Limit" : "600",
+                    "X-Ratelimit-Window" : "5m"})
+    assert limiter.rate == pytest.approx(0.1, rel = 0.05)
+    assert limiter.available() == 10
+
+
+def test_update_holds_calls_until_the_window_resets():
+    limiter = RateLimiter(limit = 600, window = 300)
+    limiter.update({"X-Ratelimit-Remain" : "0",
+                    "X-Ratelimit-Reset" : str(time.time() + 30)})
+    assert limiter.reserve() == pytest.approx(30, abs = 1)
+
+
+def test_update_ignores_responses_without_headers():
+    limiter = RateLimiter()
+    limiter.update({})
+    assert limiter.reserve() == 0.0
@@ -0,0 +1,48 @@
+import pytest
+
+from chpy.records import CompanyProfile, Officer, dumps, from_response, loads
+
+OFFICERS = "https://api.company-information.service.gov.uk/company/00000006/officers"
+
+
+def test_record_keeps_only_its_fields():
+    profile = CompanyProfile({"company_name" : "X", "company_number" : "1",
+                              "accounts" : {"next_due" : "2020-01-01"},
+                              "links" : {"self" : "/company/1", "filing_history" : "/f"}})
+    assert profile.to_dict() == {"company_name" : "X", "company_number" : "1",
+                                 "links" : {"self" : "/company/1"}}
+    assert "accounts" not in profile
+    assert profile.get("accounts") is None
+    with pytest.raises(KeyError):
+        profile["accounts"]
+
+
+def test_record_behaves_like_a_dict():
+    profile = CompanyProfile({"company_name" : "X"})
+    profile["done"] = True
+    assert dict(profile) == {"company_name" : "X", "done" : True}
+    assert len(profile) == 2
+    del profile["done"]
+    assert "done" not in profile
+    with pytest.raises(KeyError):
+        profile["accounts"] = {}
+
+
+def test_from_response_makes_records_of_list_items():
+    data = {"total_results" : 1,
+            "items" : [{"name" : "SMITH, John", "officer_role" : "director", "etag" : "x",
+                        "links" : {"officer" : {"appointments" : "/officers/a/appointments"}}}]}
+    out = from_response(OFFICERS, data)
+    item, = out["items"]
+    assert isinstance(item, Officer)
+    assert out["total_results"] == 1
+    assert dict(item) == {"officer_role" : "director", "name" : "SMITH, John",
+                          "links" : {"officer" : {"appointments" : "/officers/a/appointments"}}}
+    assert from_response(OFFICERS, out)["items"][0] is item
+    assert from_response("https://host/company/1/filing-history", data) is data
+
+
+def test_dumps_and_loads_round_trip_records():
+    profile = CompanyProfile({"company_name" : "X", "sic_codes" : ["1234"]})
+    assert loads(dumps({"items" : [profile]})) == {"items" : [profile.to_dict()]}
+    assert loads(dumps(profile).encode()) == profile.to_dict()
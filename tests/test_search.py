@@ -0,0 +1,45 @@
+from fuzzywuzzy import fuzz
+
+from chpy.search import mark_appointments, search_filter
+
+NAMES = ["SMITH, John", "John SMITH", "SMITH, Jon", "SMYTH, John Paul", "SMITH, Jane",
+         "SÉBASTIEN, Peter", "SEBASTIEN, Peter", "JONES, Mary", ""]
+
+
+def appointment(name, number):
+    return {"name" : name,
+            "appointed_to" : {"company_name" : "COMPANY {}".format(number),
+                              "company_number" : number}}
+
+
+def test_mark_appointments_keeps_names_as_token_sort_ratio_does():
+    items = [appointment(n, str(k)) for k, n in enumerate(NAMES)]
+    for name in NAMES[:-1]:
+        out = []
+        mark_appointments([{"items" : items}], out, name = name)
+        assert [a['name'] for a in out] == \
+               [n for n in NAMES if fuzz.token_sort_ratio(name, n) >= 90]
+        assert all(a['source'] == a['name'] and a['target'].startswith("COMPANY ") for a in out)
+
+
+def test_mark_appointments_without_a_name_keeps_everything():
+    out = []
+    mark_appointments([{"items" : [appointment(n, "1") for n in NAMES]}], out, iteration = 2)
+    assert len(out) == len(NAMES)
+    assert {a['iteration'] for a in out} == {2}
+
+
+def test_search_filter():
+    record = {"name" : "SMITH, John",
+              "address" : {"premises" : "1", "address_line_1" : "High Street"},
+              "date_of_birth" : {"year" : 1970, "month" : 5}}
+    hits = {"items" : [{"title" : "John SMITH", "address" : {"a" : "1 High Street"}},
+                       {"title" : "John SMITH", "address" : {"a" : "22 Acacia Avenue"},
+                        "date_of_birth" : {"year" : 1970, "month" : 5}},
+                       {"title" : "John SMITH", "address" : {"a" : "22 Acacia Avenue"}},
+                       {"title" : "Jane DOE", "address" : {"a" : "1 High Street"}}]}
+    assert search_filter(hits, record) == hits["items"][:2]
+    scored = search_filter(hits, record, scores = True)
+    first, second = [s for _, s in scored]
+    assert first == {"name" : 100, "address" : 100, "date_of_birth" : False}
+    assert second["name"] == 100 and second["address"] < 90 and second["date_of_birth"]
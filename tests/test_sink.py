@@ -0,0 +1,65 @@
+import pytest
+
+from chpy.sink import CrawlSink, StreamReader, read_stream
+
+
+def test_sink_is_cut_back_to_the_checkpoint(tmp_path):
+    directory = str(tmp_path)
+    sink = CrawlSink(directory, chunk_lines = 2)
+    for n in range(5):
+        sink.add("edges", {"n" : n})
+    sink.close()
+    counts = dict(sink.counts)
+
+    sink = CrawlSink(directory, counts = {"edges" : 3}, chunk_lines = 2)
+    assert list(sink.read("edges")) == [{"n" : 0}, {"n" : 1}, {"n" : 2}]
+    sink.add("edges", {"n" : 9})
+    sink.close()
+    assert [i["n"] for i in read_stream(directory, "edges")] == [0, 1, 2, 9]
+    assert counts["edges"] == 5
+
+
+
+def test_chunks_and_reading_up_to_a_count(tmp_path):
+    directory = str(tmp_path)
+    sink = CrawlSink(directory, chunk_lines = 2)
+    assert [sink.add("pscs", {"n" : n}) for n in range(5)] == [0, 1, 2, 3, 4]
+    sink.flush()
+    assert sorted(p.name for p in tmp_path.iterdir()) == \
+           ["pscs-00000.jsonl", "pscs-00001.jsonl", "pscs-00002.jsonl"]
+    assert [i["n"] for i in read_stream(directory, "pscs", 3)] == [0, 1, 2]
+    sink.close()
+
+
+def test_half_written_lines_are_skipped(tmp_path):
+    directory = str(tmp_path)
+    sink = CrawlSink(directory)
+    sink.add("edges", {"n" : 0})
+    sink.close()
+    with open(str(tmp_path / "edges-00000.jsonl"), "a") as f:
+        f.write('{"n" : 1')
+    assert list(read_stream(directory, "edges")) == [{"n" : 0}]
+
+
+def test_checkpoint_ahead_of_the_streams(tmp_path):
+    sink = CrawlSink(str(tmp_path))
+    sink.add("edges", {"n" : 0})
+    sink.close()
+    with pytest.raises(ValueError):
+        CrawlSink(str(tmp_path), counts = {"edges" : 2})
+
+
+
+
+def test_stream_reader_leaves_the_streams_alone(tmp_path):
+    directory = str(tmp_path)
+    sink = CrawlSink(directory)
+    for n in range(4):
+        sink.add("companies", {"n" : n})
+    sink.close()
+
+    reader = StreamReader(directory, {"companies" : 2}, [1])
+    assert list(reader.read("companies")) == [{"n" : 0}, {"n" : 1}]
+    assert list(reader.read("edges")) == []
+    assert reader.expanded == {1}
+    assert len(list(read_stream(directory, "companies"))) == 4
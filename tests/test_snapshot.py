@@ -0,0 +1,116 @@
+import json
+import zipfile
+
+import chpy.search as search
+from chpy.search import get_appointments, get_company, get_company_search
+from chpy.snapshot import SnapshotStore, import_company_data, import_psc_data
+from chpy.transport import Transport
+
+
+BASIC_COMPANY_DATA = (
+    'CompanyName, CompanyNumber,RegAddress.AddressLine1,RegAddress.PostTown,'
+    'CompanyCategory,CompanyStatus,IncorporationDate,SICCode.SicText_1,'
+    'PreviousName_1.CONDATE, PreviousName_1.CompanyName\n'
+    '"ACME LTD",00000006,1 HIGH STREET,LONDON,Private Limited Company,Active,'
+    '01/02/2003,62012 - Business and domestic software development,'
+    '04/05/2006,OLD ACME LIMITED\n'
+    '"ACME LIMITED",00000081,2 HIGH STREET,LEEDS,Public Limited Company,'
+    'Active - Proposal to Strike off,31/12/1999,None Supplied,,\n')
+
+
+def test_import_company_data(tmp_path):
+    path = tmp_path / "BasicCompanyData.zip"
+    with zipfile.ZipFile(str(path), "w") as z:
+        z.writestr("BasicCompanyData.csv", BASIC_COMPANY_DATA)
+    store = import_company_data(str(path), str(tmp_path / "snapshot.sqlite"))
+
+    acme = store.company("00000006")
+    assert acme["company_name"] == "ACME LTD"
+    assert acme["company_status"] == "active"
+    assert acme["type"] == "ltd"
+    assert acme["date_of_creation"] == "2003-02-01"
+    assert acme["sic_codes"] == ["62012"]
+    assert acme["registered_office_address"] == {"address_line_1" : "1 HIGH STREET",
+                                                 "locality" : "LONDON"}
+    assert acme["previous_company_names"] == [{"name" : "OLD ACME LIMITED",
+                                               "ceased_on" : "2006-05-04"}]
+    assert "sic_codes" not in store.company("00000081")
+    assert store.company("00000140") is None
+    assert store.stats()["company_data"] == "BasicCompanyData.zip"
+
+
+def test_lookups_come_from_the_snapshot(tmp_path, monkeypatch):
+    path = tmp_path / "BasicCompanyData.csv"
+    path.write_text(BASIC_COMPANY_DATA)
+    store = import_company_data(str(path), str(tmp_path / "snapshot.sqlite"))
+    transport = Transport(snapshot = store)
+    # Nothing's listening here, so anything not in the snapshot fails.
+    monkeypatch.setattr(search, "base_url", "http://127.0.0.1:9")
+
+    company = get_company("00000006", "profile", "key", iteration = 1, transport = transport)
+    assert company["company_name"] == "ACME LTD"
+    # "Ltd" and "Limited" are the same name.
+    found = get_company_search("Acme Ltd.", "key", transport = transport)
+    assert [i["company_number"] for i in found["items"]] == ["00000006", "00000081"]
+    assert store.stats()["hits"] == 2
+
+
+def profile(number, name):
+    return {"company_name" : name,
+            "company_number" : number,
+            "company_status" : "active",
+            "type" : "ltd",
+            "registered_office_address" : {},
+            "links" : {"self" : "/company/{}".format(number)}}
+
+
+def psc(number, forename, surname, year = 1970):
+    return {"company_number" : number,
+            "data" : {"kind" : "individual-person-with-significant-control",
+                      "name" : "Mr {} {}".format(forename, surname),
+                      "name_elements" : {"forename" : forename, "surname" : surname},
+                      "date_of_birth" : {"month" : 1, "year" : year},
+                      "natures_of_control" : ["ownership-of-shares-75-to-100-percent"],
+                      "links" : {"self" : "/company/{}/persons-with-significant-control/"
+                                          "individual/{}".format(number, surname.lower())}}}
+
+
+def psc_store(tmp_path):
+    lines = [psc("00000001", "John", "Smith"),
+             psc("00000002", "John", "Smith"),
+             psc("00000003", "John", "Smith", year = 1980),
+             {"company_number" : "00000004",
+              "data" : {"kind" : "persons-with-significant-control-statement"}},
+             {"totals" : {"persons-with-significant-control-count" : 3}}]
+    path = tmp_path / "psc.txt"
+    path.write_text("\n".join(json.dumps(line) for line in lines))
+
+    store = SnapshotStore(str(tmp_path / "snapshot.sqlite"))
+    store.add_companies([profile("00000001", "ONE LIMITED"),
+                         profile("00000002", "TWO LIMITED"),
+                         profile("00000003", "THREE LIMITED")])
+    return import_psc_data(str(path), store)
+
+
+def test_psc_lists_come_from_the_snapshot(tmp_path, monkeypatch):
+    store = psc_store(tmp_path)
+    transport = Transport(snapshot = store)
+    monkeypatch.setattr(search, "base_url", "http://127.0.0.1:9")
+
+    pscs = get_company("00000001", "psc", "key", transport = transport)
+    assert [p["name"] for p in pscs["items"]] == ["Mr John Smith"]
+    # Statements only: no PSCs, without asking the API.
+    assert get_company("00000004", "psc", "key", transport = transport) is None
+    assert store.stats()["misses"] == 0
+
+
+def test_psc_appointments_use_the_transport_given(tmp_path, monkeypatch):
+    transport = Transport(snapshot = psc_store(tmp_path))
+    node = dict(psc("00000001", "John", "Smith")["data"], query_type = "psc")
+    def shared():
+        raise AssertionError("used the shared Transport")
+    monkeypatch.setattr(search, "get_transport", shared)
+
+    edges = get_appointments(node, "key", transport = transport)
+    # Not the psc's own company, nor the John Smith born in 1980.
+    assert [(e["source"], e["target"]) for e in edges] == [("Mr John Smith", "TWO LIMITED")]
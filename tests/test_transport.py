@@ -0,0 +1,66 @@
+import pytest
+import requests
+
+from chpy.ratelimit import RateLimiter
+from chpy.transport import Transport
+
+
+class Response(object):
+    def __init__(self, status_code, headers = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class Session(object):
+    """ Answers each get() with the next outcome: a status code or an exception. """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, auth, timeout):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Response(outcome)
+
+
+def transport(outcomes, max_retries = 5):
+    transport = Transport(max_retries = max_retries, backoff = 0,
+                          limiter = RateLimiter(limit = 10 ** 6, window = 1, burst = 100))
+    transport.session = Session(outcomes)
+    return transport
+
+
+@pytest.mark.parametrize("error", [requests.ConnectionError(),
+                                   requests.Timeout(),
+                                   requests.exceptions.ChunkedEncodingError(),
+                                   requests.exceptions.ContentDecodingError()])
+def test_transport_failures_are_retried(error):
+    t = transport([error, 200])
+    assert t.get("http://host/company/1", "key").status_code == 200
+    assert t.session.calls == 2
+
+
+def test_retryable_statuses_are_retried():
+    t = transport([502, 503, 200])
+    assert t.get("http://host/company/1", "key").status_code == 200
+    assert t.session.calls == 3
+
+
+def test_other_statuses_are_returned():
+    t = transport([404, 200])
+    assert t.get("http://host/company/1", "key").status_code == 404
+
+
+def test_gives_up_after_max_retries():
+    t = transport([requests.exceptions.ChunkedEncodingError()] * 3, max_retries = 2)
+    assert t.get("http://host/company/1", "key") is None
+    assert t.session.calls == 3
+
+
+def test_other_errors_are_raised():
+    t = transport([requests.exceptions.InvalidURL()])
+    with pytest.raises(requests.exceptions.InvalidURL):
+        t.get("http://host/company/1", "key")
@@ -0,0 +1,16 @@
+from chpy.records import Appointment
+from chpy.utils import edge_key
+
+
+def test_edge_key_matches_equality():
+    a = {"name" : "A", "target" : "X", "appointed_to" : {"company_number" : "1"}}
+    b = {"target" : "X", "appointed_to" : {"company_number" : "1"}, "name" : "A"}
+    c = dict(a, name = "B")
+    assert edge_key(a) == edge_key(b)
+    assert edge_key(a) != edge_key(c)
+    assert len({edge_key(i) for i in (a, b, c)}) == 2
+
+
+def test_edge_key_of_a_record_is_that_of_its_dict():
+    record = Appointment({"name" : "A", "officer_role" : "director"})
+    assert edge_key(record) == edge_key({"name" : "A", "officer_role" : "director"})